@@ -0,0 +1,218 @@
+"""Compare how many slow downloads a WSGI and an ASGI deployment keep in flight.
+
+Run both deployments of the same checkout on the same machine (see
+benchmarks/README.md), create a user, then:
+
+    python benchmarks/asgi_vs_wsgi.py --username bench --password secret \
+        --target wsgi=http://127.0.0.1:8001 --target asgi=http://127.0.0.1:8002
+
+For each target a test file is uploaded (unless --file-id is given), --clients
+concurrent downloads are opened that each read at most --rate bytes per second,
+and while they run small probe requests (a one byte range of the same file) are
+timed. A deployment that ties a thread to every slow client stops answering the
+probes once its threads are used up; one that does not keeps answering them.
+
+Only the standard library is used, so the script runs from any Python 3.9+.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+
+class Target:
+    def __init__(self, name, url):
+        parts = urlsplit(url)
+        self.name = name
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.cookies = {}
+
+    def cookie_header(self):
+        return '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+
+
+async def open_request(target, method, path, headers=None, body=b''):
+    """Send a request and return (reader, writer, status, headers) once the head has arrived."""
+    reader, writer = await asyncio.open_connection(target.host, target.port)
+    lines = [f'{method} {path} HTTP/1.1', f'Host: {target.host}:{target.port}', 'Connection: close']
+    if target.cookies:
+        lines.append(f'Cookie: {target.cookie_header()}')
+    for name, value in (headers or {}).items():
+        lines.append(f'{name}: {value}')
+    lines.append(f'Content-Length: {len(body)}')
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    response_headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        name, value = name.strip().lower(), value.strip()
+        if name == 'set-cookie':
+            cookie = SimpleCookie(value)
+            for key, morsel in cookie.items():
+                target.cookies[key] = morsel.value
+        response_headers[name] = value
+    return reader, writer, status, response_headers
+
+
+async def request(target, method, path, headers=None, body=b''):
+    reader, writer, status, response_headers = await open_request(target, method, path, headers, body)
+    data = await reader.read()
+    writer.close()
+    return status, response_headers, data
+
+
+def form(data):
+    return {'Content-Type': 'application/x-www-form-urlencoded'}, urlencode(data).encode()
+
+
+def csrf(target):
+    return {'X-CSRFToken': target.cookies.get('csrftoken', '')}
+
+
+async def login(target, username, password):
+    await request(target, 'GET', '/accounts/login/')
+    headers, body = form({
+        'username': username, 'password': password, 'csrfmiddlewaretoken': target.cookies.get('csrftoken', ''),
+    })
+    status, _, _ = await request(target, 'POST', '/accounts/login/', headers, body)
+    if 'sessionid' not in target.cookies:
+        raise SystemExit(f'{target.name}: login failed (HTTP {status}).')
+
+
+async def upload(target, size):
+    data = os.urandom(size)
+    headers, body = form({'name': f'bench-{uuid.uuid4().hex[:8]}.bin', 'size': size})
+    status, _, payload = await request(target, 'POST', '/storage/api/uploads/', {**headers, **csrf(target)}, body)
+    if status != 201:
+        raise SystemExit(f'{target.name}: could not start upload (HTTP {status}): {payload[:200]!r}')
+    session = json.loads(payload)
+    chunk_size = session['chunk_size']
+    for index in range(session['chunk_count']):
+        start = index * chunk_size
+        chunk = data[start:start + chunk_size]
+        headers = {
+            **csrf(target),
+            'Content-Type': 'application/octet-stream',
+            'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{size}',
+        }
+        await request(target, 'PUT', f'/storage/api/uploads/{session["upload_id"]}/chunks/{index}/', headers, chunk)
+    status, _, payload = await request(
+        target, 'POST', f'/storage/api/uploads/{session["upload_id"]}/finalize/', csrf(target))
+    return json.loads(payload)['file_id']
+
+
+async def slow_download(target, file_id, rate, deadline, results):
+    started = time.monotonic()
+    try:
+        reader, writer, status, _ = await asyncio.wait_for(
+            open_request(target, 'GET', f'/storage/download/{file_id}/'), deadline - started)
+    except (asyncio.TimeoutError, OSError):
+        results.append({'ok': False})
+        return
+    results.append({'ok': status == 200, 'ttfb': time.monotonic() - started})
+    piece = 16 * 1024
+    try:
+        while time.monotonic() < deadline:
+            if not await reader.read(piece):
+                break
+            await asyncio.sleep(piece / rate)
+    finally:
+        writer.close()
+
+
+async def probe(target, file_id, deadline, timeout, latencies):
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            status, _, _ = await asyncio.wait_for(
+                request(target, 'GET', f'/storage/download/{file_id}/', {'Range': 'bytes=0-0'}), timeout)
+            latencies.append(time.monotonic() - started if status == 206 else None)
+        except (asyncio.TimeoutError, OSError):
+            latencies.append(None)
+        await asyncio.sleep(0.25)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_target(target, args):
+    await login(target, args.username, args.password)
+    file_id = args.file_id or await upload(target, args.size)
+    deadline = time.monotonic() + args.duration
+    downloads, latencies = [], []
+    tasks = [
+        asyncio.create_task(slow_download(target, file_id, args.rate, deadline, downloads))
+        for _ in range(args.clients)
+    ]
+    # Give the slow clients a moment to occupy the server before probing.
+    await asyncio.sleep(min(2, args.duration / 4))
+    tasks.append(asyncio.create_task(probe(target, file_id, deadline, args.probe_timeout, latencies)))
+    await asyncio.gather(*tasks)
+    ttfb = [d['ttfb'] for d in downloads if d['ok']]
+    answered = [latency for latency in latencies if latency is not None]
+    return {
+        'target': target.name,
+        'clients': args.clients,
+        'downloads_started': len(ttfb),
+        'ttfb_p50': percentile(ttfb, 0.5),
+        'ttfb_p95': percentile(ttfb, 0.95),
+        'probes': len(latencies),
+        'probes_failed': len(latencies) - len(answered),
+        'probe_p50': percentile(answered, 0.5),
+        'probe_p95': percentile(answered, 0.95),
+        'probe_mean': statistics.mean(answered) if answered else None,
+    }
+
+
+def format_seconds(value):
+    return '-' if value is None else f'{value * 1000:.0f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--target', action='append', required=True, metavar='NAME=URL',
+                        help='Deployment to measure; repeat for each one.')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--file-id', type=int, help='Existing file to download instead of uploading one.')
+    parser.add_argument('--size', type=int, default=64 * 1024 * 1024, help='Size of the uploaded test file.')
+    parser.add_argument('--clients', type=int, default=500, help='Concurrent slow downloads.')
+    parser.add_argument('--rate', type=int, default=64 * 1024, help='Bytes per second each client reads.')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to keep the downloads open.')
+    parser.add_argument('--probe-timeout', type=float, default=5, help='Seconds before a probe counts as failed.')
+    parser.add_argument('--json', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    results = []
+    for spec in args.target:
+        name, _, url = spec.partition('=')
+        results.append(asyncio.run(run_target(Target(name, url), args)))
+
+    print(f'{"target":<10} {"started":>9} {"ttfb p50":>9} {"ttfb p95":>9} {"probes ok":>10} {"probe p50":>10} {"probe p95":>10}')
+    for r in results:
+        print(f'{r["target"]:<10} {r["downloads_started"]:>4}/{r["clients"]:<4} '
+              f'{format_seconds(r["ttfb_p50"]):>9} {format_seconds(r["ttfb_p95"]):>9} '
+              f'{r["probes"] - r["probes_failed"]:>4}/{r["probes"]:<5} '
+              f'{format_seconds(r["probe_p50"]):>10} {format_seconds(r["probe_p95"]):>10}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Throughput of CR-Drive's encryption and transfer pipeline, in-process.
+
+Unlike the other scripts here this one imports the project (run it with the
+project's virtualenv and .env; see benchmarks/README.md):
+
+    python benchmarks/crypto_throughput.py --sizes 1K,1M,64M --runs 5 --json crypto.json
+
+Operations:
+
+  fernet-encrypt, fernet-decrypt   the legacy whole-file Fernet format (still readable)
+  encrypt, decrypt                 storage.encryption.encrypt_file / decrypt_file, in memory
+  upload                           a multipart POST to DriveView, encrypted to disk by the upload handler
+  download                         DownloadFileView streaming the file back, including disk reads
+
+The segmented operations run in two modes: `serial` on the request thread
+(CRYPTO_POOL_WORKERS=0) and `pool` on the crypto worker pool for every size
+(CRYPTO_POOL_MIN_SIZE=0), which shows where the pool starts to pay off.
+
+Like pyperf, every (operation, mode, size) runs in a fresh worker process: warm-up
+runs first, then timed runs on seeded data, so the process's peak RSS belongs to
+that case alone. --cpus pins the workers (and the pool they start) to a CPU set.
+For each case the script reports the median throughput and its spread, time to
+first byte for downloads, the peak bytes allocated by Python during one run
+(tracemalloc) and the worker's peak RSS.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'cr_drive_container')
+OPERATIONS = ['fernet-encrypt', 'fernet-decrypt', 'encrypt', 'decrypt', 'upload', 'download']
+SEGMENTED = {'encrypt', 'decrypt', 'upload', 'download'}
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit in ['G', 'M', 'K']:
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f'{size // UNITS[unit]}{unit}'
+    return str(size)
+
+
+def parse_cpus(text):
+    cpus = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+# --- worker side ---
+
+def setup_django(tmpdir):
+    """Configure the project against a throwaway test database and media directory; returns a teardown function."""
+    sys.path.insert(0, PROJECT_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cr_drive.settings')
+    import django
+    django.setup()
+    import shutil
+    import tempfile
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    settings.MEDIA_ROOT = tempfile.mkdtemp(dir=tmpdir)
+    settings.USER_STORAGE_QUOTA = float('inf')
+    settings.MAX_FILE_SIZE = max(settings.MAX_FILE_SIZE, 2 * UNITS['G'])
+
+    def teardown():
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+    return teardown
+
+
+class Case:
+    """Prepares one operation on `data`; run() performs it once and returns the time to first byte or None."""
+
+    def __init__(self, operation, data):
+        self.operation = operation
+        self.data = data
+        getattr(self, f'prepare_{operation.replace("-", "_")}')()
+
+    def prepare_fernet_encrypt(self):
+        from storage.encryption import fernet
+        self.run = lambda: fernet.encrypt(self.data) and None
+
+    def prepare_fernet_decrypt(self):
+        from storage.encryption import fernet
+        token = fernet.encrypt(self.data)
+        self.run = lambda: fernet.decrypt(token) and None
+
+    def prepare_encrypt(self):
+        from storage.encryption import encrypt_file
+        self.run = lambda: encrypt_file(self.data) and None
+
+    def prepare_decrypt(self):
+        from storage.encryption import decrypt_file, encrypt_file
+        ciphertext = encrypt_file(self.data)
+        self.run = lambda: decrypt_file(ciphertext) and None
+
+    def login(self):
+        from django.contrib.auth.models import User
+        from django.test import Client
+        user = User.objects.create_user(f'bench-{self.operation}', password='bench')
+        self.client = Client()
+        self.client.force_login(user)
+        return user
+
+    def prepare_upload(self):
+        import shutil
+        from django.conf import settings
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.db import transaction
+        from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+        from django.urls import reverse
+        self.login()
+        # Encoded once up front, so the timings cover the server side only.
+        body = encode_multipart(BOUNDARY, {
+            'upload_file': '1', 'visibility': 'private', 'file': SimpleUploadedFile('bench.bin', self.data)})
+        url = reverse('drive')
+
+        def run():
+            with transaction.atomic():
+                response = self.client.generic('POST', url, body, content_type=MULTIPART_CONTENT)
+                transaction.set_rollback(True)
+            assert response.json()['status'] == 'success', response.content
+            # Rolled back rows would leave their ciphertext behind; keep runs independent.
+            shutil.rmtree(os.path.join(settings.MEDIA_ROOT, 'blobs'), ignore_errors=True)
+        self.run = run
+
+    def prepare_download(self):
+        from django.urls import reverse
+        from storage.blobstore import store_content
+        from storage.models import File
+        user = self.login()
+        blob = store_content(user, 'bench.bin', self.data)
+        file = File.objects.create(name='bench.bin', owner=user, blob=blob, size=blob.size)
+        url = reverse('download_file', args=[file.pk])
+
+        def run():
+            start = time.perf_counter()
+            response = self.client.get(url)
+            assert response.status_code == 200, response.status_code
+            ttfb = None
+            for chunk in response.streaming_content:
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+            response.close()
+            return ttfb
+        self.run = run
+
+
+def worker(spec):
+    if spec['cpus']:
+        os.sched_setaffinity(0, spec['cpus'])
+    teardown = setup_django(spec['tmpdir'])
+    import random
+    import tracemalloc
+    try:
+        data = random.Random(spec['seed']).randbytes(spec['size'])
+        case = Case(spec['operation'], data)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for _ in range(spec['warmups']):
+            case.run()
+        timings, ttfbs = [], []
+        for _ in range(spec['runs']):
+            start = time.perf_counter()
+            ttfb = case.run()
+            timings.append(time.perf_counter() - start)
+            if ttfb is not None:
+                ttfbs.append(ttfb)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        case.run()
+        _, allocated = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        teardown()
+    median = statistics.median(timings)
+    return {
+        'seconds': timings,
+        'median_s': median,
+        'mb_per_s': spec['size'] / median / 1e6 if median else None,
+        'stdev_pct': 100 * statistics.stdev(timings) / statistics.mean(timings) if len(timings) > 1 else 0.0,
+        'ttfb_ms': 1000 * statistics.median(ttfbs) if ttfbs else None,
+        'allocated_bytes': allocated,
+        # ru_maxrss is in KiB on Linux.
+        'rss_setup_kib': rss_before,
+        'rss_peak_kib': peak_rss,
+    }
+
+
+# --- driver side ---
+
+def run_case(args, operation, mode, size):
+    env = dict(os.environ)
+    if mode == 'pool':
+        env.update(CRYPTO_POOL_WORKERS=str(args.pool_workers), CRYPTO_POOL_KIND=args.pool_kind, CRYPTO_POOL_MIN_SIZE='0')
+    else:
+        env['CRYPTO_POOL_WORKERS'] = '0'
+    spec = {
+        'operation': operation, 'size': size, 'runs': args.runs, 'warmups': args.warmups, 'seed': args.seed,
+        'cpus': sorted(args.cpus) if args.cpus else None, 'tmpdir': args.tmpdir,
+    }
+    proc = subprocess.run([sys.executable, __file__, '--worker', json.dumps(spec)], env=env,
+                          capture_output=True, text=True)
+    if proc.returncode:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f'{operation} [{mode}] {format_size(size)} failed.')
+    return {'operation': operation, 'mode': mode, 'size': size, **json.loads(proc.stdout.splitlines()[-1])}
+
+
+def print_row(r):
+    ttfb = '-' if r['ttfb_ms'] is None else f'{r["ttfb_ms"]:.1f} ms'
+    print(f'{r["operation"]:<15} {r["mode"]:<7} {format_size(r["size"]):>6} {r["mb_per_s"]:>10.1f} '
+          f'{r["stdev_pct"]:>6.1f}% {ttfb:>10} {r["allocated_bytes"] / 1024:>12.0f} {r["rss_peak_kib"]:>10}',
+          flush=True)
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--worker':
+        print(json.dumps(worker(json.loads(sys.argv[2]))))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help='Comma-separated subset of the operations.')
+    parser.add_argument('--modes', default='serial,pool', help='serial, pool or both (segmented operations only).')
+    parser.add_argument('--sizes', default='1K,64K,1M,16M,256M,1G', help='Comma-separated sizes, e.g. 1K,4M,1G.')
+    parser.add_argument('--runs', type=int, default=5, help='Timed runs per case.')
+    parser.add_argument('--warmups', type=int, default=1, help='Untimed runs before them.')
+    parser.add_argument('--pool-workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--pool-kind', choices=['process', 'thread'], default='process')
+    parser.add_argument('--cpus', type=parse_cpus, help='Pin the workers to these CPUs, e.g. 0-3 or 2,4.')
+    parser.add_argument('--tmpdir', help='Where uploads and downloads write ciphertext (default: system temp).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the benchmark data.')
+    parser.add_argument('--json', help='Also write the results to this file.')
+    args = parser.parse_args()
+    operations = [op.strip() for op in args.operations.split(',')]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f'unknown operations: {", ".join(sorted(unknown))}')
+    modes = [mode.strip() for mode in args.modes.split(',')]
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+
+    print(f'{"operation":<15} {"mode":<7} {"size":>6} {"MB/s":>10} {"stdev":>7} {"ttfb":>10} '
+          f'{"alloc KiB":>12} {"RSS KiB":>10}')
+    results = []
+    for operation in operations:
+        for mode in (modes if operation in SEGMENTED else ['serial']):
+            for size in sizes:
+                results.append(run_case(args, operation, mode, size))
+                print_row(results[-1])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'machine': {
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpu_count': os.cpu_count(),
+                    'cpus': sorted(args.cpus) if args.cpus else None,
+                },
+                'settings': {'runs': args.runs, 'warmups': args.warmups, 'seed': args.seed,
+                             'pool_workers': args.pool_workers, 'pool_kind': args.pool_kind},
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
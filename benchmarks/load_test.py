@@ -0,0 +1,384 @@
+"""Mixed, concurrent load against a local CR-Drive server.
+
+Starts the server itself (or targets one given with --url), then runs --users
+virtual users for --duration seconds. Each virtual user logs in as one of the
+benchmark accounts (see `generate_dataset`) and repeatedly picks a weighted
+scenario:
+
+  browse       open a folder in the drive page, then its JSON listing
+  share_link   open the share link of one of the user's files or folders
+  upload       upload a small file through the drive page form
+  download     download one of the user's files
+  edit         save a text file through the editor
+  approve      open the access-request inbox and approve a pending request
+
+    python benchmarks/load_test.py --server gunicorn --workers 4 --users 50 --duration 60 \\
+        --mix browse=50,share_link=15,download=15,upload=10,edit=5,approve=5 --json load.json
+
+The report lists throughput, latency percentiles and error rates per request,
+and the server's CPU time and peak RSS (its whole process tree, read from
+/proc, so Linux only). Everything runs locally; only the standard library is used.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from urllib.parse import urlencode
+
+from asgi_vs_wsgi import Target, csrf, form, login, percentile, request
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'cr_drive_container')
+SCENARIOS = ['browse', 'share_link', 'upload', 'download', 'edit', 'approve']
+DEFAULT_MIX = 'browse=50,share_link=15,download=15,upload=10,edit=5,approve=5'
+SERVERS = {
+    'gunicorn': 'gunicorn cr_drive.wsgi -w {workers} --threads {threads} -b 127.0.0.1:{port}',
+    'uvicorn': 'uvicorn cr_drive.asgi:application --workers {workers} --port {port} --no-access-log',
+    'runserver': '{python} manage.py runserver 127.0.0.1:{port} --noreload',
+}
+APPROVE_RE = re.compile(rb'/storage/access-requests/approve/(\d+)/')
+
+
+class Stats:
+    def __init__(self):
+        self.samples = {}
+        self.started = time.monotonic()
+
+    def record(self, name, seconds, ok, status):
+        self.samples.setdefault(name, []).append((seconds, ok, status))
+
+    def report(self, elapsed):
+        rows = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = [seconds for seconds, ok, _ in samples if ok]
+            statuses = {}
+            for _, _, status in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            rows[name] = {
+                'requests': len(samples),
+                'errors': len(samples) - len(latencies),
+                'error_rate': (len(samples) - len(latencies)) / len(samples),
+                'rps': len(samples) / elapsed,
+                'p50_ms': _ms(percentile(latencies, 0.5)),
+                'p90_ms': _ms(percentile(latencies, 0.9)),
+                'p99_ms': _ms(percentile(latencies, 0.99)),
+                'max_ms': _ms(max(latencies, default=None)),
+                'statuses': statuses,
+            }
+        return rows
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class VirtualUser:
+    """One logged-in client; remembers the folders and files it has seen."""
+
+    def __init__(self, url, username, password, args, stats, rng):
+        self.target = Target(username, url)
+        self.username = username
+        self.password = password
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.folders = [None]
+        self.files = []
+        self.text_files = []
+
+    async def call(self, name, method, path, headers=None, body=b'', check=None):
+        started = time.monotonic()
+        try:
+            status, _, data = await asyncio.wait_for(
+                request(self.target, method, path, headers, body), self.args.timeout)
+            ok = status < 400 and (check is None or check(data))
+        except (asyncio.TimeoutError, OSError):
+            status, data, ok = None, b'', False
+        if started - self.stats.started >= self.args.warmup:
+            self.stats.record(name, time.monotonic() - started, ok, status or 'failed')
+        return status, data
+
+    async def start(self):
+        await login(self.target, self.username, self.password)
+        await self.listing(None)
+
+    async def listing(self, folder):
+        query = {'fields': 'id,name,is_owner'}
+        if folder:
+            query['folder'] = folder
+        status, data = await self.call('api.listing', 'GET', f'/storage/api/v1/listing/?{urlencode(query)}')
+        if status != 200:
+            return
+        listing = json.loads(data)
+        for item in listing['folders']:
+            if item['id'] not in self.folders:
+                self.folders.append(item['id'])
+        for item in listing['files']:
+            if item['is_owner'] and item['id'] not in self.files:
+                self.files.append(item['id'])
+                if item['name'].endswith('.txt'):
+                    self.text_files.append(item['id'])
+
+    async def browse(self):
+        folder = self.rng.choice(self.folders)
+        await self.call('drive', 'GET', f'/storage/drive/?folder={folder}' if folder else '/storage/drive/')
+        await self.listing(folder)
+
+    async def share_link(self):
+        if not self.files:
+            return await self.browse()
+        file_id = self.rng.choice(self.files)
+        status, data = await self.call('api.share_state', 'GET', f'/storage/api/v1/files/{file_id}/share/')
+        if status == 200:
+            link = json.loads(data).get('share_link')
+            if link:
+                await self.call('share_link', 'GET', '/' + link.split('/', 3)[3])
+
+    async def upload(self):
+        folder = self.rng.choice(self.folders)
+        boundary = uuid.uuid4().hex
+        content = os.urandom(self.args.upload_size)
+        parts = [
+            f'--{boundary}\r\nContent-Disposition: form-data; name="upload_file"\r\n\r\n1\r\n'.encode(),
+            f'--{boundary}\r\nContent-Disposition: form-data; name="visibility"\r\n\r\nprivate\r\n'.encode(),
+            (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="load-{boundary[:8]}.bin"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + b'\r\n',
+            f'--{boundary}--\r\n'.encode(),
+        ]
+        headers = {**csrf(self.target), 'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        path = f'/storage/drive/?folder={folder}' if folder else '/storage/drive/'
+        # Quota and other failures come back as 200 with a JSON error.
+        await self.call('upload', 'POST', path, headers, b''.join(parts),
+                        check=lambda data: b'"success"' in data)
+
+    async def download(self):
+        if not self.files:
+            return await self.browse()
+        await self.call('download', 'GET', f'/storage/download/{self.rng.choice(self.files)}/')
+
+    async def edit(self):
+        if not self.text_files:
+            return await self.browse()
+        file_id = self.rng.choice(self.text_files)
+        headers, body = form({'file_content': f'edited by {self.username} at {time.time()}\n' * 20})
+        await self.call('edit', 'POST', f'/storage/view/{file_id}/', {**headers, **csrf(self.target)}, body)
+
+    async def approve(self):
+        status, data = await self.call('access_requests', 'GET', '/storage/access-requests/')
+        pending = APPROVE_RE.findall(data or b'')
+        if pending:
+            request_id = int(self.rng.choice(pending))
+            await self.call('approve', 'POST', f'/storage/access-requests/approve/{request_id}/', csrf(self.target))
+
+    async def run(self, scenarios, weights, deadline):
+        while time.monotonic() < deadline:
+            scenario = self.rng.choices(scenarios, weights)[0]
+            await getattr(self, scenario)()
+            if self.args.think:
+                await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+
+
+class ServerMonitor:
+    """Samples CPU time and RSS of a process and all its descendants from /proc."""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.peak_rss = 0
+        self.cpu = {}
+        self.first_cpu = None
+
+    def tree(self):
+        children = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat') as f:
+                        ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                children.setdefault(ppid, []).append(int(entry))
+        pids, todo = [], [self.pid]
+        while todo:
+            pid = todo.pop()
+            pids.append(pid)
+            todo.extend(children.get(pid, []))
+        return pids
+
+    def sample(self):
+        rss = 0
+        for pid in self.tree():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                with open(f'/proc/{pid}/statm') as f:
+                    rss += int(f.read().split()[1]) * self.page_size
+            except (OSError, IndexError, ValueError):
+                continue
+            # utime + stime; exited processes keep their last reading.
+            self.cpu[pid] = (int(fields[11]) + int(fields[12])) / self.ticks
+        self.peak_rss = max(self.peak_rss, rss)
+        if self.first_cpu is None:
+            self.first_cpu = sum(self.cpu.values())
+
+    async def run(self, deadline):
+        while time.monotonic() < deadline:
+            self.sample()
+            await asyncio.sleep(self.interval)
+        self.sample()
+
+    def report(self, elapsed):
+        cpu = sum(self.cpu.values()) - (self.first_cpu or 0)
+        return {
+            'cpu_seconds': round(cpu, 2),
+            'cpu_percent': round(100 * cpu / elapsed, 1),
+            'peak_rss_mb': round(self.peak_rss / 1024 ** 2, 1),
+            'processes': len(self.cpu),
+        }
+
+
+def start_server(args):
+    command = args.server_cmd or SERVERS[args.server].format(
+        workers=args.workers, threads=args.threads, port=args.port, python=sys.executable)
+    env = dict(os.environ)
+    if args.server == 'uvicorn' and not args.server_cmd:
+        env.setdefault('ASYNC_VIEWS', 'True')
+    log = open(args.server_log, 'wb')
+    proc = subprocess.Popen(shlex.split(command), cwd=PROJECT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+    return proc
+
+
+async def wait_until_up(url, timeout, proc=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc and proc.poll() is not None:
+            raise SystemExit(f'The server exited with status {proc.returncode}; see the server log.')
+        try:
+            status, _, _ = await request(Target('probe', url), 'GET', '/accounts/login/')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.25)
+    raise SystemExit(f'No server answered at {url} within {timeout} seconds.')
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f'Unknown scenario {name!r}; choose from {", ".join(SCENARIOS)}.')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def run(args, url, server_pid):
+    mix = parse_mix(args.mix)
+    stats = Stats()
+    rng = random.Random(args.seed)
+    users = [
+        VirtualUser(url, args.username_pattern.format(i % args.accounts), args.password, args, stats,
+                    random.Random(rng.random()))
+        for i in range(args.users)
+    ]
+    await asyncio.gather(*(user.start() for user in users))
+    stats = Stats()
+    for user in users:
+        user.stats = stats
+    deadline = time.monotonic() + args.duration
+    monitor = ServerMonitor(server_pid) if server_pid and os.path.isdir('/proc') else None
+    tasks = [user.run(list(mix), list(mix.values()), deadline) for user in users]
+    if monitor:
+        tasks.append(monitor.run(deadline))
+    started = time.monotonic()
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started - min(args.warmup, args.duration)
+    requests = stats.report(elapsed)
+    total = sum(row['requests'] for row in requests.values())
+    errors = sum(row['errors'] for row in requests.values())
+    return {
+        'url': url,
+        'users': args.users,
+        'duration': args.duration,
+        'mix': mix,
+        'total': {'requests': total, 'errors': errors, 'error_rate': errors / total if total else 0,
+                  'rps': total / elapsed if elapsed > 0 else 0},
+        'requests': requests,
+        'server': monitor.report(elapsed + min(args.warmup, args.duration)) if monitor else None,
+    }
+
+
+def print_report(result):
+    print(f'{"request":<18} {"count":>7} {"req/s":>8} {"errors":>7} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9}')
+    for name, row in result['requests'].items():
+        values = [f'{row[key]:.1f}' if row[key] is not None else '-' for key in ['p50_ms', 'p90_ms', 'p99_ms', 'max_ms']]
+        print(f'{name:<18} {row["requests"]:>7} {row["rps"]:>8.1f} {100 * row["error_rate"]:>6.1f}% '
+              + ' '.join(f'{value:>9}' for value in values))
+    total = result['total']
+    print(f'{"total":<18} {total["requests"]:>7} {total["rps"]:>8.1f} {100 * total["error_rate"]:>6.1f}%')
+    if result['server']:
+        server = result['server']
+        print(f'server: {server["cpu_seconds"]} s CPU ({server["cpu_percent"]}% of one core), '
+              f'peak RSS {server["peak_rss_mb"]} MB over {server["processes"]} processes')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help='Load an already running server instead of starting one.')
+    parser.add_argument('--server-pid', type=int, help='With --url: the server process to monitor.')
+    parser.add_argument('--server', choices=SERVERS, default='gunicorn', help='Server to start (in cr_drive_container).')
+    parser.add_argument('--server-cmd', help='Start this command instead; must listen on --port.')
+    parser.add_argument('--server-log', default='load_test_server.log', help='Where the started server logs to.')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users.')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of load.')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds at the start left out of the statistics.')
+    parser.add_argument('--think', type=float, default=0, help='Mean seconds a user pauses between scenarios.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Scenario weights, e.g. browse=3,download=1.')
+    parser.add_argument('--username-pattern', default='bench{:06d}', help='Format of the account names.')
+    parser.add_argument('--accounts', type=int, default=10, help='Number of accounts the users are spread over.')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--upload-size', type=int, default=256 * 1024)
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    proc = None
+    if args.url:
+        url, server_pid = args.url.rstrip('/'), args.server_pid
+    else:
+        url = f'http://127.0.0.1:{args.port}'
+        proc = start_server(args)
+        server_pid = proc.pid
+    try:
+        asyncio.run(wait_until_up(url, 60, proc))
+        result = asyncio.run(run(args, url, server_pid))
+    finally:
+        if proc:
+            os.killpg(proc.pid, signal.SIGTERM)
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib import messages
-from storage.models import File
+from storage.quota import get_usage
 from django.conf import settings
 
 def signup_view(request):
@@ -42,8 +42,8 @@ def logout_view(request):
 
 @login_required
 def dashboard(request):
-    usage = sum(f.size for f in File.objects.filter(owner=request.user))
-    quota = int(getattr(settings, 'TOTAL_SERVER_STORAGE', 0)) * 0.02
+    usage = get_usage(request.user)
+    quota = settings.USER_STORAGE_QUOTA
     usage_percent = int((usage / quota) * 100) if quota else 0
     return render(request, 'accounts/dashboard.html', {
         'usage': usage,
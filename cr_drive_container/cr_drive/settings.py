@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
     'accounts',
     'storage',
     'sharing',
@@ -117,13 +118,59 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# JSON API under /storage/api/v1/ (storage.api); the drive page uses the session,
+# other clients a bearer token from /storage/api/v1/token/
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework_simplejwt.authentication.JWTAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.URLPathVersioning',
+    'ALLOWED_VERSIONS': ['v1'],
+}
+
+# Serve transfers, uploads and the sharing API with async views; enable when running under ASGI
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
 # Storage quota
 TOTAL_SERVER_STORAGE = int(os.getenv('TOTAL_SERVER_STORAGE', 5368709120))  # Default 5GB
 USER_STORAGE_QUOTA = TOTAL_SERVER_STORAGE * 0.02
 
 # File encryption key
 FILE_ENCRYPTION_KEY = os.getenv('FILE_ENCRYPTION_KEY')
+# Plaintext bytes per authenticated segment in the streaming encryption format
+ENCRYPTION_SEGMENT_SIZE = int(os.getenv('ENCRYPTION_SEGMENT_SIZE', 65536))  # 64KB default
+# Worker pool for encryption/decryption of large transfers ('process' or 'thread'; 0 workers disables it)
+CRYPTO_POOL_WORKERS = int(os.getenv('CRYPTO_POOL_WORKERS', min(4, os.cpu_count() or 1)))
+CRYPTO_POOL_KIND = os.getenv('CRYPTO_POOL_KIND', 'process')
+CRYPTO_POOL_MIN_SIZE = int(os.getenv('CRYPTO_POOL_MIN_SIZE', 4194304))  # Smaller transfers are handled inline
+CRYPTO_POOL_MAX_PENDING = int(os.getenv('CRYPTO_POOL_MAX_PENDING', 0)) or None  # Queued batches; default 4 per worker
+# Compression applied before encryption: 'zlib', 'zstd' (needs the zstandard package) or 'none'
+FILE_COMPRESSION = os.getenv('FILE_COMPRESSION', 'zlib')
+# Per-process LRU of decrypted public content, in bytes (0 disables it)
+PLAINTEXT_CACHE_SIZE = int(os.getenv('PLAINTEXT_CACHE_SIZE', 0))
+PLAINTEXT_CACHE_MAX_ENTRY = int(os.getenv('PLAINTEXT_CACHE_MAX_ENTRY', 1048576))  # Larger files are cached by segment
+PLAINTEXT_CACHE_MAX_FILE_SHARE = float(os.getenv('PLAINTEXT_CACHE_MAX_FILE_SHARE', 0.125))  # Cap on one file's share of the cache
+
+# Items per page of a folder listing; further pages load as the user scrolls
+DRIVE_PAGE_SIZE = int(os.getenv('DRIVE_PAGE_SIZE', 100))
+
+# Seconds a user's resolved sharing grants stay cached (storage.access); changes invalidate them at once.
+# Unset, it is 300 with a shared cache backend and 0 (off) with a per-process one such as the default
+# LocMemCache, whose cached grants would outlive revocations made in other processes
+ACCESS_CACHE_TIMEOUT = os.getenv('ACCESS_CACHE_TIMEOUT')
+ACCESS_CACHE_TIMEOUT = None if ACCESS_CACHE_TIMEOUT is None else int(ACCESS_CACHE_TIMEOUT)
 
 # File size limit
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 1073741824))  # 1GB default
 
+# Resumable uploads
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 8388608))  # 8MB default, rounded to whole segments
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 86400))  # Abandoned sessions expire after 1 day
+UPLOAD_COMPRESS_MAX_SIZE = int(os.getenv('UPLOAD_COMPRESS_MAX_SIZE', 67108864))  # Larger uploads are not recompressed
+
+
+# Deduplication: 'global' shares identical content across all users, 'user' only within one account
+BLOB_DEDUP_SCOPE = os.getenv('BLOB_DEDUP_SCOPE', 'global')
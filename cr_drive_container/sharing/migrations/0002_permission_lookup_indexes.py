@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sharing', '0001_initial'),
+        ('storage', '0013_hot_lookup_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='permission',
+            index=models.Index(condition=models.Q(('file__isnull', False)), fields=['user', 'file'], name='permission_user_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='permission',
+            index=models.Index(condition=models.Q(('folder__isnull', False)), fields=['user', 'folder'], name='permission_user_folder_idx'),
+        ),
+    ]
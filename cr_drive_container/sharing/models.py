@@ -16,6 +16,14 @@ class Permission(models.Model):
 
     class Meta:
         unique_together = ('user', 'file', 'folder')
+        # A grant targets either a file or a folder, so each lookup gets an index
+        # without the other, always-NULL column in it.
+        indexes = [
+            models.Index(fields=['user', 'file'], name='permission_user_file_idx',
+                         condition=models.Q(file__isnull=False)),
+            models.Index(fields=['user', 'folder'], name='permission_user_folder_idx',
+                         condition=models.Q(folder__isnull=False)),
+        ]
 
     def __str__(self):
         target = self.file if self.file else self.folder
@@ -65,6 +65,119 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   }
 
+  // Resumable chunked uploads: every file gets an upload session on the server,
+  // its chunks are sent in parallel (with retries) and the session is finalized
+  // once all chunks have landed. An interrupted upload of the same file resumes
+  // from the chunks the server already has.
+  var UPLOAD_PARALLELISM = 4;
+  var UPLOAD_RETRIES = 3;
+  function currentFolderId() {
+    return new URLSearchParams(window.location.search).get('folder') || '';
+  }
+  function uploadKey(file) {
+    return 'cr-drive-upload:' + currentFolderId() + ':' + file.name + ':' + file.size + ':' + file.lastModified;
+  }
+  function uploadApi(method, url, body) {
+    return fetch(url, {
+      method: method,
+      headers: {'X-CSRFToken': window.csrf_token},
+      credentials: 'same-origin',
+      body: body
+    })
+    .then(r => r.json())
+    .then(data => {
+      if (data.status !== 'success') throw new Error(data.message || 'Upload failed.');
+      return data;
+    });
+  }
+  function startUploadSession(file, visibility) {
+    let saved = localStorage.getItem(uploadKey(file));
+    let resume = saved ? uploadApi('GET', `/storage/api/uploads/${saved}/`).catch(() => null) : Promise.resolve(null);
+    return resume.then(session => {
+      if (session) return session;
+      return uploadApi('POST', '/storage/api/uploads/', new URLSearchParams({
+        name: file.name,
+        size: file.size,
+        visibility: visibility,
+        folder: currentFolderId()
+      }))
+      .then(data => {
+        localStorage.setItem(uploadKey(file), data.upload_id);
+        data.received = [];
+        return data;
+      });
+    });
+  }
+  function putChunk(file, session, index, onProgress) {
+    let start = index * session.chunk_size;
+    let end = Math.min(start + session.chunk_size, file.size);
+    return new Promise(function(resolve, reject) {
+      let xhr = new XMLHttpRequest();
+      xhr.open('PUT', `/storage/api/uploads/${session.upload_id}/chunks/${index}/`);
+      xhr.setRequestHeader('X-CSRFToken', window.csrf_token || '');
+      xhr.setRequestHeader('Content-Range', `bytes ${start}-${end - 1}/${file.size}`);
+      xhr.upload.onprogress = function(e) { onProgress(e.loaded); };
+      xhr.onload = function() {
+        if (xhr.status === 200) {
+          resolve();
+        } else {
+          let resp = {};
+          try { resp = JSON.parse(xhr.responseText); } catch (e) {}
+          reject(new Error(resp.message || 'Upload failed: ' + xhr.statusText));
+        }
+      };
+      xhr.onerror = function() { reject(new Error('Upload failed. Please try again.')); };
+      xhr.send(file.slice(start, end));
+    });
+  }
+  function uploadFile(file, visibility, onProgress) {
+    return startUploadSession(file, visibility).then(session => {
+      let chunkLength = index => Math.min(session.chunk_size, file.size - index * session.chunk_size);
+      let pending = [];
+      let done = 0;
+      for (let i = 0; i < session.chunk_count; i++) {
+        if (session.received.indexOf(i) === -1) {
+          pending.push(i);
+        } else {
+          done += chunkLength(i);
+        }
+      }
+      let inFlight = {};
+      function report() {
+        let sent = done;
+        for (let k in inFlight) sent += inFlight[k];
+        onProgress(file.size ? sent / file.size : 1);
+      }
+      function worker() {
+        if (!pending.length) return Promise.resolve();
+        let index = pending.shift();
+        let attempts = 0;
+        function attempt() {
+          return putChunk(file, session, index, function(loaded) { inFlight[index] = loaded; report(); })
+            .catch(function(err) {
+              inFlight[index] = 0;
+              if (++attempts < UPLOAD_RETRIES) return attempt();
+              throw err;
+            });
+        }
+        return attempt().then(function() {
+          delete inFlight[index];
+          done += chunkLength(index);
+          report();
+          return worker();
+        });
+      }
+      let workers = [];
+      for (let k = 0; k < UPLOAD_PARALLELISM; k++) workers.push(worker());
+      return Promise.all(workers)
+        .then(() => uploadApi('POST', `/storage/api/uploads/${session.upload_id}/finalize/`))
+        .then(resp => {
+          localStorage.removeItem(uploadKey(file));
+          return resp;
+        });
+    });
+  }
+
   // Upload progress bar logic (multiple files)
   var uploadForm = document.getElementById('uploadForm');
   var progressBar = document.getElementById('uploadProgressBar');
@@ -81,6 +194,8 @@ document.addEventListener('DOMContentLoaded', function() {
       let files = fileInput.files;
       let total = files.length;
       let uploaded = 0;
+      let visibilitySelect = uploadForm.querySelector('select[name="visibility"]');
+      let visibility = visibilitySelect ? visibilitySelect.value : 'private';
       function uploadNext() {
         if (uploaded >= total) {
           progress.style.width = '100%';
@@ -89,45 +204,20 @@ document.addEventListener('DOMContentLoaded', function() {
           setTimeout(function() { window.location.reload(); }, 1000);
           return;
         }
-        let formData = new FormData();
-        formData.append('upload_file', '1');
-        formData.append('file', files[uploaded]);
-        formData.append('csrfmiddlewaretoken', window.csrf_token || '');
-        var xhr = new XMLHttpRequest();
-        xhr.open('POST', window.location.href);
-        xhr.upload.onprogress = function(e) {
-          if (e.lengthComputable) {
-            var percent = Math.round((e.loaded / e.total) * 100);
-            progressBar.classList.remove('d-none');
-            progress.style.width = percent + '%';
-            progress.innerText = percent + '% (' + (uploaded+1) + '/' + total + ')';
-          }
-        };
-        xhr.onload = function() {
-          if (xhr.status === 200) {
-            let resp = {};
-            try { resp = JSON.parse(xhr.responseText); } catch (e) {}
-            if (resp.status === 'success') {
-              uploaded++;
-              uploadNext();
-            } else {
-              let msg = resp.message || 'Upload failed.';
-              uploadStatus.innerHTML = '<div class="alert alert-danger">' + msg + '</div>';
-              progressBar.classList.add('d-none');
-            }
-          } else {
-            let msg = 'Upload failed: ' + xhr.statusText;
-            if (xhr.responseText) {
-              msg += '<br>' + xhr.responseText;
-            }
-            uploadStatus.innerHTML = '<div class="alert alert-danger">' + msg + '</div>';
-            progressBar.classList.add('d-none');
-          }
-        };
-        xhr.onerror = function() {
-          uploadStatus.innerHTML = '<div class="alert alert-danger">Upload failed. Please try again.</div>';
-        };
-        xhr.send(formData);
+        progressBar.classList.remove('d-none');
+        uploadFile(files[uploaded], visibility, function(fraction) {
+          var percent = Math.round(fraction * 100);
+          progress.style.width = percent + '%';
+          progress.innerText = percent + '% (' + (uploaded+1) + '/' + total + ')';
+        })
+        .then(function() {
+          uploaded++;
+          uploadNext();
+        })
+        .catch(function(err) {
+          uploadStatus.innerHTML = '<div class="alert alert-danger">' + err.message + '</div>';
+          progressBar.classList.add('d-none');
+        });
       }
       uploadNext();
     });
@@ -137,16 +227,6 @@ document.addEventListener('DOMContentLoaded', function() {
   let contextMenu = document.getElementById('contextMenu');
   let currentTargetType = null;
   let currentTargetId = null;
-  document.querySelectorAll('.explorer-item').forEach(function(item) {
-    item.addEventListener('contextmenu', function(e) {
-      e.preventDefault();
-      currentTargetType = item.getAttribute('data-type');
-      currentTargetId = item.getAttribute('data-id');
-      contextMenu.style.display = 'block';
-      contextMenu.style.left = e.pageX + 'px';
-      contextMenu.style.top = e.pageY + 'px';
-    });
-  });
   document.addEventListener('click', function(e) {
     if (!contextMenu.contains(e.target)) {
       contextMenu.style.display = 'none';
@@ -177,6 +257,13 @@ document.addEventListener('DOMContentLoaded', function() {
     moveModal.show();
     contextMenu.style.display = 'none';
   };
+  document.getElementById('copyBtn').onclick = function() {
+    if (currentTargetType === 'file') {
+      document.getElementById('copyTargetId').value = currentTargetId;
+      document.getElementById('copyForm').submit();
+    }
+    contextMenu.style.display = 'none';
+  };
   document.getElementById('removeBtn').onclick = function() {
     document.getElementById('removeTargetType').value = currentTargetType;
     document.getElementById('removeTargetId').value = currentTargetId;
@@ -198,9 +285,29 @@ document.addEventListener('DOMContentLoaded', function() {
     contextMenu.style.display = 'none';
   };
 
-  // Drag-and-drop move logic (basic visual feedback)
+  // Per-item behaviour: context menu, drag-and-drop move, view button and size formatting.
+  // Applied to the first page on load and to every page appended by infinite scroll.
   let draggedItem = null;
-  document.querySelectorAll('.explorer-item').forEach(function(item) {
+  function formatFileSize(size) {
+    if (size >= 1024*1024) {
+      return (size/1024/1024).toFixed(2) + ' MB';
+    } else if (size >= 1024) {
+      return (size/1024).toFixed(2) + ' KB';
+    } else {
+      return size + ' bytes';
+    }
+  }
+  function initExplorerItem(item) {
+    item.addEventListener('contextmenu', function(e) {
+      e.preventDefault();
+      currentTargetType = item.getAttribute('data-type');
+      currentTargetId = item.getAttribute('data-id');
+      contextMenu.style.display = 'block';
+      contextMenu.style.left = e.pageX + 'px';
+      contextMenu.style.top = e.pageY + 'px';
+    });
+
+    // Drag-and-drop move logic (basic visual feedback)
     item.setAttribute('draggable', true);
     item.addEventListener('dragstart', function(e) {
       draggedItem = item;
@@ -227,10 +334,9 @@ document.addEventListener('DOMContentLoaded', function() {
         moveModal.show();
       }
     });
-  });
 
-  // Add a "View" button for each file and double-click to view
-  document.querySelectorAll('.explorer-item[data-type="file"]').forEach(function(item) {
+    if (item.getAttribute('data-type') !== 'file') return;
+    // Add a "View" button for each file and double-click to view
     let fileId = item.getAttribute('data-id');
     let viewBtn = document.createElement('a');
     viewBtn.href = '/storage/view/' + fileId + '/';
@@ -238,26 +344,224 @@ document.addEventListener('DOMContentLoaded', function() {
     viewBtn.innerHTML = '<i class="bi bi-eye"></i> View';
     let cardBody = item.querySelector('.card-body .mt-1') || item.querySelector('.justify-content-between');
     if (cardBody) cardBody.appendChild(viewBtn);
-    // Double-click to view
     item.addEventListener('dblclick', function(e) {
       window.open('/storage/view/' + fileId + '/', '_blank');
     });
-  });
+    // Update file size display in file lists
+    item.querySelectorAll('.file-size').forEach(function(span) {
+      let size = parseInt(span.getAttribute('data-size'));
+      span.innerText = '(' + formatFileSize(size) + ')';
+    });
+  }
+  document.querySelectorAll('.explorer-item').forEach(initExplorerItem);
 
-  // Update file size display in file/folder lists
-  function formatFileSize(size) {
-    if (size >= 1024*1024) {
-      return (size/1024/1024).toFixed(2) + ' MB';
-    } else if (size >= 1024) {
-      return (size/1024).toFixed(2) + ' KB';
-    } else {
-      return size + ' bytes';
+  // Pending access requests on the user's items, read from a per-owner counter.
+  var pendingRequests = document.getElementById('pendingRequests');
+  if (pendingRequests) {
+    fetch('/storage/api/v1/access-requests/pending/', {credentials: 'same-origin'})
+      .then(r => r.ok ? r.json() : {pending: 0})
+      .then(data => {
+        if (data.pending > 0) {
+          document.getElementById('pendingRequestCount').innerText = data.pending;
+          pendingRequests.classList.remove('d-none');
+        }
+      });
+  }
+
+  // Client-side navigation: folders, sorting and further pages are fetched as JSON from
+  // the read API (/storage/api/v1/) and rendered here, instead of reloading the page.
+  // The markup mirrors templates/storage/drive_items.html.
+  var LISTING_FIELDS = 'id,name,size,visibility,is_owner,shared_with_user,access_pending';
+  var driveItems = document.getElementById('driveItems');
+  var driveSentinel = document.getElementById('driveSentinel');
+  var breadcrumbList = document.getElementById('breadcrumbs');
+  function escapeHtml(text) {
+    return String(text).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'})[c]);
+  }
+  function visibilityBadge(visibility) {
+    if (visibility === 'public') return '<span class="badge bg-success">Public</span>';
+    if (visibility === 'ask') return '<span class="badge bg-warning text-dark">Ask</span>';
+    return '<span class="badge bg-secondary">Private</span>';
+  }
+  function fileActions(file) {
+    let name = escapeHtml(JSON.stringify(file.name));
+    return `<a href="/storage/download/${file.id}/" class="btn btn-sm btn-outline-primary"><i class="bi bi-download"></i></a>
+      <button type="button" class="btn btn-sm btn-outline-danger" onclick="triggerRemoveModal(${file.id}, 'file')"><i class="bi bi-trash"></i></button>
+      <a href="#" class="btn btn-sm btn-outline-secondary" onclick="openShareModal('file', ${file.id}, ${name})"><i class="bi bi-share"></i></a>`;
+  }
+  function renderFolder(folder, viewMode) {
+    let name = escapeHtml(folder.name);
+    if (viewMode === 'icon') {
+      return `<div class="col-6 col-sm-4 col-md-3 col-lg-2">
+        <div class="explorer-item" data-type="folder" data-id="${folder.id}">
+          <a href="/storage/drive/?folder=${folder.id}" class="text-decoration-none text-dark">
+            <div class="card text-center h-100 shadow-sm hover-shadow">
+              <div class="card-body py-4">
+                <i class="bi bi-folder-fill" style="font-size:2rem;"></i>
+                <div class="mt-2 small">${name}</div>
+              </div>
+            </div>
+          </a>
+        </div>
+      </div>`;
     }
+    return `<li class="list-group-item d-flex align-items-center explorer-item" data-type="folder" data-id="${folder.id}">
+      <i class="bi bi-folder-fill me-2 text-warning"></i>
+      <a href="/storage/drive/?folder=${folder.id}" class="flex-grow-1 text-decoration-none text-dark">${name}</a>
+      <span class="ms-2">${visibilityBadge(folder.visibility)}</span>
+    </li>`;
+  }
+  function renderFile(file, viewMode) {
+    let name = escapeHtml(file.name);
+    if (viewMode === 'icon') {
+      return `<div class="col-6 col-sm-4 col-md-3 col-lg-2">
+        <div class="explorer-item" data-type="file" data-id="${file.id}">
+          <div class="card text-center h-100 shadow-sm hover-shadow">
+            <div class="card-body py-4">
+              <i class="bi bi-file-earmark-fill" style="font-size:2rem;"></i>
+              <div class="mt-2 small">${name}</div>
+              <div class="mt-1">${fileActions(file)}</div>
+            </div>
+          </div>
+        </div>
+      </div>`;
+    }
+    let access = '';
+    if (file.visibility === 'ask' && !file.is_owner && !file.shared_with_user) {
+      access = `<form method="post" action="/storage/request-access/file/${file.id}/" style="display:inline;">
+        <input type="hidden" name="csrfmiddlewaretoken" value="${window.csrf_token}">
+        <button type="submit" class="btn btn-sm btn-outline-warning ms-2">Request Access</button>
+      </form>`;
+    } else if (file.visibility === 'ask' && file.access_pending) {
+      access = '<span class="badge bg-warning text-dark ms-2">Access Requested</span>';
+    }
+    return `<li class="list-group-item d-flex align-items-center justify-content-between explorer-item" data-type="file" data-id="${file.id}">
+      <div>
+        <i class="bi bi-file-earmark-fill me-2 text-secondary"></i>
+        ${name} <span class="text-muted small file-size" data-size="${file.size}">(${file.size} bytes)</span>
+        <span class="ms-2">${visibilityBadge(file.visibility)}</span>
+        ${access}
+      </div>
+      <div>${fileActions(file)}</div>
+    </li>`;
+  }
+  function renderBreadcrumbs(crumbs) {
+    let html = '<li class="breadcrumb-item"><a href="/storage/drive/"><i class="bi bi-house-door"></i> My Drive</a></li>';
+    crumbs.forEach(function(crumb, index) {
+      if (index === crumbs.length - 1) {
+        html += `<li class="breadcrumb-item active" aria-current="page">${escapeHtml(crumb.name)}</li>`;
+      } else {
+        html += `<li class="breadcrumb-item"><a href="/storage/drive/?folder=${crumb.id}">${escapeHtml(crumb.name)}</a></li>`;
+      }
+    });
+    breadcrumbList.innerHTML = html;
+  }
+  function appendItems(data) {
+    let viewMode = driveItems.getAttribute('data-view-mode');
+    let html = data.folders.map(f => renderFolder(f, viewMode)).join('') + data.files.map(f => renderFile(f, viewMode)).join('');
+    let template = document.createElement('template');
+    template.innerHTML = html;
+    template.content.querySelectorAll('.explorer-item').forEach(initExplorerItem);
+    driveItems.appendChild(template.content);
+    driveItems.setAttribute('data-next-cursor', data.next_cursor || '');
+  }
+  function fetchListing(params) {
+    let url = new URL('/storage/api/v1/listing/', window.location.origin);
+    url.searchParams.set('fields', LISTING_FIELDS);
+    for (let key in params) {
+      if (params[key]) url.searchParams.set(key, params[key]);
+    }
+    return fetch(url, {credentials: 'same-origin'}).then(r => {
+      if (!r.ok) throw new Error('Could not load the folder.');
+      return r.json();
+    });
+  }
+  function listingParams() {
+    let query = new URLSearchParams(window.location.search);
+    return {folder: query.get('folder'), sort: query.get('sort')};
+  }
+
+  // Infinite scroll: fetch the next page of the listing when the sentinel below it comes into view.
+  var loadingPage = false;
+  var pageObserver = null;
+  var listingGeneration = 0;  // bumped on navigation so late pages of the old folder are dropped
+  function observeSentinel() {
+    if (!pageObserver) return;
+    // A short page may leave the sentinel visible; observe again to keep loading.
+    pageObserver.unobserve(driveSentinel);
+    if (driveItems.getAttribute('data-next-cursor')) pageObserver.observe(driveSentinel);
+  }
+  if (driveItems && driveSentinel && 'IntersectionObserver' in window) {
+    pageObserver = new IntersectionObserver(function(entries) {
+      let cursor = driveItems.getAttribute('data-next-cursor');
+      if (!entries[0].isIntersecting || loadingPage || !cursor) return;
+      loadingPage = true;
+      let generation = listingGeneration;
+      fetchListing(Object.assign(listingParams(), {cursor: cursor}))
+        .then(data => { if (generation === listingGeneration) appendItems(data); })
+        .catch(() => driveItems.setAttribute('data-next-cursor', ''))
+        .finally(() => {
+          loadingPage = false;
+          observeSentinel();
+        });
+    }, {rootMargin: '400px'});
+    pageObserver.observe(driveSentinel);
+  }
+
+  function navigate(url, push) {
+    let query = new URL(url, window.location.href).searchParams;
+    let generation = ++listingGeneration;
+    return fetchListing({folder: query.get('folder'), sort: query.get('sort')})
+      .then(data => {
+        if (generation !== listingGeneration) return;
+        if (push) history.pushState(null, '', url);
+        if (sortSelect) sortSelect.value = query.get('sort') || 'name';
+        loadingPage = false;
+        driveItems.innerHTML = '';
+        appendItems(data);
+        if (!data.folders.length && !data.files.length && driveItems.tagName === 'UL') {
+          driveItems.innerHTML = '<li class="list-group-item text-center text-muted">This folder is empty.</li>';
+        }
+        if (breadcrumbList) renderBreadcrumbs(data.breadcrumbs);
+        document.querySelectorAll('.view-toggle').forEach(function(link) {
+          let href = new URL(window.location.href);
+          href.searchParams.set('view', link.getAttribute('data-view'));
+          link.href = href.pathname + href.search;
+        });
+        observeSentinel();
+      })
+      .catch(() => { window.location.href = url; });
+  }
+  if (driveItems) {
+    document.addEventListener('click', function(e) {
+      let link = e.target.closest('#driveItems a[href^="/storage/drive/"], #breadcrumbs a[href^="/storage/drive/"]');
+      if (!link || e.ctrlKey || e.metaKey || e.shiftKey || e.button !== 0) return;
+      e.preventDefault();
+      let url = new URL(link.href, window.location.href);
+      // Keep the current view mode and sort when entering a folder.
+      let current = new URLSearchParams(window.location.search);
+      ['view', 'sort'].forEach(function(key) {
+        if (current.get(key) && !url.searchParams.get(key)) url.searchParams.set(key, current.get(key));
+      });
+      navigate(url.pathname + url.search, true);
+    });
+    window.addEventListener('popstate', function() {
+      navigate(window.location.href, false);
+    });
+  }
+
+  var sortSelect = document.getElementById('sortSelect');
+  if (sortSelect) {
+    sortSelect.addEventListener('change', function() {
+      let url = new URL(window.location.href);
+      url.searchParams.set('sort', sortSelect.value);
+      if (driveItems) {
+        navigate(url.pathname + url.search, true);
+      } else {
+        window.location.href = url;
+      }
+    });
   }
-  document.querySelectorAll('.file-size').forEach(function(span) {
-    let size = parseInt(span.getAttribute('data-size'));
-    span.innerText = '(' + formatFileSize(size) + ')';
-  });
 
   window.triggerRemoveModal = function(id, type) {
     document.getElementById('removeTargetType').value = type;
@@ -0,0 +1,219 @@
+"""Effective access to files and folders, including grants inherited through the tree.
+
+A Permission on a folder covers every folder and file below it. A user's grants are
+loaded in one query and kept in the cache framework. Access to any batch of items
+is then worked out in memory, because each folder's materialized path lists the
+ancestors whose grants apply.
+
+Cached grants are keyed by a per-user version that is bumped whenever one of the
+user's Permission rows changes (storage.signals), so a request that read the grants
+before the change cannot store them under the new version. Visibility,
+ownership and tree position are read from the rows being checked, not from the
+cache, so moving or re-sharing an item needs no invalidation.
+
+Invalidation only reaches the processes sharing the cache backend, so grants are
+cached only when that backend is shared (see cache_timeout and storage.checks).
+
+Views go through AccessPolicy (see policy_for), which owns the rules built on top of
+the grants and memoizes them for the rest of the request.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.db import transaction
+
+from sharing.models import Permission
+from .models import File, Folder
+
+logger = logging.getLogger(__name__)
+
+# Higher wins when a user holds grants at several levels of the tree.
+RANK = {None: 0, Permission.READ: 1, Permission.WRITE: 2}
+
+# Backends whose entries live in each process, out of reach of other processes' invalidations.
+PER_PROCESS_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+DEFAULT_TIMEOUT = 300
+
+
+def shared_cache():
+    return settings.CACHES[DEFAULT_CACHE_ALIAS]['BACKEND'] not in PER_PROCESS_CACHES
+
+
+def cache_timeout():
+    """Seconds to cache grants: ACCESS_CACHE_TIMEOUT, or by default 0 unless the cache is shared."""
+    if settings.ACCESS_CACHE_TIMEOUT is not None:
+        return settings.ACCESS_CACHE_TIMEOUT
+    return DEFAULT_TIMEOUT if shared_cache() else 0
+
+
+def _version_key(user_id):
+    return f'access-grants-version:{user_id}'
+
+
+def _version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Never restart from a number an earlier, evicted counter may already have used.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def invalidate(user_id):
+    """Drop `user_id`'s cached grants, now and again when the current transaction commits.
+
+    The second bump discards grants another request may have cached from the
+    pre-commit state in between.
+    """
+    _bump(user_id)
+    transaction.on_commit(lambda: _bump(user_id))
+
+
+def _load_grants(user):
+    loaded = {'files': {}, 'folders': {}}
+    for file_id, folder_id, level in Permission.objects.filter(user=user).values_list(
+            'file_id', 'folder_id', 'access_level'):
+        if file_id:
+            loaded['files'][file_id] = level
+        elif folder_id:
+            loaded['folders'][folder_id] = level
+    return loaded
+
+
+def grants(user):
+    """{'files': {id: level}, 'folders': {id: level}} for every Permission `user` holds."""
+    timeout = cache_timeout()
+    if not timeout:
+        return _load_grants(user)
+    key = f'access-grants:{user.pk}:{_version(user.pk)}'
+    cached = cache.get(key)
+    if cached is None:
+        cached = _load_grants(user)
+        cache.set(key, cached, timeout)
+    return cached
+
+
+def _best(levels):
+    return max(levels, key=RANK.__getitem__, default=None)
+
+
+def _path_grant(folder_grants, path):
+    if not folder_grants:
+        return None
+    return _best(folder_grants.get(int(pk)) for pk in path.split('/') if pk)
+
+
+def folder_levels(user, folders):
+    """{folder.pk: level or None}: the strongest grant on each folder or an ancestor of it."""
+    folder_grants = grants(user)['folders']
+    return {folder.pk: _path_grant(folder_grants, folder.path) for folder in folders}
+
+
+def file_levels(user, files):
+    """{file.pk: level or None} from grants on each file and on the folders above it.
+
+    Uses file.folder when it was loaded with select_related, otherwise fetches the
+    missing folder paths in a single query (and none at all if the user holds no
+    folder grants).
+    """
+    user_grants = grants(user)
+    paths = {}
+    if user_grants['folders']:
+        missing = set()
+        for file in files:
+            if not file.folder_id:
+                continue
+            if File.folder.is_cached(file):
+                paths[file.folder_id] = file.folder.path
+            else:
+                missing.add(file.folder_id)
+        missing -= paths.keys()
+        if missing:
+            paths.update(Folder.objects.filter(pk__in=missing).values_list('pk', 'path'))
+    return {
+        file.pk: _best([user_grants['files'].get(file.pk),
+                        _path_grant(user_grants['folders'], paths.get(file.folder_id, ''))])
+        for file in files
+    }
+
+
+def folder_level(user, folder):
+    return folder_levels(user, [folder])[folder.pk]
+
+
+def file_level(user, file):
+    return file_levels(user, [file])[file.pk]
+
+
+class AccessPolicy:
+    """Every access decision for one user during one request.
+
+    Resolved grant levels are memoized, so checking the same item twice (a view that
+    falls back to another, a template asking again) costs nothing, and prefetch()
+    resolves a whole batch at once. Anonymous users get public access only, without
+    touching the grant cache. Obtain one with policy_for(request).
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._levels = {}
+
+    def _key(self, item):
+        return (item._meta.model_name, item.pk)
+
+    def prefetch(self, items):
+        """Resolve grant levels for many files and/or folders in one pass."""
+        todo = [item for item in items if self._key(item) not in self._levels]
+        if not todo:
+            return
+        if not self.user.is_authenticated:
+            self._levels.update((self._key(item), None) for item in todo)
+            return
+        logger.debug('Resolving access to %d items for user %s', len(todo), self.user.pk)
+        files = [item for item in todo if isinstance(item, File)]
+        folders = [item for item in todo if isinstance(item, Folder)]
+        if files:
+            self._levels.update((('file', pk), level) for pk, level in file_levels(self.user, files).items())
+        if folders:
+            self._levels.update((('folder', pk), level) for pk, level in folder_levels(self.user, folders).items())
+
+    def level(self, item):
+        """The strongest grant the user holds on `item` or a folder above it, or None."""
+        self.prefetch([item])
+        return self._levels[self._key(item)]
+
+    def is_owner(self, item):
+        return self.user.is_authenticated and item.owner_id == self.user.id
+
+    def can_manage(self, item):
+        """Rename, move, delete, re-share: the owner or a superuser."""
+        return self.is_owner(item) or self.user.is_superuser
+
+    def can_read(self, item):
+        """Open a file's content or a folder's full contents."""
+        return self.can_manage(item) or item.visibility == 'public' or self.level(item) is not None
+
+    def can_see(self, item):
+        """Know the item exists: list it, show its metadata or offer to request access."""
+        return self.can_read(item) or item.visibility == 'ask'
+
+    def can_write(self, item):
+        return self.can_manage(item) or self.level(item) == Permission.WRITE
+
+
+def policy_for(request):
+    """The request's AccessPolicy, created on first use."""
+    policy = getattr(request, '_access_policy', None)
+    if policy is None or policy.user is not request.user:
+        policy = request._access_policy = AccessPolicy(request.user)
+    return policy
@@ -0,0 +1,105 @@
+"""Versioned read API for the drive front end (/storage/api/v1/...).
+
+drive.js navigates between folders with these endpoints instead of reloading
+storage/drive.html. Listings are keyset-paginated by storage.pagination, and
+`?fields=` trims the items to the keys the client needs.
+"""
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from sharing.models import Permission
+from .access import policy_for
+from .inbox import pending_count
+from .models import File, Folder
+from .pagination import InvalidCursor, paginate, parse_sort
+from .serializers import BreadcrumbSerializer, FileSerializer, FolderSerializer
+from .views import drive_listing, get_breadcrumbs, get_requested_folder, with_access_flags
+
+
+def visible_folder(policy, pk):
+    folder = get_object_or_404(Folder, pk=pk)
+    if not policy.can_see(folder):
+        raise Http404()
+    return folder
+
+
+def visible_file(policy, pk):
+    file = get_object_or_404(with_access_flags(File.objects.select_related('folder'), policy.user, 'file'), pk=pk)
+    if not policy.can_see(file):
+        raise Http404()
+    # The annotation only sees grants on the file itself.
+    file.shared_with_user = policy.level(file) is not None
+    return file
+
+
+class ListingView(APIView):
+    """One page of a folder (`?folder=`, root if omitted), folders first.
+
+    The first page also carries the folder and its breadcrumbs; pass the returned
+    `next_cursor` as `?cursor=` for the next one.
+    """
+
+    def get(self, request, version):
+        folder = get_requested_folder(request)
+        folders, files = drive_listing(folder, policy_for(request))
+        cursor = request.query_params.get('cursor')
+        try:
+            folders, files, next_cursor = paginate(folders, files, parse_sort(request.query_params.get('sort')), cursor)
+        except InvalidCursor:
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+        context = {'request': request}
+        data = {
+            'folders': FolderSerializer(folders, many=True, context=context).data,
+            'files': FileSerializer(files, many=True, context=context).data,
+            'next_cursor': next_cursor,
+        }
+        if not cursor:
+            data['folder'] = FolderSerializer(folder, context=context).data if folder else None
+            data['breadcrumbs'] = BreadcrumbSerializer(get_breadcrumbs(folder), many=True).data
+        return Response(data)
+
+
+class FolderDetailView(APIView):
+    def get(self, request, version, pk):
+        folder = visible_folder(policy_for(request), pk)
+        data = FolderSerializer(folder, context={'request': request}).data
+        data['breadcrumbs'] = BreadcrumbSerializer(get_breadcrumbs(folder), many=True).data
+        return Response(data)
+
+
+class FileDetailView(APIView):
+    def get(self, request, version, pk):
+        return Response(FileSerializer(visible_file(policy_for(request), pk), context={'request': request}).data)
+
+
+class ShareStateView(APIView):
+    """Visibility of a file or folder; owners also get the share link and who it is shared with.
+
+    Unlike the legacy share-info endpoint this never changes the item.
+    """
+
+    def get(self, request, version, kind, pk):
+        policy = policy_for(request)
+        if kind == 'files':
+            obj = visible_file(policy, pk)
+            link_name, permissions = 'share_link_file', Permission.objects.filter(file=obj)
+        else:
+            obj = visible_folder(policy, pk)
+            link_name, permissions = 'share_link_folder', Permission.objects.filter(folder=obj)
+        is_owner = policy.can_manage(obj)
+        data = {'visibility': obj.visibility, 'is_owner': is_owner}
+        if is_owner:
+            data['share_link'] = request.build_absolute_uri(reverse(link_name, args=[obj.share_token]))
+            data['shared_users'] = list(permissions.values('user__username', 'access_level'))
+        return Response(data)
+
+
+class PendingRequestCountView(APIView):
+    """Pending access requests on the user's files and folders, for the drive badge."""
+
+    def get(self, request, version):
+        return Response({'pending': pending_count(request.user)})
@@ -0,0 +1,276 @@
+"""Async implementations of the transfer, upload and sharing endpoints.
+
+Used by storage/urls.py instead of the views of the same name in storage/views.py
+when ASYNC_VIEWS is enabled (i.e. when served under ASGI). Reads go through the
+async ORM; file I/O and crypto run in worker threads; writes that need a
+transaction reuse the synchronous helpers through sync_to_async.
+"""
+import asyncio
+import mimetypes
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.urls import reverse
+from django.views import View
+
+from sharing.models import Permission
+from .access import policy_for
+from .encryption import ciphertext_length
+from .models import File, Folder, UploadSession
+from .streaming import aencrypted_file_response, conditional_response, file_etag, read_plaintext
+from .uploads import (
+    UploadError, abort_session, contiguous_offset, create_session, finalize_session, purge_expired_sessions,
+    write_chunk,
+)
+from .quota import QuotaExceeded, get_usage
+from .views import TEXT_EXTS, can_upload_to, public_cache_key, replace_file_content
+
+
+class AsyncLoginRequiredMixin:
+    """LoginRequiredMixin for async views: resolves the user without blocking the loop."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def get_readable_file(request, file_id):
+    """Fetch a file the user may read, mirroring the checks of the sync views.
+
+    Returns (file, None), or (None, response) when the user has to request access.
+    """
+    file = await aget_object_or_404(File.objects.select_related('blob', 'folder'), id=file_id)
+    if await sync_to_async(policy_for(request).can_read)(file):
+        return file, None
+    if file.visibility == 'ask':
+        messages.error(request, 'You must request access to this file.')
+        return None, redirect('drive')
+    raise Http404()
+
+
+async def get_stored_path(file):
+    file_path = file.blob.file.path
+    if not await asyncio.to_thread(os.path.exists, file_path):
+        raise Http404()
+    return file_path
+
+
+class DownloadFileView(AsyncLoginRequiredMixin, View):
+    async def get(self, request, file_id):
+        file, response = await get_readable_file(request, file_id)
+        if response:
+            return response
+        etag = file_etag(file.blob)
+        not_modified = conditional_response(request, etag, file.updated_at)
+        if not_modified:
+            return not_modified
+        file_path = await get_stored_path(file)
+        return await aencrypted_file_response(
+            request, file_path, file.name, disposition='attachment', last_modified=file.updated_at,
+            codec=file.blob.codec, content_size=file.blob.content_size, cache_key=public_cache_key(file), etag=etag)
+
+
+class ViewFileView(AsyncLoginRequiredMixin, View):
+    template_name = 'storage/view_text_file.html'
+
+    async def get(self, request, file_id):
+        file, response = await get_readable_file(request, file_id)
+        if response:
+            return response
+        ext = os.path.splitext(file.name)[1].lower()
+        if ext in TEXT_EXTS:
+            file_path = await get_stored_path(file)
+            data = await asyncio.to_thread(read_plaintext, file_path, file.blob.codec)
+            return await sync_to_async(render)(
+                request, self.template_name, {'file': file, 'text': data.decode(errors='replace')})
+        etag = file_etag(file.blob)
+        not_modified = conditional_response(request, etag, file.updated_at)
+        if not_modified:
+            return not_modified
+        file_path = await get_stored_path(file)
+        mime, _ = mimetypes.guess_type(file.name)
+        return await aencrypted_file_response(
+            request, file_path, file.name, disposition='inline', content_type=mime or 'application/octet-stream',
+            last_modified=file.updated_at, codec=file.blob.codec, content_size=file.blob.content_size,
+            cache_key=public_cache_key(file), etag=etag)
+
+    async def post(self, request, file_id):
+        file, response = await get_readable_file(request, file_id)
+        if response:
+            return response
+        await get_stored_path(file)
+        ext = os.path.splitext(file.name)[1].lower()
+        if ext not in TEXT_EXTS:
+            return await self.get(request, file_id)
+        new_text = request.POST.get('file_content', '')
+        try:
+            await sync_to_async(replace_file_content)(file, new_text.encode())
+        except QuotaExceeded:
+            messages.error(request, 'Storage quota exceeded.')
+        else:
+            messages.success(request, 'File saved.')
+        return redirect('view_file', file_id=file.id)
+
+
+# --- Resumable chunked uploads ---
+class UploadSessionCreateView(AsyncLoginRequiredMixin, View):
+    async def post(self, request):
+        user = request.user
+        await sync_to_async(purge_expired_sessions)(user)
+        name = request.POST.get('name', '').strip()
+        visibility = request.POST.get('visibility', 'private')
+        try:
+            size = int(request.POST.get('size'))
+        except (TypeError, ValueError):
+            size = -1
+        if not name or size < 0 or visibility not in ['public', 'private', 'ask']:
+            return JsonResponse({'status': 'error', 'message': 'Invalid upload.'}, status=400)
+        folder = None
+        if request.POST.get('folder'):
+            folder = await aget_object_or_404(Folder, id=request.POST.get('folder'))
+        if not await sync_to_async(can_upload_to)(request, folder):
+            return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
+        if size > settings.MAX_FILE_SIZE:
+            return JsonResponse({'status': 'error', 'message': f'File size exceeds the limit of {settings.MAX_FILE_SIZE // (1024*1024)} MB.'}, status=400)
+        if await sync_to_async(get_usage)(user) + ciphertext_length(size) > settings.USER_STORAGE_QUOTA:
+            return JsonResponse({'status': 'error', 'message': 'Storage quota exceeded.'}, status=400)
+        session = await sync_to_async(create_session)(user, folder, name, size, visibility)
+        return JsonResponse({
+            'status': 'success',
+            'upload_id': str(session.id),
+            'chunk_size': session.chunk_size,
+            'chunk_count': session.chunk_count,
+        }, status=201)
+
+
+class UploadSessionView(AsyncLoginRequiredMixin, View):
+    async def get(self, request, upload_id):
+        session = await aget_object_or_404(UploadSession, id=upload_id, owner=request.user)
+        received = [index async for index in session.chunks.order_by('index').values_list('index', flat=True)]
+        return JsonResponse({
+            'status': 'success',
+            'upload_id': str(session.id),
+            'name': session.name,
+            'size': session.size,
+            'chunk_size': session.chunk_size,
+            'chunk_count': session.chunk_count,
+            'received': received,
+            'offset': contiguous_offset(session, received),
+            'expires_at': session.expires_at.isoformat(),
+        })
+
+    async def delete(self, request, upload_id):
+        session = await aget_object_or_404(UploadSession, id=upload_id, owner=request.user)
+        await sync_to_async(abort_session)(session)
+        return JsonResponse({'status': 'success'})
+
+
+class UploadChunkView(AsyncLoginRequiredMixin, View):
+    content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    async def put(self, request, upload_id, index):
+        session = await aget_object_or_404(UploadSession, id=upload_id, owner=request.user)
+        match = self.content_range_re.match(request.headers.get('Content-Range', ''))
+        if not match or int(match.group(3)) != session.size:
+            return JsonResponse({'status': 'error', 'message': 'Missing or invalid Content-Range.'}, status=400)
+        start, end = int(match.group(1)), int(match.group(2))
+        try:
+            await sync_to_async(write_chunk)(session, index, request, start, end - start + 1)
+        except UploadError as e:
+            return JsonResponse({'status': 'error', 'message': e.message}, status=e.status)
+        return JsonResponse({'status': 'success', 'index': index})
+
+
+class UploadFinalizeView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, upload_id):
+        session = await aget_object_or_404(
+            UploadSession.objects.select_related('owner', 'folder'), id=upload_id, owner=request.user)
+        try:
+            file_obj = await sync_to_async(finalize_session)(session)
+        except UploadError as e:
+            return JsonResponse({'status': 'error', 'message': e.message}, status=e.status)
+        return JsonResponse({'status': 'success', 'file_id': file_obj.id, 'message': 'File uploaded and encrypted successfully.'})
+
+
+# --- AJAX endpoints for sharing modal ---
+async def get_share_target(type, id):
+    if type == 'file':
+        obj = await aget_object_or_404(File, id=id)
+        return obj, Permission.objects.filter(file=obj)
+    obj = await aget_object_or_404(Folder, id=id)
+    return obj, Permission.objects.filter(folder=obj)
+
+
+class ShareInfoView(AsyncLoginRequiredMixin, View):
+    async def get(self, request, type, id):
+        policy = policy_for(request)
+        obj, permissions = await get_share_target(type, id)
+        if not await sync_to_async(policy.can_see)(obj):
+            raise Http404()
+        is_owner = policy.can_manage(obj)
+        # If owner requests a share link for a private item, auto-switch to 'ask' mode for secure sharing
+        if obj.visibility == 'private' and is_owner:
+            obj.visibility = 'ask'
+            await obj.asave()
+        link_name = 'share_link_file' if type == 'file' else 'share_link_folder'
+        share_link = request.build_absolute_uri(reverse(link_name, args=[obj.share_token]))
+        # Only whoever can change the grants gets to see them.
+        shared_users = [p async for p in permissions.values('user__username', 'access_level')] if is_owner else []
+        return JsonResponse({
+            'name': obj.name,
+            'share_link': share_link,
+            'visibility': obj.visibility,
+            'is_owner': is_owner,
+            'shared_users': shared_users,
+        })
+
+
+class ShareUpdateView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, type, id):
+        visibility = request.POST.get('visibility')
+        obj, _ = await get_share_target(type, id)
+        if not policy_for(request).can_manage(obj):
+            return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
+        if visibility in ['public', 'private', 'ask']:
+            obj.visibility = visibility
+            await obj.asave()
+            return JsonResponse({'status': 'success', 'visibility': obj.visibility})
+        return JsonResponse({'status': 'error', 'message': 'Invalid visibility.'}, status=400)
+
+
+class ShareAddUserView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, type, id):
+        username = request.POST.get('username')
+        access_level = request.POST.get('access_level', 'read')
+        target_user = await User.objects.filter(username=username).afirst()
+        if not target_user:
+            return JsonResponse({'status': 'error', 'message': 'User not found.'}, status=404)
+        obj, _ = await get_share_target(type, id)
+        if not policy_for(request).can_manage(obj):
+            return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
+        target = {'file': obj} if type == 'file' else {'folder': obj}
+        await Permission.objects.aupdate_or_create(user=target_user, **target, defaults={'access_level': access_level})
+        return JsonResponse({'status': 'success', 'user': username, 'access_level': access_level})
+
+
+class ShareRemoveUserView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, type, id):
+        username = request.POST.get('username')
+        target_user = await User.objects.filter(username=username).afirst()
+        if not target_user:
+            return JsonResponse({'status': 'error', 'message': 'User not found.'}, status=404)
+        obj, permissions = await get_share_target(type, id)
+        if not policy_for(request).can_manage(obj):
+            return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
+        await permissions.filter(user=target_user).adelete()
+        return JsonResponse({'status': 'success', 'user': username})
@@ -0,0 +1,294 @@
+"""In-process benchmarks of every storage and accounts view (see benchmark_views).
+
+Each scenario is one request made through the Django test client against a
+generated dataset (storage.dataset). A profiled run records the query count and
+the peak Python memory allocated while serving the request, then timed runs give
+the p50/p99 latency. Every run happens in a transaction that is rolled back, so
+views that change data see the same dataset each time.
+"""
+import io
+import math
+import statistics
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.db.models.functions import Length
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from sharing.models import Permission
+from .models import AccessRequest, File, Folder
+from .uploads import create_session, write_chunk
+
+PASSWORD = 'bench'
+UPLOAD = b'benchmark upload\n' * 256
+
+
+class Scenario:
+    """A request to time: `path(f, obj)` builds the URL from the fixtures and whatever `setup(f, client)` returned.
+
+    `user` is the fixture the client is logged in as ('anonymous' for none).
+    """
+
+    def __init__(self, name, method, path, user='owner', data=None, setup=None, **extra):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.user = user
+        self.data = data
+        self.setup = setup
+        self.extra = extra
+
+    def request(self, client, f):
+        obj = self.setup(f, client) if self.setup else None
+        data = self.data(f, obj) if callable(self.data) else self.data
+        kwargs = dict(self.extra)
+        if data is not None:
+            kwargs['data'] = data
+        return getattr(client, self.method)(self.path(f, obj), **kwargs)
+
+
+def fixtures(prefix):
+    """Pick the busiest generated users and folders to run the scenarios on, and add what they need."""
+    users = User.objects.filter(username__startswith=prefix).annotate(n=Count('files')).order_by('-n')
+    owner, reader = users[0], users[1]
+    owned = File.objects.filter(owner=owner)
+    f = SimpleNamespace(
+        owner=owner,
+        reader=reader,
+        admin=User.objects.create_superuser(f'{prefix}-admin', password=PASSWORD),
+        big_folder=Folder.objects.filter(owner=owner).annotate(n=Count('files')).order_by('-n').first(),
+        deep_folder=Folder.objects.filter(owner=owner).order_by(Length('path').desc()).first(),
+        text_file=owned.filter(name__endswith='.txt').first(),
+        binary_file=owned.filter(name__endswith='.pdf').first(),
+    )
+    # The share-link views take the public path; the reader can browse the big folder.
+    File.objects.filter(pk=f.text_file.pk).update(visibility='public')
+    Folder.objects.filter(pk=f.big_folder.pk).update(visibility='public')
+    for item in (f.text_file, f.big_folder):
+        item.refresh_from_db()
+    Permission.objects.get_or_create(user=reader, folder=f.big_folder, defaults={'access_level': 'read'})
+    return f
+
+
+def pending_request(f, client):
+    return AccessRequest.objects.create(user=f.reader, file=f.binary_file)
+
+
+def grant(f, client):
+    return Permission.objects.create(user=f.reader, file=f.binary_file, access_level='write')
+
+
+def upload_session(f, client):
+    return create_session(f.owner, None, 'bench.bin', len(UPLOAD), 'private')
+
+
+def uploaded_session(f, client):
+    session = upload_session(f, client)
+    write_chunk(session, 0, io.BytesIO(UPLOAD), 0, len(UPLOAD))
+    return session
+
+
+def logged_in(f, client):
+    client.force_login(f.owner)
+
+
+def drive(**params):
+    return lambda f, obj: f"{reverse('drive')}?{'&'.join(f'{k}={v(f)}' for k, v in params.items())}"
+
+
+def api(name, **kwargs):
+    return lambda f, obj: reverse(name, kwargs={'version': 'v1', **{k: v(f) for k, v in kwargs.items()}})
+
+
+def share(name, kind, item):
+    return lambda f, obj: reverse(name, kwargs={'type': kind, 'id': item(f).pk})
+
+
+def target(kind, item, **extra):
+    return lambda f, obj: {'target_type': kind, 'target_id': item(f).pk,
+                           **{k: v(f) if callable(v) else v for k, v in extra.items()}}
+
+
+def big(f):
+    return f.big_folder.pk
+
+
+def binary(f):
+    return f.binary_file
+
+
+def folder(f):
+    return f.big_folder
+
+
+SCENARIOS = [
+    # accounts
+    Scenario('accounts.signup', 'get', lambda f, obj: reverse('signup'), user='anonymous'),
+    Scenario('accounts.signup.post', 'post', lambda f, obj: reverse('signup'), user='anonymous',
+             data={'username': 'bench-signup', 'password1': 'Bench-pass-123', 'password2': 'Bench-pass-123'}),
+    Scenario('accounts.login', 'get', lambda f, obj: reverse('login'), user='anonymous'),
+    Scenario('accounts.login.post', 'post', lambda f, obj: reverse('login'), user='anonymous',
+             data=lambda f, obj: {'username': f.owner.username, 'password': PASSWORD}),
+    Scenario('accounts.logout', 'post', lambda f, obj: reverse('logout'), user='anonymous', setup=logged_in),
+    Scenario('accounts.dashboard', 'get', lambda f, obj: reverse('dashboard')),
+    # drive
+    Scenario('drive.root', 'get', lambda f, obj: reverse('drive')),
+    Scenario('drive.big_folder', 'get', drive(folder=big)),
+    Scenario('drive.big_folder.grid', 'get', drive(folder=big, view=lambda f: 'grid')),
+    Scenario('drive.big_folder.by_size', 'get', drive(folder=big, sort=lambda f: '-size')),
+    Scenario('drive.deep_folder', 'get', drive(folder=lambda f: f.deep_folder.pk)),
+    Scenario('drive.big_folder.shared', 'get', drive(folder=big), user='reader'),
+    Scenario('drive.upload', 'post', drive(folder=big),
+             data=lambda f, obj: {'upload_file': '1', 'file': SimpleUploadedFile('bench.txt', UPLOAD)}),
+    Scenario('drive.create_folder', 'post', drive(folder=big), data={'create_folder': '1', 'name': 'bench', 'visibility': 'private'}),
+    Scenario('drive.rename', 'post', drive(folder=big), data=target('file', binary, rename='1', name='renamed.pdf')),
+    Scenario('drive.move', 'post', drive(folder=big),
+             data=target('folder', lambda f: f.deep_folder, move='1', destination=big)),
+    Scenario('drive.remove_file', 'post', drive(folder=big), data=target('file', binary, remove='1')),
+    Scenario('drive.remove_folder', 'post', drive(), data=target('folder', folder, remove='1')),
+    Scenario('drive.copy', 'post', drive(), data=target('file', binary, copy='1')),
+    # transfers
+    Scenario('file.download', 'get', lambda f, obj: reverse('download_file', args=[f.binary_file.pk])),
+    Scenario('file.view', 'get', lambda f, obj: reverse('view_file', args=[f.text_file.pk])),
+    Scenario('file.view.binary', 'get', lambda f, obj: reverse('view_file', args=[f.binary_file.pk])),
+    Scenario('file.save', 'post', lambda f, obj: reverse('view_file', args=[f.text_file.pk]),
+             data={'file_content': 'edited by the benchmark\n'}),
+    Scenario('upload.create', 'post', lambda f, obj: reverse('api_upload_create'),
+             data={'name': 'bench.bin', 'size': len(UPLOAD), 'visibility': 'private'}),
+    Scenario('upload.status', 'get', lambda f, obj: reverse('api_upload_session', args=[obj.pk]),
+             setup=upload_session),
+    Scenario('upload.chunk', 'put', lambda f, obj: reverse('api_upload_chunk', args=[obj.pk, 0]),
+             setup=upload_session, data=UPLOAD, content_type='application/octet-stream',
+             HTTP_CONTENT_RANGE=f'bytes 0-{len(UPLOAD) - 1}/{len(UPLOAD)}'),
+    Scenario('upload.finalize', 'post', lambda f, obj: reverse('api_upload_finalize', args=[obj.pk]),
+             setup=uploaded_session),
+    # sharing
+    Scenario('share.form', 'get', lambda f, obj: reverse('share_file', args=[f.binary_file.pk])),
+    Scenario('share.form.post', 'post', lambda f, obj: reverse('share_file', args=[f.binary_file.pk]),
+             data=lambda f, obj: {'username': f.reader.username, 'access_level': 'read'}),
+    Scenario('share.info', 'get', share('api_share_info', 'folder', folder)),
+    Scenario('share.update', 'post', share('api_share_update', 'file', binary), data={'visibility': 'ask'}),
+    Scenario('share.add_user', 'post', share('api_share_add_user', 'file', binary),
+             data=lambda f, obj: {'username': f.reader.username, 'access_level': 'read'}),
+    Scenario('share.remove_user', 'post', share('api_share_remove_user', 'file', binary), setup=grant,
+             data=lambda f, obj: {'username': f.reader.username}),
+    Scenario('share.accept', 'post', lambda f, obj: reverse('accept_access', args=[obj.pk]), setup=grant),
+    Scenario('share_link.file', 'get', lambda f, obj: reverse('share_link_file', args=[f.text_file.share_token]),
+             user='anonymous'),
+    Scenario('share_link.folder', 'get',
+             lambda f, obj: reverse('share_link_folder', args=[f.big_folder.share_token]), user='anonymous'),
+    # access requests
+    Scenario('access.request', 'post', lambda f, obj: reverse('request_access', args=[f.binary_file.pk]),
+             user='reader'),
+    Scenario('access.request_file', 'post',
+             lambda f, obj: reverse('request_access_file', args=[f.binary_file.pk]), user='reader'),
+    Scenario('access.request_folder', 'post',
+             lambda f, obj: reverse('request_access_folder', args=[f.deep_folder.pk]), user='reader'),
+    Scenario('access.inbox', 'get', lambda f, obj: reverse('owner_access_requests')),
+    Scenario('access.approve', 'post', lambda f, obj: reverse('approve_access_request', args=[obj.pk]),
+             setup=pending_request),
+    Scenario('access.reject', 'post', lambda f, obj: reverse('reject_access_request', args=[obj.pk]),
+             setup=pending_request),
+    # superuser
+    Scenario('superuser.dashboard', 'get', lambda f, obj: reverse('superuser_dashboard'), user='admin'),
+    Scenario('superuser.user_files', 'get', lambda f, obj: reverse('superuser_user_files', args=[f.owner.pk]),
+             user='admin'),
+    Scenario('superuser.cache_stats', 'get', lambda f, obj: reverse('api_cache_stats'), user='admin'),
+    # JSON API
+    Scenario('api.listing', 'get', api('api_listing'), data=lambda f, obj: {'folder': f.big_folder.pk}),
+    Scenario('api.folder', 'get', api('api_folder', pk=big)),
+    Scenario('api.file', 'get', api('api_file', pk=lambda f: f.binary_file.pk)),
+    Scenario('api.share_state', 'get', api('api_share_state', kind=lambda f: 'folders', pk=big)),
+    Scenario('api.pending_requests', 'get', api('api_pending_requests')),
+    Scenario('api.token', 'post', api('api_token'), user='anonymous',
+             data=lambda f, obj: {'username': f.owner.username, 'password': PASSWORD}),
+]
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _rolled_back(scenario, client, f):
+    with transaction.atomic():
+        response = scenario.request(client, f)
+        # Streaming responses (downloads) do their work while being consumed.
+        b''.join(response.streaming_content) if response.streaming else response.content
+        transaction.set_rollback(True)
+    return response
+
+
+def measure(scenario, f, iterations):
+    # Server errors are recorded as the status instead of aborting the run.
+    client = Client(raise_request_exception=False)
+    if scenario.user != 'anonymous':
+        client.force_login(getattr(f, scenario.user))
+    _rolled_back(scenario, client, f)  # warm-up: caches, lazy imports, session
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            response = _rolled_back(scenario, client, f)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    # Read now: later requests reset the connection's query log.
+    query_count = len(queries)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        _rolled_back(scenario, client, f)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'status': response.status_code,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': query_count,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run(f, iterations, only=None, log=None):
+    """{scenario name: measurements} for every scenario (or those whose name starts with one of `only`)."""
+    results = {}
+    for scenario in SCENARIOS:
+        if only and not scenario.name.startswith(tuple(only)):
+            continue
+        results[scenario.name] = measure(scenario, f, iterations)
+        if log:
+            log(scenario.name, results[scenario.name])
+    return results
+
+
+def compare(baseline, current, tolerance, noise_ms=2.0):
+    """List (scale, view, metric, before, after) for every measurement that got worse.
+
+    Latency and memory may grow by `tolerance` (a fraction) before they count, and
+    latency differences under `noise_ms` are treated as noise; any extra query counts.
+    """
+    regressions = []
+    for scale, views in current.items():
+        for name, after in views.items():
+            before = baseline.get(scale, {}).get(name)
+            if not before:
+                continue
+            for metric in ['p50_ms', 'p99_ms', 'peak_kib']:
+                limit = before[metric] * (1 + tolerance)
+                if metric.endswith('_ms'):
+                    limit = max(limit, before[metric] + noise_ms)
+                if after[metric] > limit:
+                    regressions.append((scale, name, metric, before[metric], after[metric]))
+            if after['queries'] > before['queries']:
+                regressions.append((scale, name, 'queries', before['queries'], after['queries']))
+            if after['status'] != before['status']:
+                regressions.append((scale, name, 'status', before['status'], after['status']))
+    return regressions
@@ -0,0 +1,157 @@
+import hashlib
+import hmac
+import os
+import struct
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .compression import choose_codec, compress
+from .encryption import ciphertext_length, derive_key, encrypt_stream
+from .models import Blob
+
+# Content digests hash plaintext in fixed blocks and then HMAC the list of block hashes,
+# so chunks hashed independently (and out of order) give the same digest as one
+# sequential pass. Never change this once blobs exist.
+DIGEST_BLOCK_SIZE = 64 * 1024
+
+# 'global' deduplicates identical content across all users; 'user' only within each
+# owner's files, so nobody can learn whether someone else holds a given file.
+DEDUP_SCOPE = getattr(settings, 'BLOB_DEDUP_SCOPE', 'global')
+
+_digest_key = derive_key(b'cr-drive content digest v1')
+
+# Ciphertext lives under MEDIA_ROOT/blobs/<2 hex>/<2 hex>/<id>; see new_blob_path().
+BLOB_DIR = 'blobs'
+
+
+class ContentHasher:
+    def __init__(self):
+        self.length = 0
+        self._buffer = bytearray()
+        self._blocks = []
+
+    def update(self, data):
+        self._buffer += data
+        self.length += len(data)
+        while len(self._buffer) >= DIGEST_BLOCK_SIZE:
+            self._blocks.append(hashlib.sha256(self._buffer[:DIGEST_BLOCK_SIZE]).digest())
+            del self._buffer[:DIGEST_BLOCK_SIZE]
+
+    def finish(self):
+        """Return the concatenated block hashes, including a trailing partial block."""
+        if self._buffer:
+            self._blocks.append(hashlib.sha256(self._buffer).digest())
+            self._buffer = bytearray()
+        return b''.join(self._blocks)
+
+
+def content_digest(owner, length, block_digests):
+    scope = b'global' if DEDUP_SCOPE == 'global' else f'user:{owner.pk}'.encode()
+    message = scope + b'\0' + struct.pack('>Q', length) + block_digests
+    return hmac.new(_digest_key, message, hashlib.sha256).hexdigest()
+
+
+def new_blob_path():
+    """Return (relative_path, absolute_path) for new ciphertext.
+
+    Names are random 128-bit ids, so they never collide and need no probing, and
+    are fanned out over two directory levels by their leading hex digits to keep
+    directories small. Display names live only in the database.
+    """
+    name = uuid.uuid4().hex
+    file_path = f'{BLOB_DIR}/{name[:2]}/{name[2:4]}/{name}'
+    return file_path, os.path.join(settings.MEDIA_ROOT, file_path)
+
+
+def temp_blob_dir():
+    return os.path.join(settings.MEDIA_ROOT, BLOB_DIR, 'tmp')
+
+
+def temp_blob_path():
+    """Return a fresh path to write ciphertext to before commit_blob_file() moves it into place."""
+    temp_dir = temp_blob_dir()
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, uuid.uuid4().hex)
+
+
+def commit_blob_file(temp_path):
+    """Rename finished ciphertext to a new blob path; returns (relative_path, absolute_path).
+
+    The rename is atomic, so a blob path only ever holds complete ciphertext.
+    `temp_path` must be on the same filesystem as MEDIA_ROOT.
+    """
+    file_path, abs_path = new_blob_path()
+    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+    os.replace(temp_path, abs_path)
+    return file_path, abs_path
+
+
+def unlink_quietly(abs_path):
+    try:
+        os.remove(abs_path)
+    except FileNotFoundError:
+        pass
+
+
+def store_blob(digest, place_file, codec='none', content_size=None):
+    """Take a reference on the blob holding the content identified by `digest`.
+
+    If that content is not stored yet, `place_file()` is called to put its ciphertext
+    in place and must return (path relative to MEDIA_ROOT, ciphertext size); `codec`
+    and `content_size` describe that ciphertext. Call this inside the transaction that
+    creates the referencing File.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(digest=digest).first()
+        if blob is None:
+            file_path, stored_size = place_file()
+            try:
+                with transaction.atomic():
+                    return Blob.objects.create(
+                        digest=digest, file=file_path, size=stored_size, codec=codec, content_size=content_size,
+                        ref_count=1)
+            except IntegrityError:
+                # The same content was stored concurrently; ours is redundant.
+                unlink_quietly(os.path.join(settings.MEDIA_ROOT, file_path))
+                blob = Blob.objects.select_for_update().get(digest=digest)
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        return blob
+
+
+def store_content(owner, name, data):
+    """Store in-memory plaintext as a blob, skipping encryption if the content is known."""
+    hasher = ContentHasher()
+    hasher.update(data)
+    digest = content_digest(owner, len(data), hasher.finish())
+    codec = choose_codec(name, data)
+
+    def place_file():
+        stored = compress(codec, data)
+        temp_path = temp_blob_path()
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in encrypt_stream([stored], len(stored)):
+                    f.write(chunk)
+        except BaseException:
+            unlink_quietly(temp_path)
+            raise
+        file_path, _ = commit_blob_file(temp_path)
+        return file_path, ciphertext_length(len(stored))
+
+    return store_blob(digest, place_file, codec, len(data))
+
+
+def share_blob(blob):
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+
+def release_blob(blob_id):
+    """Drop one reference; the last one deletes the blob and, after commit, its ciphertext."""
+    Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+    for blob in Blob.objects.filter(pk=blob_id, ref_count=0):
+        abs_path = blob.file.path
+        blob.delete()
+        transaction.on_commit(lambda: unlink_quietly(abs_path))
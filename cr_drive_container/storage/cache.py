@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .encryption import decrypt_segments
+
+# Per-process LRU of decrypted content, keyed by blob id. Blobs are immutable (an
+# edit stores a new blob), so the blob id doubles as the content version and
+# entries never go stale; invalidation only frees memory early. Only files that are
+# public are served from it, and always after the view's access checks.
+CACHE_SIZE = int(getattr(settings, 'PLAINTEXT_CACHE_SIZE', 0))
+MAX_ENTRY_SIZE = int(getattr(settings, 'PLAINTEXT_CACHE_MAX_ENTRY', 1024 * 1024))
+# Share of the cache a single blob's segments may hold, so one popular large file
+# cannot push everything else out.
+MAX_BLOB_SHARE = float(getattr(settings, 'PLAINTEXT_CACHE_MAX_FILE_SHARE', 0.125))
+
+WHOLE = 'whole'
+
+
+class PlaintextCache:
+    """A byte-bounded LRU of (blob_id, part) -> plaintext, where part is a segment index or WHOLE."""
+
+    def __init__(self, max_bytes, max_entry_bytes, max_blob_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_blob_bytes = max_blob_bytes
+        self._entries = OrderedDict()
+        self._blob_bytes = {}
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.invalidations = 0
+
+    def __contains__(self, key):
+        # Membership only; does not count as a hit or refresh the entry.
+        with self._lock:
+            return key in self._entries
+
+    def get(self, blob_id, part):
+        with self._lock:
+            data = self._entries.get((blob_id, part))
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((blob_id, part))
+            self.hits += 1
+            return data
+
+    def put(self, blob_id, part, data):
+        size = len(data)
+        with self._lock:
+            if (blob_id, part) in self._entries:
+                return
+            if size > self.max_entry_bytes or self._blob_bytes.get(blob_id, 0) + size > self.max_blob_bytes:
+                self.rejections += 1
+                return
+            self._entries[(blob_id, part)] = bytes(data)
+            self._blob_bytes[blob_id] = self._blob_bytes.get(blob_id, 0) + size
+            self.size += size
+            while self.size > self.max_bytes:
+                (old_blob, _), old = self._entries.popitem(last=False)
+                self._discard(old_blob, len(old))
+                self.evictions += 1
+
+    def invalidate(self, blob_id):
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == blob_id]
+            for key in keys:
+                self._discard(blob_id, len(self._entries.pop(key)))
+            if keys:
+                self.invalidations += 1
+
+    def _discard(self, blob_id, size):
+        self.size -= size
+        remaining = self._blob_bytes[blob_id] - size
+        if remaining:
+            self._blob_bytes[blob_id] = remaining
+        else:
+            del self._blob_bytes[blob_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'bytes': self.size,
+                'entries': len(self._entries),
+                'blobs': len(self._blob_bytes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+                'invalidations': self.invalidations,
+            }
+
+
+plaintext_cache = None
+if CACHE_SIZE > 0:
+    plaintext_cache = PlaintextCache(CACHE_SIZE, min(MAX_ENTRY_SIZE, CACHE_SIZE), CACHE_SIZE * MAX_BLOB_SHARE)
+
+
+def cached_segment_reader(blob_id):
+    """Return a decrypt_segments replacement that serves hits from the cache, or None if disabled."""
+    if plaintext_cache is None or blob_id is None:
+        return None
+
+    def segments(fileobj, header, first, last):
+        index = first
+        while index <= last:
+            data = plaintext_cache.get(blob_id, index)
+            if data is not None:
+                yield index, data
+                index += 1
+                continue
+            # Decrypt the run of consecutive misses in one pass.
+            end = index
+            while end < last and (blob_id, end + 1) not in plaintext_cache:
+                end += 1
+            for segment_index, data in decrypt_segments(fileobj, header, index, end):
+                plaintext_cache.put(blob_id, segment_index, data)
+                yield segment_index, data
+            index = end + 1
+
+    return segments
+
+
+def cacheable_whole(blob_id, content_size):
+    """Whether a compressed blob is small enough to be cached as one decompressed entry."""
+    return (plaintext_cache is not None and blob_id is not None and content_size is not None
+            and content_size <= plaintext_cache.max_entry_bytes)
+
+
+def invalidate(blob_id):
+    if plaintext_cache is not None:
+        plaintext_cache.invalidate(blob_id)
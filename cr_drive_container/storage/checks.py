@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from . import access
+
+
+@register(Tags.caches)
+def check_access_cache(app_configs, **kwargs):
+    """Cached sharing grants must live where every process's invalidations reach them."""
+    if settings.ACCESS_CACHE_TIMEOUT and not access.shared_cache():
+        return [Warning(
+            'ACCESS_CACHE_TIMEOUT caches sharing grants in a per-process cache backend.',
+            hint=('Other processes keep serving revoked grants for up to ACCESS_CACHE_TIMEOUT seconds. '
+                  'Configure a shared CACHES backend (e.g. Redis or Memcached) or set ACCESS_CACHE_TIMEOUT=0.'),
+            id='storage.W001',
+        )]
+    return []
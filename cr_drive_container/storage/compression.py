@@ -0,0 +1,91 @@
+import logging
+import os
+import zlib
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Compression happens before encryption (ciphertext does not compress). The codec is
+# recorded on the Blob so downloads know how to undo it.
+CODECS = ('none', 'zlib', 'zstd')
+
+FILE_COMPRESSION = getattr(settings, 'FILE_COMPRESSION', 'zlib')
+if FILE_COMPRESSION not in CODECS:
+    raise ValueError(f'FILE_COMPRESSION must be one of {", ".join(CODECS)}.')
+if FILE_COMPRESSION == 'zstd' and zstandard is None:
+    logger.warning('FILE_COMPRESSION is zstd but the zstandard package is not installed; using zlib.')
+    FILE_COMPRESSION = 'zlib'
+
+# Formats that are already compressed; recompressing them only burns CPU.
+INCOMPRESSIBLE_EXTS = {
+    '.7z', '.apk', '.avi', '.br', '.bz2', '.docx', '.flac', '.gif', '.gz', '.heic', '.jar', '.jpeg', '.jpg',
+    '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.odt', '.ogg', '.pdf', '.png', '.pptx', '.rar', '.tgz', '.webm',
+    '.webp', '.xlsx', '.xz', '.zip', '.zst',
+}
+SAMPLE_SIZE = 64 * 1024
+MIN_SIZE = 512
+# A sample must shrink by at least this much for the file to be stored compressed.
+MIN_SAVING = 0.1
+# Upper bound on plaintext produced per decompression step.
+OUTPUT_CHUNK_SIZE = 256 * 1024
+
+
+def choose_codec(name, sample):
+    """Pick the codec for a file from its name and its first bytes."""
+    if FILE_COMPRESSION == 'none' or len(sample) < MIN_SIZE:
+        return 'none'
+    if os.path.splitext(name)[1].lower() in INCOMPRESSIBLE_EXTS:
+        return 'none'
+    sample = bytes(sample[:SAMPLE_SIZE])
+    if len(zlib.compress(sample, 1)) > len(sample) * (1 - MIN_SAVING):
+        return 'none'
+    return FILE_COMPRESSION
+
+
+def compressor(codec):
+    """Return an object with compress(data) and flush(), or None for 'none'."""
+    if codec == 'zlib':
+        return zlib.compressobj(6)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+def compress(codec, data):
+    comp = compressor(codec)
+    if comp is None:
+        return data
+    return comp.compress(data) + comp.flush()
+
+
+def decompress_stream(codec, chunks):
+    """Yield decompressed data for an iterable of compressed chunks."""
+    if codec == 'none':
+        yield from chunks
+        return
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('The zstandard package is required to read zstd-compressed files.')
+        dobj = zstandard.ZstdDecompressor().decompressobj()
+        for chunk in chunks:
+            out = dobj.decompress(chunk)
+            if out:
+                yield out
+        return
+    dobj = zlib.decompressobj()
+    for chunk in chunks:
+        data = chunk
+        while data:
+            out = dobj.decompress(data, OUTPUT_CHUNK_SIZE)
+            if out:
+                yield out
+            data = dobj.unconsumed_tail
+    out = dobj.flush()
+    if out:
+        yield out
@@ -0,0 +1,57 @@
+"""Bounded worker pool for segment encryption and decryption.
+
+Workers only see the AES key, nonces and segment bytes, so this module does not
+import Django and can be loaded by freshly spawned worker processes.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+_worker_cipher = None
+
+
+def _init_worker(key):
+    global _worker_cipher
+    _worker_cipher = AESGCM(key)
+
+
+def encrypt_batch(nonces, segments, aad):
+    return [_worker_cipher.encrypt(nonce, segment, aad) for nonce, segment in zip(nonces, segments)]
+
+
+def decrypt_batch(nonces, segments, aad):
+    # InvalidTag propagates to the caller through the future.
+    return [_worker_cipher.decrypt(nonce, segment, aad) for nonce, segment in zip(nonces, segments)]
+
+
+class CryptoPool:
+    """A process or thread pool with a cap on queued batches.
+
+    submit() blocks while `max_pending` batches are in flight, so a burst of large
+    transfers waits for crypto capacity instead of queueing unbounded data in memory.
+    """
+
+    def __init__(self, key, workers, kind='process', max_pending=None):
+        if kind == 'thread':
+            self.executor = ThreadPoolExecutor(workers, initializer=_init_worker, initargs=(key,))
+        else:
+            # Workers are forked from a clean server process, not from a threaded request worker.
+            self.executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('forkserver'),
+                initializer=_init_worker, initargs=(key,))
+        self.slots = threading.BoundedSemaphore(max_pending or workers * 4)
+
+    def submit(self, fn, *args):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,199 @@
+"""Synthetic datasets for benchmarking: users, deep folder trees, files and sharing.
+
+Everything is bulk-inserted, so millions of files take minutes rather than hours.
+Ownership, folder sizes, grants and access requests follow Zipf-like distributions:
+a few users own most of the data and receive most of the shares, and a few folders
+hold most of the files, like a real deployment. Files point at a small pool of
+real encrypted blobs (stored through storage.blobstore), so downloads and the text
+editor work on generated files too.
+
+Run it against a scratch database; generated users are named `<prefix><n>` and all
+share the password given to generate().
+"""
+import io
+import random
+import uuid
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
+
+from sharing.models import Permission
+from .blobstore import store_content
+from .models import AccessRequest, Blob, File, Folder
+
+# Sizes of the named presets used by generate_dataset --scale and benchmark_views.
+SCALES = {
+    'small': {'users': 20, 'folders': 200, 'files': 2_000, 'permissions': 200, 'requests': 100},
+    'medium': {'users': 200, 'folders': 5_000, 'files': 100_000, 'permissions': 10_000, 'requests': 5_000},
+    'large': {'users': 2_000, 'folders': 50_000, 'files': 1_000_000, 'permissions': 100_000, 'requests': 50_000},
+    'huge': {'users': 10_000, 'folders': 250_000, 'files': 5_000_000, 'permissions': 500_000, 'requests': 250_000},
+}
+
+BATCH_SIZE = 5000
+EXTENSIONS = ['txt', 'md', 'pdf', 'jpg', 'png', 'zip', 'csv', 'docx']
+TEXT_EXTENSIONS = {'txt', 'md', 'csv'}
+WORDS = 'report draft invoice notes photo backup budget slides archive scan summary plan'.split()
+# private, public, ask
+VISIBILITY_WEIGHTS = [70, 20, 10]
+
+
+class Zipf:
+    """Draws indexes 0..n-1 with probability proportional to 1 / (i + 1) ** s."""
+
+    def __init__(self, rng, n, s=1.1):
+        self.rng = rng
+        self.n = n
+        self.cum = list(accumulate(1 / (i + 1) ** s for i in range(n)))
+
+    def draw(self):
+        return self.rng.choices(range(self.n), cum_weights=self.cum)[0]
+
+
+def _visibility(rng):
+    return rng.choices(['private', 'public', 'ask'], VISIBILITY_WEIGHTS)[0]
+
+
+def _batches(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _stub_blobs(rng, owner, count):
+    # {extension group: [blob, ...]}; text files get text so the editor can open them.
+    stubs = {'text': [], 'binary': []}
+    for i in range(count):
+        if i % 2:
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 2000)))
+            stubs['text'].append(store_content(owner, f'stub{i}.txt', f'{i}\n{words}\n'.encode()))
+        else:
+            data = rng.randbytes(rng.randint(256, 64 * 1024))
+            stubs['binary'].append(store_content(owner, f'stub{i}.bin', data))
+    return stubs
+
+
+def _create_users(prefix, count, password):
+    hashed = make_password(password)
+    users = [User(username=f'{prefix}{i:06d}', password=hashed) for i in range(count)]
+    for batch in _batches(users):
+        User.objects.bulk_create(batch)
+    return list(User.objects.filter(username__startswith=prefix).order_by('username').values_list('pk', flat=True))
+
+
+def _create_folders(rng, users, owners, count, depth):
+    """Create `count` folders spread over `depth` levels; returns {owner_id: [(folder_id, level)]}."""
+    per_owner = {}
+    for _ in range(count):
+        owner = users[owners.draw()]
+        per_owner[owner] = per_owner.get(owner, 0) + 1
+    created = {owner: [] for owner in users}
+    paths = {}
+    for level in range(depth):
+        batch = []
+        for owner, total in per_owner.items():
+            # Each user's folders are split evenly over the levels, so every tree reaches full depth.
+            n = total // depth + (1 if level < total % depth else 0)
+            parents = [pk for pk, lvl in created[owner] if lvl == level - 1]
+            for _ in range(n):
+                parent = rng.choice(parents) if parents else None
+                batch.append(Folder(
+                    name=f'{rng.choice(WORDS)}-{level}-{rng.randrange(10 ** 6)}', owner_id=owner, parent_id=parent,
+                    visibility=_visibility(rng), share_token=uuid.uuid4().hex))
+        for chunk in _batches(batch):
+            Folder.objects.bulk_create(chunk)
+            for folder in chunk:
+                folder.path = f'{paths.get(folder.parent_id, "")}{folder.pk}/'
+                paths[folder.pk] = folder.path
+                created[folder.owner_id].append((folder.pk, level))
+            Folder.objects.bulk_update(chunk, ['path'], batch_size=1000)
+    return created
+
+
+def _files(rng, users, owners, folders, stubs, count):
+    pickers = {}
+    for i in range(count):
+        owner = users[owners.draw()]
+        owned = folders[owner]
+        folder = None
+        # A fifth of the files live at the top level; the rest crowd into a few folders.
+        if owned and rng.random() >= 0.2:
+            picker = pickers.get(owner) or pickers.setdefault(owner, Zipf(rng, len(owned)))
+            folder = owned[picker.draw()][0]
+        ext = rng.choice(EXTENSIONS)
+        blob = rng.choice(stubs['text' if ext in TEXT_EXTENSIONS else 'binary'])
+        yield File(
+            name=f'{rng.choice(WORDS)}-{i}.{ext}', owner_id=owner, folder_id=folder, blob=blob, size=blob.size,
+            visibility=_visibility(rng), share_token=uuid.uuid4().hex)
+
+
+def _create_files(rng, users, owners, folders, stubs, count):
+    file_ids = {}
+    for batch in _batches(_files(rng, users, owners, folders, stubs, count)):
+        File.objects.bulk_create(batch)
+        for file in batch:
+            # Enough candidates for sharing without holding millions of ids.
+            owned = file_ids.setdefault(file.owner_id, [])
+            if len(owned) < 1000:
+                owned.append(file.pk)
+    return file_ids
+
+
+def _sharing_targets(rng, users, owners, folders, files, count):
+    # (grantee, file_id, folder_id) triples; popular users both own and receive the most.
+    seen = set()
+    for _ in range(count * 2):
+        if len(seen) == count:
+            break
+        grantee, owner = users[owners.draw()], users[owners.draw()]
+        if grantee == owner:
+            continue
+        if folders[owner] and rng.random() < 0.3:
+            target = (grantee, None, rng.choice(folders[owner])[0])
+        elif files.get(owner):
+            target = (grantee, rng.choice(files[owner]), None)
+        else:
+            continue
+        if target not in seen:
+            seen.add(target)
+            yield target
+
+
+def generate(users=20, folders=200, files=2000, permissions=200, requests=100, depth=8, stubs=16,
+             prefix='bench', password='bench', seed=0, log=None):
+    """Bulk-create a dataset of the given size; returns the generated users' ids."""
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    with transaction.atomic():
+        user_ids = _create_users(prefix, users, password)
+        log(f'{len(user_ids)} users')
+        owners = Zipf(rng, len(user_ids))
+        blobs = _stub_blobs(rng, User(pk=user_ids[0]), stubs)
+        folder_ids = _create_folders(rng, user_ids, owners, folders, depth)
+        log(f'{folders} folders, {depth} levels deep')
+        file_ids = _create_files(rng, user_ids, owners, folder_ids, blobs, files)
+        log(f'{files} files')
+        for batch in _batches(_sharing_targets(rng, user_ids, owners, folder_ids, file_ids, permissions)):
+            Permission.objects.bulk_create(
+                [Permission(user_id=u, file_id=f, folder_id=d, access_level=rng.choice(['read', 'read', 'write']))
+                 for u, f, d in batch])
+        log(f'{Permission.objects.filter(user__in=user_ids).count()} permissions')
+        for batch in _batches(_sharing_targets(rng, user_ids, owners, folder_ids, file_ids, requests)):
+            AccessRequest.objects.bulk_create(
+                [AccessRequest(user_id=u, file_id=f, folder_id=d,
+                               status=rng.choices(['pending', 'approved', 'rejected'], [70, 20, 10])[0])
+                 for u, f, d in batch])
+        log(f'{AccessRequest.objects.filter(user__in=user_ids).count()} access requests')
+        # store_content() counted one reference per stub; the generated files hold the rest.
+        for blob in [blob for group in blobs.values() for blob in group]:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=File.all_objects.filter(blob=blob).count())
+        call_command('reconcile_storage_usage', stdout=io.StringIO())
+        call_command('rebuild_pending_counts', stdout=io.StringIO())
+    return user_ids
@@ -1,13 +1,387 @@
+import base64
+import os
+import struct
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import BrokenExecutor
+from io import BytesIO
+
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from django.conf import settings
 
+from .cryptopool import CryptoPool, decrypt_batch, encrypt_batch
+
+# Legacy whole-file format: a single Fernet token. Still readable, no longer written.
 fernet = Fernet(settings.FILE_ENCRYPTION_KEY.encode())
 
+# Segmented format (version 1):
+#
+#   header:  magic(4) | version(1) | segment_size(4) | nonce_prefix(7) | plaintext_length(8)
+#   body:    AES-256-GCM segments of `segment_size` plaintext bytes, each followed by a 16 byte tag
+#
+# Every segment is authenticated against the first 16 header bytes, its index and a
+# "last segment" flag (all folded into the nonce), so segments cannot be reordered,
+# dropped or truncated without failing decryption. The plaintext length is kept in the
+# header so sizes and byte offsets can be computed without touching the body.
+MAGIC = b'CRDS'
+FORMAT_VERSION = 1
+HEADER_SIZE = 24
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+SEGMENT_SIZE = int(getattr(settings, 'ENCRYPTION_SEGMENT_SIZE', 64 * 1024))
+
+# Transfers of at least POOL_MIN_SIZE bytes are encrypted/decrypted on a shared worker
+# pool in batches of POOL_BATCH_SEGMENTS segments; smaller ones stay on the request
+# thread, where handing data to a worker would cost more than it saves.
+POOL_WORKERS = int(getattr(settings, 'CRYPTO_POOL_WORKERS', 0))
+POOL_KIND = getattr(settings, 'CRYPTO_POOL_KIND', 'process')
+POOL_MIN_SIZE = int(getattr(settings, 'CRYPTO_POOL_MIN_SIZE', 4 * 1024 * 1024))
+POOL_BATCH_SEGMENTS = max(1, int(getattr(settings, 'CRYPTO_POOL_BATCH_SEGMENTS', 16)))
+POOL_MAX_PENDING = getattr(settings, 'CRYPTO_POOL_MAX_PENDING', None)
+
+_HEADER_STRUCT = struct.Struct('>4sBI7sQ')
+_AAD_SIZE = HEADER_SIZE - 8
+
+
+def derive_key(info):
+    """Derive an independent 32 byte key from FILE_ENCRYPTION_KEY for the given purpose."""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=info,
+    ).derive(base64.urlsafe_b64decode(settings.FILE_ENCRYPTION_KEY))
+
+
+_segment_key = derive_key(b'cr-drive segmented file encryption v1')
+aesgcm = AESGCM(_segment_key)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+SegmentHeader = namedtuple('SegmentHeader', ['version', 'segment_size', 'nonce_prefix', 'plaintext_length', 'aad'])
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def build_header(plaintext_length, segment_size=SEGMENT_SIZE, nonce_prefix=None):
+    if nonce_prefix is None:
+        nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+    return _HEADER_STRUCT.pack(MAGIC, FORMAT_VERSION, segment_size, nonce_prefix, plaintext_length)
+
+
+def parse_header(data):
+    """Return a SegmentHeader, or None if `data` does not start a segmented file."""
+    if data[:len(MAGIC)] != MAGIC:
+        return None
+    if len(data) < HEADER_SIZE:
+        raise DecryptionError('Truncated header.')
+    magic, version, segment_size, nonce_prefix, plaintext_length = _HEADER_STRUCT.unpack(data[:HEADER_SIZE])
+    if version != FORMAT_VERSION or segment_size <= 0:
+        raise DecryptionError(f'Unsupported format version {version}.')
+    return SegmentHeader(version, segment_size, nonce_prefix, plaintext_length, bytes(data[:_AAD_SIZE]))
+
+
+def segment_count(plaintext_length, segment_size=SEGMENT_SIZE):
+    # An empty file still carries one (empty) final segment so truncation is detectable.
+    return max(1, -(-plaintext_length // segment_size))
+
+
+def ciphertext_length(plaintext_length, segment_size=SEGMENT_SIZE):
+    return HEADER_SIZE + segment_count(plaintext_length, segment_size) * TAG_SIZE + plaintext_length
+
+
+def _nonce(header, index, last):
+    return header.nonce_prefix + struct.pack('>IB', index, 1 if last else 0)
+
+
+def encrypt_segment(header, index, data, last):
+    return aesgcm.encrypt(_nonce(header, index, last), bytes(data), header.aad)
+
+
+def decrypt_segment(header, index, data, last):
+    try:
+        return aesgcm.decrypt(_nonce(header, index, last), bytes(data), header.aad)
+    except InvalidTag:
+        raise DecryptionError(f'Segment {index} failed authentication.')
+
+
+def get_pool():
+    """Return the shared crypto pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CryptoPool(_segment_key, POOL_WORKERS, POOL_KIND, POOL_MAX_PENDING)
+    return _pool
+
+
+def _discard_pool(pool):
+    """Forget a pool whose worker died, so the next get_pool() starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+class _Batch:
+    """A batch of segments submitted to the pool, used like its future.
+
+    If the pool is broken (a worker died), the pool is replaced for later batches
+    and result() does this one on the calling thread instead.
+    """
+
+    def __init__(self, fn, nonces, segments, aad):
+        self.args = (nonces, segments, aad)
+        self.fn = fn
+        self.pool = get_pool()
+        try:
+            self.future = self.pool.submit(fn, nonces, segments, aad)
+        except BrokenExecutor:
+            _discard_pool(self.pool)
+            self.future = None
+
+    def done(self):
+        return self.future is None or self.future.done()
+
+    def result(self):
+        if self.future is not None:
+            try:
+                return self.future.result()
+            except BrokenExecutor:
+                _discard_pool(self.pool)
+        nonces, segments, aad = self.args
+        # The workers use the same key as `aesgcm`.
+        op = aesgcm.encrypt if self.fn is encrypt_batch else aesgcm.decrypt
+        return [op(nonce, segment, aad) for nonce, segment in zip(nonces, segments)]
+
+
+def _use_pool(length):
+    return POOL_WORKERS > 0 and length >= POOL_MIN_SIZE
+
+
+def _batched(segments, first):
+    batch = []
+    for segment in segments:
+        batch.append(bytes(segment))
+        if len(batch) == POOL_BATCH_SEGMENTS:
+            yield first, batch
+            first += len(batch)
+            batch = []
+    if batch:
+        yield first, batch
+
+
+def _batch_result(first, batch):
+    try:
+        return first, batch.result()
+    except InvalidTag:
+        raise DecryptionError(f'A segment from {first} on failed authentication.')
+
+
+def _run_batches(fn, header, batches, count):
+    """Run `fn` on the pool for each (first_index, segments) batch, yielding results in order.
+
+    Up to POOL_WORKERS batches of one stream are in flight at once, so a single large
+    file can keep every worker busy without reading arbitrarily far ahead.
+    """
+    pending = deque()
+    for first, segments in batches:
+        nonces = [_nonce(header, index, index == count - 1) for index in range(first, first + len(segments))]
+        pending.append((first, _Batch(fn, nonces, segments, header.aad)))
+        if len(pending) > POOL_WORKERS:
+            yield _batch_result(*pending.popleft())
+    while pending:
+        yield _batch_result(*pending.popleft())
+
+
+def encrypt_segments(header, first, segments, count, length):
+    """Encrypt consecutive plaintext segments starting at index `first`, yielding ciphertext in order.
+
+    `count` is the file's total segment count and `length` the number of plaintext
+    bytes in `segments`, used to decide whether the work goes to the pool.
+    """
+    if not _use_pool(length):
+        for index, data in enumerate(segments, first):
+            yield encrypt_segment(header, index, data, index == count - 1)
+        return
+    for _, out in _run_batches(encrypt_batch, header, _batched(segments, first), count):
+        yield from out
+
+
+class StreamEncryptor:
+    """Incrementally encrypts a byte stream into the segmented format.
+
+    Feed plaintext with update() and finish with finalize(); both return ciphertext
+    that must be written in order after `header`. When the plaintext length is not
+    known up front the header written first carries a zero length; once finalized,
+    `header` reflects the real length and can be written over the first HEADER_SIZE
+    bytes.
+    """
+
+    def __init__(self, plaintext_length=None, segment_size=SEGMENT_SIZE):
+        self.expected_length = plaintext_length
+        self.segment_size = segment_size
+        self.nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self.plaintext_length = 0
+        self._params = parse_header(build_header(0, segment_size, self.nonce_prefix))
+        self._buffer = bytearray()
+        self._index = 0
+        self._pending = deque()
+        self.finalized = False
+
+    @property
+    def header(self):
+        length = self.plaintext_length if self.finalized else (self.expected_length or 0)
+        return build_header(length, self.segment_size, self.nonce_prefix)
+
+    def update(self, data):
+        if self.finalized:
+            raise ValueError('Encryptor already finalized.')
+        self._buffer += data
+        self.plaintext_length += len(data)
+        out = []
+        # Always hold back at least one byte: a full segment can only be sealed once we
+        # know more data follows it, otherwise it has to carry the "last" flag.
+        if self._pending or _use_pool(self.expected_length or self.plaintext_length):
+            self._submit_batches(out)
+        else:
+            while len(self._buffer) > self.segment_size:
+                out.append(encrypt_segment(self._params, self._index, self._buffer[:self.segment_size], False))
+                del self._buffer[:self.segment_size]
+                self._index += 1
+        return b''.join(out)
+
+    def _submit_batches(self, out):
+        batch_size = self.segment_size * POOL_BATCH_SEGMENTS
+        while len(self._buffer) > batch_size:
+            segments = [bytes(self._buffer[i:i + self.segment_size]) for i in range(0, batch_size, self.segment_size)]
+            del self._buffer[:batch_size]
+            nonces = [_nonce(self._params, self._index + i, False) for i in range(len(segments))]
+            self._pending.append(_Batch(encrypt_batch, nonces, segments, self._params.aad))
+            self._index += len(segments)
+            if len(self._pending) > POOL_WORKERS:
+                out.extend(self._pending.popleft().result())
+        while self._pending and self._pending[0].done():
+            out.extend(self._pending.popleft().result())
+
+    def finalize(self):
+        if self.finalized:
+            raise ValueError('Encryptor already finalized.')
+        if self.expected_length is not None and self.expected_length != self.plaintext_length:
+            raise ValueError(f'Expected {self.expected_length} bytes, got {self.plaintext_length}.')
+        out = []
+        while self._pending:
+            out.extend(self._pending.popleft().result())
+        while len(self._buffer) > self.segment_size:
+            out.append(encrypt_segment(self._params, self._index, self._buffer[:self.segment_size], False))
+            del self._buffer[:self.segment_size]
+            self._index += 1
+        out.append(encrypt_segment(self._params, self._index, self._buffer, True))
+        self._buffer = bytearray()
+        self.finalized = True
+        return b''.join(out)
+
+
+def encrypt_stream(chunks, plaintext_length, segment_size=SEGMENT_SIZE):
+    """Yield the segmented ciphertext for an iterable of plaintext chunks."""
+    encryptor = StreamEncryptor(plaintext_length, segment_size)
+    yield encryptor.header
+    for chunk in chunks:
+        data = encryptor.update(chunk)
+        if data:
+            yield data
+    yield encryptor.finalize()
+
+
+def _read_exactly(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise DecryptionError('Unexpected end of file.')
+    return data
+
+
+def decrypt_stream(fileobj):
+    """Yield plaintext chunks from an open ciphertext file, one segment at a time.
+
+    Legacy Fernet files are decrypted in one piece and yielded as a single chunk.
+    Raises DecryptionError if the data has been tampered with or truncated.
+    """
+    start = fileobj.read(HEADER_SIZE)
+    header = parse_header(start)
+    if header is None:
+        try:
+            yield fernet.decrypt(start + fileobj.read())
+        except InvalidToken:
+            raise DecryptionError('Legacy token failed authentication.')
+        return
+    count = segment_count(header.plaintext_length, header.segment_size)
+    for index, data in decrypt_segments(fileobj, header, 0, count - 1):
+        yield data
+    if fileobj.read(1):
+        raise DecryptionError('Trailing data after final segment.')
+
+
+def decrypt_segments(fileobj, header, first, last):
+    """Yield (index, plaintext) for segments `first`..`last` of an open ciphertext file."""
+    size = header.segment_size
+    count = segment_count(header.plaintext_length, size)
+    fileobj.seek(HEADER_SIZE + first * (size + TAG_SIZE))
+
+    def read_segments():
+        for index in range(first, last + 1):
+            length = min(size, header.plaintext_length - index * size)
+            yield _read_exactly(fileobj, length + TAG_SIZE)
+
+    if not _use_pool((last - first + 1) * size):
+        for index, data in enumerate(read_segments(), first):
+            yield index, decrypt_segment(header, index, data, index == count - 1)
+        return
+    for first_index, out in _run_batches(decrypt_batch, header, _batched(read_segments(), first), count):
+        yield from enumerate(out, first_index)
+
+
+def decrypt_range(fileobj, header, start, end, segments=decrypt_segments):
+    """Yield plaintext bytes `start`..`end` (inclusive) of a segmented file.
+
+    Only the segments overlapping the range are read and decrypted, by `segments`
+    (decrypt_segments or a caching wrapper with the same signature).
+    """
+    size = header.segment_size
+    first, last = start // size, end // size
+    for index, data in segments(fileobj, header, first, last):
+        offset = index * size
+        lo = start - offset if index == first else 0
+        hi = end - offset + 1 if index == last else len(data)
+        yield data[lo:hi]
+
+
+def read_header(fileobj):
+    """Return the SegmentHeader of an open ciphertext file, or None for legacy files."""
+    fileobj.seek(0)
+    header = parse_header(fileobj.read(HEADER_SIZE))
+    fileobj.seek(0)
+    return header
+
+
 def encrypt_file(file_bytes):
-    return fernet.encrypt(file_bytes)
+    return b''.join(encrypt_stream([file_bytes], len(file_bytes)))
+
 
 def decrypt_file(encrypted_bytes):
+    header = parse_header(encrypted_bytes[:HEADER_SIZE])
+    if header is None:
+        try:
+            return fernet.decrypt(encrypted_bytes)
+        except InvalidToken:
+            return None
     try:
-        return fernet.decrypt(encrypted_bytes)
-    except InvalidToken:
-        return None 
\ No newline at end of file
+        return b''.join(decrypt_stream(BytesIO(encrypted_bytes)))
+    except DecryptionError:
+        return None
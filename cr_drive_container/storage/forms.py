@@ -2,11 +2,11 @@ from django import forms
 from .models import File, Folder
 
 class FileUploadForm(forms.ModelForm):
+    file = forms.FileField(widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '*/*'}))
     class Meta:
         model = File
-        fields = ['file', 'visibility']
+        fields = ['visibility']
         widgets = {
-            'file': forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '*/*'}),
             'visibility': forms.Select(attrs={'class': 'form-select'}),
         }
     def __init__(self, *args, **kwargs):
@@ -28,6 +28,12 @@ class MoveForm(forms.Form):
     destination = forms.ModelChoiceField(queryset=Folder.objects.none())
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
+        self.target = kwargs.pop('target', None)
         super().__init__(*args, **kwargs)
         if user:
-            self.fields['destination'].queryset = Folder.objects.filter(owner=user) 
\ No newline at end of file
+            self.fields['destination'].queryset = Folder.objects.filter(owner=user)
+    def clean_destination(self):
+        destination = self.cleaned_data['destination']
+        if isinstance(self.target, Folder) and destination.is_within(self.target):
+            raise forms.ValidationError('A folder cannot be moved into itself or one of its subfolders.')
+        return destination 
\ No newline at end of file
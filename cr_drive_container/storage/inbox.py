@@ -0,0 +1,62 @@
+"""Per-owner counts of pending access requests, behind the drive's request badge.
+
+storage.signals adjusts the owner's counter whenever a request is created, leaves
+or re-enters the pending state, or is deleted (cascades included), so reading it
+never touches the request table. delete_requests() removes many requests with
+one update per owner instead. Other bulk writes bypass the signals; run
+`rebuild_pending_counts` after them.
+"""
+from django.contrib.auth.models import User
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import AccessRequest, PendingRequestCount
+
+
+def pending_count(user):
+    """Pending requests on `user`'s files and folders: a single primary-key read."""
+    return PendingRequestCount.objects.filter(user_id=user.pk).values_list('count', flat=True).first() or 0
+
+
+def owner_id(access_request):
+    target = access_request.file if access_request.file_id else access_request.folder
+    return target.owner_id
+
+
+def adjust(owner_id, delta):
+    """Add `delta` to the owner's counter with an atomic UPDATE."""
+    if delta > 0:
+        PendingRequestCount.objects.get_or_create(user_id=owner_id)
+    # Decrements never create the row: they also run while the owner is being deleted.
+    if delta:
+        PendingRequestCount.objects.filter(user_id=owner_id).update(count=F('count') + delta)
+
+
+def rebuild():
+    """Recompute every counter from the requests; returns how many were wrong."""
+    PendingRequestCount.objects.bulk_create(
+        [PendingRequestCount(user_id=pk) for pk in User.objects.filter(pending_requests__isnull=True).values_list('pk', flat=True)],
+        ignore_conflicts=True)
+    counts = (
+        AccessRequest.objects.filter(Q(file__owner=OuterRef('user')) | Q(folder__owner=OuterRef('user')), status='pending')
+        .order_by().values('status').annotate(total=Count('pk')).values('total')
+    )
+    actual = Coalesce(Subquery(counts), Value(0))
+    drifted = PendingRequestCount.objects.annotate(actual=actual).exclude(count=F('actual')).count()
+    PendingRequestCount.objects.update(count=actual)
+    return drifted
+
+
+def delete_requests(requests):
+    """Delete a queryset of requests, decrementing each affected owner's counter once.
+
+    Skips the per-row delete signals, which would look up every request's owner.
+    """
+    pending = (
+        requests.filter(status='pending').order_by().annotate(owner=Coalesce('file__owner', 'folder__owner'))
+        .values('owner').annotate(total=Count('pk'))
+    )
+    for row in pending:
+        adjust(row['owner'], -row['total'])
+    # Nothing references access requests, so there is no cascade to collect.
+    requests._raw_delete(requests.db)
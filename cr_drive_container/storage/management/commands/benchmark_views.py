@@ -0,0 +1,84 @@
+import json
+import platform
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from storage.access import DEFAULT_TIMEOUT
+from storage.benchmark import compare, fixtures, run
+from storage.dataset import SCALES, generate
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every storage and accounts view (latency, queries, peak memory) on generated datasets. '
+            'Runs in throwaway test databases; the configured database is never touched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='small,medium', help=f'Comma-separated presets: {", ".join(SCALES)}.')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per view.')
+        parser.add_argument('--only', action='append', help='Only views whose name starts with this (repeatable).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save', help='Write the results to this JSON file, e.g. as a new baseline.')
+        parser.add_argument('--compare', help='Baseline JSON to compare against; exits non-zero on regressions.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative growth of latency and memory before it counts as a regression.')
+        parser.add_argument('--noise-ms', type=float, default=2.0,
+                            help='Latency differences smaller than this are never regressions.')
+
+    def handle(self, *args, **options):
+        scales = [scale.strip() for scale in options['scales'].split(',') if scale.strip()]
+        unknown = set(scales) - set(SCALES)
+        if unknown:
+            raise CommandError(f'Unknown scales: {", ".join(sorted(unknown))}.')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+        results = {}
+        setup_test_environment(debug=False)
+        try:
+            with tempfile.TemporaryDirectory() as media:
+                for scale in scales:
+                    results[scale] = self.run_scale(scale, media, options)
+        finally:
+            teardown_test_environment()
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump({
+                    'meta': {
+                        'created': timezone.now().isoformat(),
+                        'database': connection.vendor,
+                        'python': platform.python_version(),
+                        'iterations': options['iterations'],
+                    },
+                    'results': results,
+                }, f, indent=2, sort_keys=True)
+            self.stdout.write(f'Saved results to {options["save"]}.')
+        if baseline is not None:
+            regressions = compare(baseline, results, options['tolerance'], options['noise_ms'])
+            for scale, name, metric, before, after in regressions:
+                self.stderr.write(f'REGRESSION {scale} {name}: {metric} {before} -> {after}')
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["compare"]}.')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}.'))
+
+    def run_scale(self, scale, media, options):
+        self.stdout.write(f'== {scale} ==')
+        old_name = connection.settings_dict['NAME']
+        # A fresh cache per scale: user ids restart with every test database.
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': scale}}
+        # Everything runs in this process, so its cache is as good as a shared one for sharing grants.
+        with override_settings(MEDIA_ROOT=media, CACHES=caches, ACCESS_CACHE_TIMEOUT=DEFAULT_TIMEOUT):
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                generate(**SCALES[scale], seed=options['seed'], log=lambda message: self.stdout.write(f'  {message}'))
+                return run(fixtures('bench'), options['iterations'], options['only'], self.report)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:<28} {result["status"]:>4} p50 {result["p50_ms"]:>9.2f} ms  p99 {result["p99_ms"]:>9.2f} ms  '
+            f'{result["queries"]:>4} queries  {result["peak_kib"]:>9.1f} KiB')
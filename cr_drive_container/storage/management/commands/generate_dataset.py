@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from storage.dataset import SCALES, generate
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create a synthetic dataset (users, folder trees, files, grants, access requests) for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small', help='Preset sizes; the options below override them.')
+        for name in ['users', 'folders', 'files', 'permissions', 'requests']:
+            parser.add_argument(f'--{name}', type=int)
+        parser.add_argument('--depth', type=int, default=8, help='Levels of each user\'s folder tree.')
+        parser.add_argument('--prefix', default='bench', help='Username prefix of the generated users.')
+        parser.add_argument('--password', default='bench', help='Password of every generated user.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = {name: options[name] if options[name] is not None else value
+                 for name, value in SCALES[options['scale']].items()}
+        if not sizes['users']:
+            raise CommandError('At least one user is needed.')
+        generate(**sizes, depth=max(1, options['depth']), prefix=options['prefix'], password=options['password'],
+                 seed=options['seed'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated the dataset; log in as {options["prefix"]}000000 / {options["password"]}.'))
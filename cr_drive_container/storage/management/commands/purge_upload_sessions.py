@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from storage.uploads import purge_expired_sessions
+
+class Command(BaseCommand):
+    help = 'Delete expired resumable upload sessions and their partial files.'
+
+    def handle(self, *args, **options):
+        purged = purge_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired upload sessions.'))
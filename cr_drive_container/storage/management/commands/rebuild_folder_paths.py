@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from storage.models import Folder
+
+
+def folder_paths(parents):
+    """Compute materialized paths from a {folder_id: parent_id} map.
+
+    Returns (paths, detached): a {folder_id: path} map, and the ids of folders whose
+    parent was cleared to break a cycle (possible in trees created before moves were
+    checked). `parents` is updated to match.
+    """
+    detached = []
+    state = {}
+    for start in parents:
+        walk = []
+        node = start
+        while node is not None and state.get(node) != 'done':
+            if state.get(node) == 'visiting':
+                parents[node] = None
+                detached.append(node)
+                break
+            state[node] = 'visiting'
+            walk.append(node)
+            node = parents[node]
+        for node in walk:
+            state[node] = 'done'
+    paths = {}
+    for start in parents:
+        chain = []
+        node = start
+        while node is not None and node not in paths:
+            chain.append(node)
+            node = parents[node]
+        prefix = paths[node] if node is not None else ''
+        for node in reversed(chain):
+            prefix = f'{prefix}{node}/'
+            paths[node] = prefix
+    return paths, detached
+
+
+def rebuild(model):
+    """Recompute `path` for every folder of `model`; returns (updated, detached)."""
+    folders = list(model._base_manager.only('pk', 'parent_id', 'path'))
+    parents = {folder.pk: folder.parent_id for folder in folders}
+    paths, detached = folder_paths(parents)
+    changed = []
+    for folder in folders:
+        if folder.path != paths[folder.pk] or folder.parent_id != parents[folder.pk]:
+            folder.path = paths[folder.pk]
+            folder.parent_id = parents[folder.pk]
+            changed.append(folder)
+    model._base_manager.bulk_update(changed, ['path', 'parent'], batch_size=1000)
+    return len(changed), detached
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized path of every folder from its parent links.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated, detached = rebuild(Folder)
+        for pk in detached:
+            self.stderr.write(f'Folder {pk} was part of a cycle and has been moved to the top level.')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt paths; {updated} folders updated.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from storage.inbox import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute every owner\'s pending access request count from the requests.'
+
+    def handle(self, *args, **options):
+        drifted = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt pending request counts; {drifted} owners were out of date.'))
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from storage.models import File
+from storage.reclaim import reclaim_blobs, reclaim_files, reclaim_folders, reclaim_temp_files, with_retries
+
+
+class Command(BaseCommand):
+    help = ('Finish deleting soft-deleted folders: remove their files in batches and unlink unreferenced '
+            'ciphertext and abandoned temporary files.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--retries', type=int, default=3, help='Retries per batch on database errors.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new work.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            self.reclaim(options['batch_size'], options['retries'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def reclaim(self, batch_size, retries):
+        total = File.all_objects.filter(deleted_at__isnull=False).count()
+        done = 0
+        while True:
+            count = with_retries(lambda: reclaim_files(batch_size), retries)
+            if not count:
+                break
+            done += count
+            self.stdout.write(f'Files: {done}/{total}')
+        folders = 0
+        while True:
+            count = with_retries(lambda: reclaim_folders(batch_size), retries)
+            if not count:
+                break
+            folders += count
+        blobs, failed = 0, []
+        while True:
+            count, batch_failed = with_retries(lambda: reclaim_blobs(batch_size, failed), retries)
+            failed += batch_failed
+            if not count and not batch_failed:
+                break
+            blobs += count
+            if count:
+                self.stdout.write(f'Blobs: {blobs} unlinked')
+        temp_files = reclaim_temp_files()
+        if temp_files:
+            self.stdout.write(f'Temporary files: {temp_files} removed')
+        if failed:
+            self.stderr.write(f'{len(failed)} blobs could not be unlinked and will be retried on the next run.')
+        if done or folders or blobs:
+            self.stdout.write(self.style.SUCCESS(f'Reclaimed {done} files, {folders} folders and {blobs} blobs.'))
@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from storage.models import File, StorageUsage
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user\'s storage usage counter from their files.'
+
+    def handle(self, *args, **options):
+        StorageUsage.objects.bulk_create(
+            [StorageUsage(user_id=pk) for pk in User.objects.filter(storage_usage__isnull=True).values_list('pk', flat=True)],
+            ignore_conflicts=True)
+        totals = (
+            File.objects.filter(owner=OuterRef('user')).order_by().values('owner')
+            .annotate(total=Sum('size')).values('total')
+        )
+        actual = Coalesce(Subquery(totals), Value(0))
+        drifted = StorageUsage.objects.annotate(actual=actual).exclude(used=F('actual')).count()
+        # One UPDATE ... SET used = (SELECT SUM(size) ...) for all users.
+        StorageUsage.objects.update(used=actual)
+        self.stdout.write(self.style.SUCCESS(f'Reconciled storage usage; {drifted} users were out of date.'))
@@ -0,0 +1,67 @@
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from storage.blobstore import BLOB_DIR, new_blob_path, temp_blob_path, unlink_quietly
+from storage.models import Blob
+
+SHARDED_NAME = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{32}}$')
+
+
+class Command(BaseCommand):
+    help = 'Move ciphertext stored under the old per-user/per-folder layout into the sharded blob layout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Files to move in parallel.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many blobs would move.')
+
+    def handle(self, *args, **options):
+        pending = [
+            (pk, name) for pk, name in Blob.objects.values_list('pk', 'file').iterator()
+            if not SHARDED_NAME.match(name)
+        ]
+        if options['dry_run']:
+            self.stdout.write(f'{len(pending)} blobs would be relocated.')
+            return
+        with ThreadPoolExecutor(max(1, options['workers'])) as executor:
+            results = list(executor.map(lambda item: self.relocate(*item), pending))
+        moved = results.count('moved')
+        missing = results.count('missing')
+        skipped = results.count('skipped')
+        self.remove_empty_dirs(os.path.join(settings.MEDIA_ROOT, 'files'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Relocated {moved} blobs ({missing} missing on disk, {skipped} changed concurrently).'))
+
+    def relocate(self, pk, old_name):
+        try:
+            old_path = os.path.join(settings.MEDIA_ROOT, old_name)
+            if not os.path.exists(old_path):
+                self.stderr.write(f'Blob {pk}: {old_name} is missing, left as is.')
+                return 'missing'
+            new_name, new_path = new_blob_path()
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            # Link (or copy) first and repoint the row second, so a crash at any
+            # point leaves the blob readable at the path the database has.
+            try:
+                os.link(old_path, new_path)
+            except OSError:
+                temp_path = temp_blob_path()
+                shutil.copyfile(old_path, temp_path)
+                os.replace(temp_path, new_path)
+            if not Blob.objects.filter(pk=pk, file=old_name).update(file=new_name):
+                unlink_quietly(new_path)
+                return 'skipped'
+            unlink_quietly(old_path)
+            return 'moved'
+        finally:
+            # Each worker thread opened its own connection.
+            connection.close()
+
+    def remove_empty_dirs(self, root):
+        for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+            if not os.listdir(dirpath):
+                os.rmdir(dirpath)
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:52
+
+from django.db import migrations
+
+
+def create_blobs(apps, schema_editor):
+    # Existing files keep their ciphertext where it is; each becomes a blob of its own.
+    # Their digests are unknown without decrypting, so they take no part in deduplication.
+    File = apps.get_model('storage', 'File')
+    Blob = apps.get_model('storage', 'Blob')
+    for f in File.objects.filter(blob__isnull=True).iterator():
+        f.blob = Blob.objects.create(file=f.file.name, size=f.size, ref_count=1)
+        f.save(update_fields=['blob'])
+
+
+def restore_file_paths(apps, schema_editor):
+    File = apps.get_model('storage', 'File')
+    for f in File.objects.select_related('blob').iterator():
+        f.file = f.blob.file.name
+        f.save(update_fields=['file'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0005_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_blobs, restore_file_paths),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0006_backfill_blobs'),
+    ]
+
+    operations = [
+        # Defaulted first so that unapplying the removal can re-add the column to existing rows.
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(default='', upload_to='files/'),
+        ),
+        migrations.RemoveField(
+            model_name='file',
+            name='file',
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='files', to='storage.blob'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0007_remove_file_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='codec',
+            field=models.CharField(default='none', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='content_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
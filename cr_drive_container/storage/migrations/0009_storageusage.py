@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_usage(apps, schema_editor):
+    File = apps.get_model('storage', 'File')
+    StorageUsage = apps.get_model('storage', 'StorageUsage')
+    totals = File.objects.values('owner').annotate(total=Sum('size')).order_by()
+    StorageUsage.objects.bulk_create(
+        [StorageUsage(user_id=row['owner'], used=row['total']) for row in totals], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('storage', '0008_blob_codec'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('used', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_usage, migrations.RunPython.noop),
+    ]
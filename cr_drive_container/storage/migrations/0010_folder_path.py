@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:17
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    # Self-contained on purpose: rebuild_folder_paths may change with the current models.
+    Folder = apps.get_model('storage', 'Folder')
+    folders = list(Folder.objects.only('pk', 'parent_id'))
+    parents = {folder.pk: folder.parent_id for folder in folders}
+    # Moves were not checked before this migration, so break any parent cycles first.
+    state = {}
+    for start in parents:
+        walk = []
+        node = start
+        while node is not None and state.get(node) != 'done':
+            if state.get(node) == 'visiting':
+                parents[node] = None
+                break
+            state[node] = 'visiting'
+            walk.append(node)
+            node = parents[node]
+        for node in walk:
+            state[node] = 'done'
+    paths = {}
+    for start in parents:
+        chain = []
+        node = start
+        while node is not None and node not in paths:
+            chain.append(node)
+            node = parents[node]
+        prefix = paths[node] if node is not None else ''
+        for node in reversed(chain):
+            prefix = f'{prefix}{node}/'
+            paths[node] = prefix
+    for folder in folders:
+        folder.path = paths[folder.pk]
+        folder.parent_id = parents[folder.pk]
+    Folder.objects.bulk_update(folders, ['path', 'parent'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0009_storageusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1024),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0011_soft_delete'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', 'name', 'id'], name='file_folder_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', 'size', 'id'], name='file_folder_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', 'created_at', 'id'], name='file_folder_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'name', 'id'], name='folder_parent_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'created_at', 'id'], name='folder_parent_created_idx'),
+        ),
+    ]
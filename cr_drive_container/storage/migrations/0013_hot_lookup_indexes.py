@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0012_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accessrequest',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['file'], name='request_pending_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accessrequest',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['folder'], name='request_pending_folder_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['owner', 'folder'], name='file_owner_folder_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', 'visibility'], name='file_folder_visibility_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['owner', 'parent'], name='folder_owner_parent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'visibility'], name='folder_parent_visibility_idx'),
+        ),
+    ]
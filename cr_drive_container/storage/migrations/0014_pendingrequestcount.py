@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counts(apps, schema_editor):
+    AccessRequest = apps.get_model('storage', 'AccessRequest')
+    PendingRequestCount = apps.get_model('storage', 'PendingRequestCount')
+    counts = {}
+    pending = AccessRequest.objects.filter(status='pending').order_by()
+    for owner_field in ['file__owner', 'folder__owner']:
+        for row in pending.filter(**{f'{owner_field}__isnull': False}).values(owner_field).annotate(total=Count('pk')):
+            counts[row[owner_field]] = counts.get(row[owner_field], 0) + row['total']
+    PendingRequestCount.objects.bulk_create(
+        [PendingRequestCount(user_id=owner, count=total) for owner, total in counts.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('storage', '0013_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRequestCount',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending_requests', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,16 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import User
 import uuid
 
 # Create your models here.
 
+class LiveManager(models.Manager):
+    # Hides rows that were soft-deleted and are waiting for the reclaimer (storage.reclaim).
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 class Folder(models.Model):
     name = models.CharField(max_length=255)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders')
@@ -17,20 +24,81 @@ class Folder(models.Model):
     ]
     visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='private')
     share_token = models.CharField(max_length=64, unique=True, blank=True, null=True)
+    # Materialized path: the ids of the folder's ancestors and its own, e.g. '3/17/42/'.
+    # Kept in sync with `parent` by save(), so a whole subtree is one prefix query.
+    path = models.CharField(max_length=1024, db_index=True, editable=False, default='')
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Keyset pagination of folder listings (storage.pagination); folders have no size.
+        indexes = [
+            models.Index(fields=['parent', 'name', 'id'], name='folder_parent_name_idx'),
+            models.Index(fields=['parent', 'created_at', 'id'], name='folder_parent_created_idx'),
+            # Root listings and the public part of a shared folder.
+            models.Index(fields=['owner', 'parent'], name='folder_owner_parent_idx'),
+            models.Index(fields=['parent', 'visibility'], name='folder_parent_visibility_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.share_token:
             self.share_token = uuid.uuid4().hex
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            old_path = Folder.objects.filter(pk=self.pk).values_list('path', flat=True).first() if self.pk else ''
+            if old_path and self.parent_id and self.parent.path.startswith(old_path):
+                raise ValueError('A folder cannot be moved into itself or one of its subfolders.')
+            super().save(*args, **kwargs)
+            path = f'{self.parent.path if self.parent_id else ""}{self.pk}/'
+            if path != old_path:
+                Folder.objects.filter(pk=self.pk).update(path=path)
+                if old_path:
+                    # Moved: rewrite the prefix of every descendant in one UPDATE.
+                    Folder.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(path), Substr('path', len(old_path) + 1)))
+            self.path = path
+
+    def ancestors(self):
+        """The folders from the root down to and including this one, in one query."""
+        ids = [int(pk) for pk in self.path.split('/') if pk]
+        return sorted(Folder.objects.filter(pk__in=ids), key=lambda folder: len(folder.path))
+
+    def descendants(self):
+        """This folder and everything below it."""
+        return Folder.objects.filter(path__startswith=self.path)
+
+    def subtree_files(self):
+        return File.objects.filter(folder__path__startswith=self.path)
+
+    def is_within(self, other):
+        return self.path.startswith(other.path)
 
     def __str__(self):
         return self.name
 
+class Blob(models.Model):
+    # Deduplicated ciphertext shared by every File with the same content. `digest` is a
+    # keyed hash of the plaintext (see storage.blobstore); blobs carried over from before
+    # deduplication have none.
+    digest = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    file = models.FileField(upload_to='blobs/')
+    size = models.BigIntegerField()
+    # Plaintext is compressed with `codec` before encryption (see storage.compression);
+    # `content_size` is the uncompressed length, unknown for blobs predating compression.
+    codec = models.CharField(max_length=8, default='none')
+    content_size = models.BigIntegerField(null=True, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest or f'blob {self.pk}'
+
 class File(models.Model):
     name = models.CharField(max_length=255)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='files')
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='files', null=True, blank=True)
-    file = models.FileField(upload_to='files/')
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='files')
     size = models.BigIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -41,6 +109,20 @@ class File(models.Model):
     ]
     visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='private')
     share_token = models.CharField(max_length=64, unique=True, blank=True, null=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Keyset pagination of folder listings (storage.pagination).
+        indexes = [
+            models.Index(fields=['folder', 'name', 'id'], name='file_folder_name_idx'),
+            models.Index(fields=['folder', 'size', 'id'], name='file_folder_size_idx'),
+            models.Index(fields=['folder', 'created_at', 'id'], name='file_folder_created_idx'),
+            models.Index(fields=['owner', 'folder'], name='file_owner_folder_idx'),
+            models.Index(fields=['folder', 'visibility'], name='file_folder_visibility_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.share_token:
@@ -50,6 +132,25 @@ class File(models.Model):
     def __str__(self):
         return self.name
 
+class StorageUsage(models.Model):
+    # Running total of File.size per owner, kept up to date by storage.quota so quota
+    # checks do not have to sum every file. `reconcile_storage_usage` recomputes it.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    used = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.used} bytes"
+
+class PendingRequestCount(models.Model):
+    # Pending access requests on each owner's files and folders, kept up to date by
+    # storage.signals so the drive badge is a primary-key read. `rebuild_pending_counts`
+    # recomputes it.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='pending_requests')
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.count} pending"
+
 class AccessRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -63,6 +164,43 @@ class AccessRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     class Meta:
         unique_together = ('user', 'file', 'folder')
+        # An owner's inbox only ever looks at pending requests, a small slice of the table.
+        indexes = [
+            models.Index(fields=['file'], name='request_pending_file_idx',
+                         condition=models.Q(status='pending')),
+            models.Index(fields=['folder'], name='request_pending_folder_idx',
+                         condition=models.Q(status='pending')),
+        ]
     def __str__(self):
         target = self.file if self.file else self.folder
         return f"{self.user.username} requests {target} ({self.status})"
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='upload_sessions', null=True, blank=True)
+    name = models.CharField(max_length=255)
+    visibility = models.CharField(max_length=10, choices=File.VISIBILITY_CHOICES, default='private')
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    header = models.BinaryField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    @property
+    def chunk_count(self):
+        return -(-self.size // self.chunk_size)
+
+    def __str__(self):
+        return f"{self.owner.username} uploading {self.name}"
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    # Concatenated SHA-256 digests of the chunk's plaintext blocks, for the content digest.
+    digests = models.BinaryField(default=b'')
+    class Meta:
+        unique_together = ('session', 'index')
+    def __str__(self):
+        return f"{self.session_id} chunk {self.index}"
@@ -0,0 +1,93 @@
+"""Keyset (cursor) pagination for folder listings.
+
+Each page is read with WHERE (key, id) > (last key, last id) ORDER BY key, id LIMIT n
+against the composite (parent, key, id) indexes on Folder and File, so page 1000 of
+a huge folder costs the same as page 1. Folders are listed before files; the
+opaque cursor records which of the two the next page continues in, the sort and
+the last row's key.
+"""
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+SORT_FIELDS = ['name', 'size', 'created_at']
+CURSOR_SALT = 'storage.pagination'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def parse_sort(value):
+    """Normalise a `sort` query parameter, e.g. '-size'; anything unknown sorts by name."""
+    return value if value and value.lstrip('-') in SORT_FIELDS else 'name'
+
+
+def dump_cursor(state):
+    return signing.dumps(state, salt=CURSOR_SALT, compress=True)
+
+
+def load_cursor(cursor):
+    try:
+        state = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor()
+    if state.get('phase') not in ('folders', 'files'):
+        raise InvalidCursor()
+    return state
+
+
+def _sort_field(sort, model):
+    field = sort.lstrip('-')
+    # Folders have no size; they keep their name order when files are sorted by size.
+    if not any(f.name == field for f in model._meta.concrete_fields):
+        field = 'name'
+    return field, sort.startswith('-')
+
+
+def _page(queryset, sort, key, limit):
+    # Returns up to `limit` rows after `key`, whether more follow, and the key of the last row.
+    field, descending = _sort_field(sort, queryset.model)
+    op = 'lt' if descending else 'gt'
+    if key:
+        value, pk = key
+        if field == 'created_at':
+            value = parse_datetime(value)
+        # The plain range condition lets the index seek straight to `value`; the OR breaks ties by id.
+        queryset = queryset.filter(**{f'{field}__{op}e': value}).filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'pk__{op}': pk}))
+    prefix = '-' if descending else ''
+    rows = list(queryset.order_by(prefix + field, prefix + 'pk')[:limit + 1])
+    rows, more = rows[:limit], len(rows) > limit
+    last = None
+    if rows:
+        value = getattr(rows[-1], field)
+        last = [value.isoformat() if field == 'created_at' else value, rows[-1].pk]
+    return rows, more, last
+
+
+def paginate(folders, files, sort, cursor=None, page_size=None):
+    """Return (folders, files, next_cursor) for one page of a listing.
+
+    `folders` and `files` are unordered querysets of the listing; `cursor` is the
+    value returned for the previous page, and next_cursor is None on the last page.
+    At most one query is made per model.
+    """
+    page_size = page_size or settings.DRIVE_PAGE_SIZE
+    state = load_cursor(cursor) if cursor else {'sort': sort, 'phase': 'folders', 'key': None}
+    sort = parse_sort(state.get('sort'))
+    folder_page = []
+    if state['phase'] == 'folders':
+        folder_page, more, last = _page(folders, sort, state['key'], page_size)
+        if more:
+            return folder_page, [], dump_cursor({'sort': sort, 'phase': 'folders', 'key': last})
+        state = {'phase': 'files', 'key': None}
+    remaining = page_size - len(folder_page)
+    if not remaining:
+        # Folders filled the page; files continue on the next one only if there are any.
+        next_cursor = dump_cursor({'sort': sort, 'phase': 'files', 'key': None}) if files.exists() else None
+        return folder_page, [], next_cursor
+    file_page, more, last = _page(files, sort, state['key'], remaining)
+    next_cursor = dump_cursor({'sort': sort, 'phase': 'files', 'key': last}) if more else None
+    return folder_page, file_page, next_cursor
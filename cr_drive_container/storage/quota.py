@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import StorageUsage
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def get_usage(user):
+    """Bytes currently charged to `user`: a single primary-key read."""
+    return StorageUsage.objects.filter(user_id=user.pk).values_list('used', flat=True).first() or 0
+
+
+def reserve(user, amount):
+    """Charge `amount` bytes (negative to refund) to `user`, or raise QuotaExceeded.
+
+    The usage row is locked until the surrounding transaction ends, so concurrent
+    uploads are checked one after another and cannot overshoot the quota together.
+    Call this inside the transaction that creates or resizes the File.
+    """
+    with transaction.atomic():
+        StorageUsage.objects.get_or_create(user_id=user.pk)
+        usage = StorageUsage.objects.select_for_update().get(user_id=user.pk)
+        if amount > 0 and usage.used + amount > settings.USER_STORAGE_QUOTA:
+            raise QuotaExceeded()
+        StorageUsage.objects.filter(pk=usage.pk).update(used=F('used') + amount)
+
+
+def adjust(user_id, delta):
+    """Add `delta` bytes without a quota check: refunds, and corrections after reserve()."""
+    if delta:
+        StorageUsage.objects.filter(user_id=user_id).update(used=F('used') + delta)
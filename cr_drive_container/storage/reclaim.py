@@ -0,0 +1,130 @@
+"""Soft deletion of folder trees and the background reclaimer that finishes the job.
+
+delete_folder() only flags rows, so removing a folder with any number of files
+is a handful of statements in one transaction. The reclaim_deleted command
+later deletes the flagged rows in batches, drops blob references and unlinks
+ciphertext that nothing refers to any more, including temporary blob files
+abandoned by requests that died before committing them.
+"""
+import logging
+import os
+import time
+from collections import Counter
+
+from django.db import DatabaseError, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from sharing.models import Permission
+from .blobstore import temp_blob_dir, unlink_quietly
+from .inbox import delete_requests
+from .models import AccessRequest, Blob, File, Folder, UploadSession
+from .quota import adjust
+from .uploads import abort_session
+
+logger = logging.getLogger(__name__)
+
+# Temporary ciphertext not written to for this long belongs to a request that died.
+TEMP_FILE_TTL = 24 * 60 * 60
+
+
+def delete_folder(folder):
+    """Remove `folder` and everything below it from view, and refund its files' quota."""
+    with transaction.atomic():
+        folders = folder.descendants()
+        files = folder.subtree_files()
+        for row in files.values('owner').annotate(total=Sum('size')).order_by():
+            adjust(row['owner'], -row['total'])
+        # Grants and requests on vanished items would otherwise linger in sharing views.
+        Permission.objects.filter(Q(file__in=files) | Q(folder__in=folders)).delete()
+        delete_requests(AccessRequest.objects.filter(Q(file__in=files) | Q(folder__in=folders)))
+        now = timezone.now()
+        files.update(deleted_at=now)
+        folders.update(deleted_at=now)
+
+
+def with_retries(step, retries, delay=1.0):
+    """Run `step()`, retrying database errors with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return step()
+        except DatabaseError:
+            if attempt == retries:
+                raise
+            logger.warning('Reclaim step failed, retrying (%d/%d)', attempt + 1, retries, exc_info=True)
+            time.sleep(delay * 2 ** attempt)
+
+
+def reclaim_files(batch_size):
+    """Delete one batch of soft-deleted files and drop their blob references; returns the count."""
+    with transaction.atomic():
+        batch = list(File.all_objects.filter(deleted_at__isnull=False).values_list('pk', 'blob_id')[:batch_size])
+        if not batch:
+            return 0
+        # Quota was refunded by delete_folder and blobs are released below, in bulk, so the
+        # per-file post_delete handler skips these rows.
+        File.all_objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+        for blob_id, count in Counter(blob_id for _, blob_id in batch).items():
+            Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - count)
+        return len(batch)
+
+
+def reclaim_blobs(batch_size, skip=()):
+    """Unlink the ciphertext of one batch of unreferenced blobs and delete their rows.
+
+    Returns (reclaimed, failed_ids). A blob whose file cannot be removed keeps its row
+    so a later run retries it; `skip` excludes ones that already failed in this run.
+    """
+    reclaimed, failed = [], []
+    with transaction.atomic():
+        # Locked so store_blob() cannot take a new reference to a blob being removed.
+        blobs = list(Blob.objects.select_for_update().filter(ref_count=0).exclude(pk__in=skip)[:batch_size])
+        for blob in blobs:
+            try:
+                unlink_quietly(blob.file.path)
+            except OSError:
+                logger.warning('Could not remove %s', blob.file.name, exc_info=True)
+                failed.append(blob.pk)
+            else:
+                reclaimed.append(blob.pk)
+        Blob.objects.filter(pk__in=reclaimed).delete()
+    return len(reclaimed), failed
+
+
+def reclaim_folders(batch_size):
+    """Delete one batch of soft-deleted folders once their files are gone; returns the count.
+
+    The deepest folders go first, so deleting a batch never cascades into the folders
+    below it.
+    """
+    with transaction.atomic():
+        batch = list(
+            Folder.all_objects.filter(deleted_at__isnull=False).order_by(Length('path').desc())
+            .values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return 0
+        for session in UploadSession.objects.filter(folder__in=batch):
+            abort_session(session)
+        # Files uploaded into a folder after it was deleted are live rows; the cascade
+        # removes them through the normal post_delete path.
+        Folder.all_objects.filter(pk__in=batch).delete()
+        return len(batch)
+
+
+def reclaim_temp_files(max_age=TEMP_FILE_TTL):
+    """Unlink temporary blob files untouched for `max_age` seconds; returns the count."""
+    cutoff = time.time() - max_age
+    count = 0
+    try:
+        entries = list(os.scandir(temp_blob_dir()))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                unlink_quietly(entry.path)
+                count += 1
+        except OSError:
+            logger.warning('Could not remove %s', entry.path, exc_info=True)
+    return count
@@ -0,0 +1,50 @@
+from rest_framework import serializers
+
+from .models import File, Folder
+
+
+class FieldSelectionMixin:
+    """Drop every field not named in the request's `?fields=id,name,...`, if given."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        fields = request.query_params.get('fields') if request else None
+        if fields:
+            wanted = set(fields.split(','))
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+
+class BreadcrumbSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Folder
+        fields = ['id', 'name']
+
+
+class FolderSerializer(FieldSelectionMixin, serializers.ModelSerializer):
+    is_owner = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Folder
+        fields = ['id', 'name', 'parent', 'visibility', 'created_at', 'is_owner']
+
+    def get_is_owner(self, obj):
+        return obj.owner_id == self.context['request'].user.id
+
+
+class FileSerializer(FieldSelectionMixin, serializers.ModelSerializer):
+    is_owner = serializers.SerializerMethodField()
+    # Annotated by storage.views.with_access_flags.
+    shared_with_user = serializers.BooleanField(read_only=True)
+    access_pending = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = File
+        fields = [
+            'id', 'name', 'folder', 'size', 'visibility', 'created_at', 'updated_at',
+            'is_owner', 'shared_with_user', 'access_pending',
+        ]
+
+    def get_is_owner(self, obj):
+        return obj.owner_id == self.context['request'].user.id
@@ -0,0 +1,57 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from sharing.models import Permission
+from . import access, cache, inbox
+from .blobstore import release_blob
+from .models import AccessRequest, Blob, File
+from .quota import adjust
+
+
+@receiver(post_delete, sender=File)
+def release_file_blob(sender, instance, **kwargs):
+    # Also runs for files removed by folder/user cascades. Soft-deleted files were
+    # refunded when deleted and are released in bulk by the reclaimer.
+    if instance.deleted_at is not None:
+        return
+    release_blob(instance.blob_id)
+    adjust(instance.owner_id, -instance.size)
+
+
+@receiver(post_save, sender=File)
+def drop_unshared_plaintext(sender, instance, **kwargs):
+    # A file that stops being public should not keep its plaintext in memory.
+    if instance.visibility != 'public':
+        cache.invalidate(instance.blob_id)
+
+
+@receiver(post_delete, sender=Blob)
+def drop_blob_plaintext(sender, instance, **kwargs):
+    # Fires once the last reference is released.
+    cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_grants(sender, instance, **kwargs):
+    access.invalidate(instance.user_id)
+
+
+@receiver(pre_save, sender=AccessRequest)
+def remember_request_status(sender, instance, **kwargs):
+    instance._was_pending = bool(instance.pk) and AccessRequest.objects.filter(pk=instance.pk, status='pending').exists()
+
+
+@receiver(post_save, sender=AccessRequest)
+def count_request_status(sender, instance, **kwargs):
+    delta = (instance.status == 'pending') - instance._was_pending
+    if delta:
+        inbox.adjust(inbox.owner_id(instance), delta)
+
+
+@receiver(pre_delete, sender=AccessRequest)
+def uncount_deleted_request(sender, instance, **kwargs):
+    # Before the delete, while a cascade has not yet removed the file or folder; a failed
+    # delete rolls this back with it.
+    if instance.status == 'pending':
+        inbox.adjust(inbox.owner_id(instance), -1)
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import re
+import uuid
+
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from . import cache
+from .compression import decompress_stream
+from .encryption import (
+    DecryptionError, decrypt_file, decrypt_range, decrypt_segments, decrypt_stream, read_header,
+)
+
+logger = logging.getLogger(__name__)
+
+# More ranges than this in one request is treated as abuse and answered with the full body.
+MAX_RANGES = 16
+
+_RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_range_header(value, length):
+    """Parse a `Range: bytes=...` header against a body of `length` bytes.
+
+    Returns a sorted list of merged inclusive (start, end) pairs, an empty list if no
+    range is satisfiable, or None if the header is malformed and should be ignored.
+    """
+    unit, _, specs = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        match = _RANGE_SPEC.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # Suffix range: the final N bytes.
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            start, end = max(0, length - suffix), length - 1
+        else:
+            start = int(first)
+            end = min(int(last), length - 1) if last else length - 1
+            if last and int(last) < start:
+                return None
+        if start < length:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def file_etag(blob):
+    """Strong ETag for a file's contents: blobs are immutable, so their digest never changes."""
+    return f'"{blob.digest or f"blob-{blob.pk}"}"'
+
+
+def _validators(etag, last_modified):
+    response = HttpResponse()
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Clients may keep a copy but must revalidate it, which is cheap.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_response(request, etag, last_modified=None):
+    """Answer a conditional GET from the validators alone, before the file is opened.
+
+    Returns a 304 (or 412 for a failed If-Match / If-Unmodified-Since), or None when
+    the full response has to be built.
+    """
+    validators = _validators(etag, last_modified)
+    timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+    response = get_conditional_response(request, etag, timestamp, validators)
+    return None if response is validators else response
+
+
+def _if_range_matches(request, etag, last_modified):
+    value = request.META.get('HTTP_IF_RANGE')
+    if value is None:
+        return True
+    if value.startswith(('"', 'W/')):
+        # Strong comparison: a weak tag never matches.
+        return etag is not None and value == etag
+    if last_modified is None:
+        return False
+    return parse_http_date_safe(value) == int(last_modified.timestamp())
+
+
+def _stream_plaintext(fileobj, path, codec='none'):
+    try:
+        yield from decompress_stream(codec, decrypt_stream(fileobj))
+    except DecryptionError:
+        # Headers are already on the wire; all we can do is cut the body short.
+        logger.exception('Decryption failed mid-stream for %s', path)
+    finally:
+        fileobj.close()
+
+
+def _stream_ranges(fileobj, path, header, ranges, boundary=None, content_type=None, segments=decrypt_segments):
+    try:
+        for start, end in ranges:
+            if boundary:
+                yield _part_header(boundary, content_type, start, end, header.plaintext_length)
+            yield from decrypt_range(fileobj, header, start, end, segments)
+            if boundary:
+                yield b'\r\n'
+        if boundary:
+            yield f'--{boundary}--\r\n'.encode()
+    except DecryptionError:
+        logger.exception('Decryption failed mid-stream for %s', path)
+    finally:
+        fileobj.close()
+
+
+def _part_header(boundary, content_type, start, end, length):
+    return (
+        f'--{boundary}\r\n'
+        f'Content-Type: {content_type}\r\n'
+        f'Content-Range: bytes {start}-{end}/{length}\r\n\r\n'
+    ).encode()
+
+
+def read_plaintext(path, codec='none'):
+    """Decrypt a whole file into memory. Only for callers that need the full contents."""
+    with open(path, 'rb') as f:
+        try:
+            return b''.join(decompress_stream(codec, decrypt_stream(f)))
+        except DecryptionError:
+            raise Http404('File decryption failed.')
+
+
+def encrypted_file_response(request, path, filename, disposition='attachment',
+                            content_type='application/octet-stream', last_modified=None,
+                            codec='none', content_size=None, cache_key=None, etag=None):
+    """Build a response that decrypts `path` segment by segment as the client reads it.
+
+    Honours `Range` (single and multiple byte ranges) and `If-Range`, decrypting only
+    the segments that overlap the requested bytes. Compressed files (`codec` other
+    than 'none', `content_size` bytes once decompressed) are always sent whole.
+    With a `cache_key` (the blob id) decrypted content is kept in the plaintext cache.
+    `etag` and `last_modified` are sent as validators; callers should try
+    conditional_response() first.
+    """
+    fileobj = open(path, 'rb')
+    try:
+        header = read_header(fileobj)
+    except DecryptionError:
+        fileobj.close()
+        raise Http404('File decryption failed.')
+    if header is None:
+        # Legacy Fernet file: it can only be decrypted in one piece, so ranges are not offered.
+        with fileobj:
+            decrypted_bytes = decrypt_file(fileobj.read())
+        if decrypted_bytes is None:
+            raise Http404('File decryption failed.')
+        response = HttpResponse(decrypted_bytes, content_type=content_type)
+        response['Accept-Ranges'] = 'none'
+    elif codec != 'none' and cache.cacheable_whole(cache_key, content_size):
+        data = cache.plaintext_cache.get(cache_key, cache.WHOLE)
+        with fileobj:
+            if data is None:
+                try:
+                    data = b''.join(decompress_stream(codec, decrypt_stream(fileobj)))
+                except DecryptionError:
+                    raise Http404('File decryption failed.')
+                cache.plaintext_cache.put(cache_key, cache.WHOLE, data)
+        response = HttpResponse(data, content_type=content_type)
+        response['Accept-Ranges'] = 'none'
+    elif codec != 'none':
+        # Plaintext offsets do not map onto compressed segments, so ranges are not offered.
+        response = StreamingHttpResponse(_stream_plaintext(fileobj, path, codec), content_type=content_type)
+        if content_size is not None:
+            response['Content-Length'] = content_size
+        response['Accept-Ranges'] = 'none'
+    else:
+        length = header.plaintext_length
+        segments = cache.cached_segment_reader(cache_key) or decrypt_segments
+        ranges = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and request.method == 'GET' and _if_range_matches(request, etag, last_modified):
+            ranges = parse_range_header(range_header, length)
+        if ranges == []:
+            fileobj.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{length}'
+            return response
+        if not ranges and (segments is decrypt_segments or not length):
+            response = StreamingHttpResponse(_stream_plaintext(fileobj, path), content_type=content_type)
+            response['Content-Length'] = length
+        elif not ranges:
+            # The whole body as a single range, so it goes through the segment cache.
+            response = StreamingHttpResponse(
+                _stream_ranges(fileobj, path, header, [(0, length - 1)], segments=segments), content_type=content_type)
+            response['Content-Length'] = length
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(
+                _stream_ranges(fileobj, path, header, ranges, segments=segments), status=206, content_type=content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{length}'
+        else:
+            boundary = uuid.uuid4().hex
+            body_length = len(f'--{boundary}--\r\n')
+            for start, end in ranges:
+                body_length += len(_part_header(boundary, content_type, start, end, length)) + end - start + 1 + 2
+            response = StreamingHttpResponse(
+                _stream_ranges(fileobj, path, header, ranges, boundary, content_type, segments),
+                status=206, content_type=f'multipart/byteranges; boundary={boundary}')
+            response['Content-Length'] = body_length
+        response['Accept-Ranges'] = 'bytes'
+    validators = _validators(etag, last_modified)
+    for name in ('ETag', 'Last-Modified', 'Cache-Control'):
+        if name in validators:
+            response[name] = validators[name]
+    response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    return response
+
+
+async def _iterate_in_thread(iterator):
+    """Drive a blocking iterator from worker threads, one item at a time."""
+    done = object()
+    while True:
+        chunk = await asyncio.to_thread(next, iterator, done)
+        if chunk is done:
+            break
+        yield chunk
+
+
+async def aencrypted_file_response(request, path, filename, **kwargs):
+    """Async variant of encrypted_file_response for ASGI views.
+
+    File reads and decryption run in worker threads chunk by chunk, so a slow
+    client holds no thread between chunks, only the event loop task.
+    """
+    response = await asyncio.to_thread(encrypted_file_response, request, path, filename, **kwargs)
+    if response.streaming:
+        response.streaming_content = _iterate_in_thread(iter(response.streaming_content))
+    return response
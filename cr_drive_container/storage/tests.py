@@ -1,3 +1,1149 @@
-from django.test import TestCase
+import importlib
+import os
+import re
+import signal
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils.http import http_date
+
+from sharing.models import Permission
+from . import access, async_views, encryption
+from . import urls as storage_urls
+from .benchmark import compare
+from .blobstore import release_blob, share_blob, store_content, temp_blob_path
+from .cache import WHOLE, PlaintextCache
+from .checks import check_access_cache
+from .dataset import generate
+from .encryption import (
+    HEADER_SIZE, DecryptionError, StreamEncryptor, ciphertext_length, decrypt_file, decrypt_range, decrypt_segment,
+    decrypt_stream, encrypt_stream, fernet, parse_header,
+)
+from .inbox import pending_count, rebuild
+from .management.commands.rebuild_folder_paths import folder_paths
+from .models import AccessRequest, Blob, File, Folder, PendingRequestCount, UploadSession
+from .pagination import paginate
+from .quota import QuotaExceeded, adjust, get_usage, reserve
+from .reclaim import delete_folder
+from .streaming import file_etag
+from .uploads import UploadError, finalize_session
+from .views import with_access_flags
+
+
+class DriveTestCase(TestCase):
+    def setUp(self):
+        # Cached sharing grants (storage.access) would outlive earlier tests' rolled-back rows.
+        cache.clear()
+
+
+class TemporaryMediaMixin:
+    """Stores blobs under a temporary MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+
+class MediaTestCase(TemporaryMediaMixin, DriveTestCase):
+    pass
+
+
+class SegmentedEncryptionTests(SimpleTestCase):
+    segment_size = 1024
+
+    def encrypt(self, data):
+        return b''.join(encrypt_stream([data], len(data), self.segment_size))
+
+    def decrypt(self, ciphertext):
+        return b''.join(decrypt_stream(BytesIO(ciphertext)))
+
+    def test_round_trip_at_segment_boundaries(self):
+        size = self.segment_size
+        for length in [0, 1, size - 1, size, size + 1, 3 * size]:
+            with self.subTest(length=length):
+                data = os.urandom(length)
+                ciphertext = self.encrypt(data)
+                self.assertEqual(len(ciphertext), ciphertext_length(length, size))
+                self.assertEqual(self.decrypt(ciphertext), data)
+                self.assertEqual(decrypt_file(ciphertext), data)
+
+    def test_stream_encryptor_with_unknown_length(self):
+        data = os.urandom(3 * self.segment_size + 7)
+        encryptor = StreamEncryptor(segment_size=self.segment_size)
+        body = b''.join(encryptor.update(data[i:i + 700]) for i in range(0, len(data), 700)) + encryptor.finalize()
+        self.assertEqual(self.decrypt(encryptor.header + body), data)
+
+    def test_tampering_is_detected(self):
+        size = self.segment_size
+        ciphertext = self.encrypt(os.urandom(2 * size + 10))
+        flipped = bytearray(ciphertext)
+        flipped[HEADER_SIZE + size + 20] ^= 1
+        # A shorter length in the header makes segment 0 the last one.
+        shortened = ciphertext[:16] + size.to_bytes(8, 'big') + ciphertext[HEADER_SIZE:]
+        cases = {
+            'modified segment': bytes(flipped),
+            'truncated final segment': ciphertext[:-1],
+            'dropped final segment': ciphertext[:HEADER_SIZE + 2 * (size + 16)],
+            'trailing data': ciphertext + b'x',
+            'modified nonce prefix': ciphertext[:10] + bytes([ciphertext[10] ^ 1]) + ciphertext[11:],
+            'shortened length': shortened,
+        }
+        for name, tampered in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(DecryptionError):
+                    self.decrypt(tampered)
+                self.assertIsNone(decrypt_file(tampered))
+
+    def test_segments_are_bound_to_the_header(self):
+        ciphertext = self.encrypt(b'secret')
+        header = parse_header(ciphertext)
+        segment = ciphertext[HEADER_SIZE:]
+        self.assertEqual(decrypt_segment(header, 0, segment, True), b'secret')
+        other = header._replace(aad=header.aad[:5] + b'\x00\x00\x08\x00' + header.aad[9:])
+        with self.assertRaises(DecryptionError):
+            decrypt_segment(other, 0, segment, True)
+        with self.assertRaises(DecryptionError):
+            decrypt_segment(header, 0, segment, False)
+
+    def test_reads_legacy_fernet_files(self):
+        token = fernet.encrypt(b'old file')
+        self.assertEqual(self.decrypt(token), b'old file')
+        self.assertEqual(decrypt_file(token), b'old file')
+        with self.assertRaises(DecryptionError):
+            self.decrypt(token[:-4])
+
+
+class DecryptRangeTests(SimpleTestCase):
+    def test_ranges_across_segment_edges(self):
+        size = 1024
+        data = os.urandom(3 * size + 100)
+        ciphertext = BytesIO(b''.join(encrypt_stream([data], len(data), size)))
+        header = parse_header(ciphertext.getvalue())
+        ranges = [(0, 0), (0, size - 1), (size - 1, size), (size, 2 * size - 1), (size - 5, 2 * size + 5),
+                  (3 * size, len(data) - 1), (len(data) - 1, len(data) - 1), (0, len(data) - 1)]
+        for start, end in ranges:
+            with self.subTest(start=start, end=end):
+                self.assertEqual(b''.join(decrypt_range(ciphertext, header, start, end)), data[start:end + 1])
+
+
+class DownloadRangeTests(MediaTestCase):
+    def test_single_range(self):
+        owner = User.objects.create_user('owner', password='pw')
+        data = os.urandom(200 * 1024)
+        file = File.objects.create(name='data.bin', owner=owner, blob=store_content(owner, 'data.bin', data),
+                                   size=len(data))
+        self.client.force_login(owner)
+        response = self.client.get(reverse('download_file', args=[file.id]), HTTP_RANGE='bytes=65530-131080')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 65530-131080/{len(data)}')
+        self.assertEqual(b''.join(response.streaming_content), data[65530:131081])
+
+
+class ConditionalDownloadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.data = os.urandom(100 * 1024)
+        self.file = File.objects.create(name='data.bin', owner=self.owner, size=len(self.data),
+                                        blob=store_content(self.owner, 'data.bin', self.data))
+        self.url = reverse('download_file', args=[self.file.id])
+        self.etag = file_etag(self.file.blob)
+        self.modified = http_date(self.file.updated_at.timestamp())
+        self.client.force_login(self.owner)
+
+    def test_validators_are_sent(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Last-Modified'], self.modified)
+
+    def test_not_modified_without_reading_the_file(self):
+        os.remove(self.file.blob.file.path)
+        for view in ('download_file', 'view_file'):
+            response = self.client.get(reverse(view, args=[self.file.id]), HTTP_IF_NONE_MATCH=self.etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=self.modified).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 404)
+
+    def test_failed_preconditions(self):
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MATCH='"other"').status_code, 412)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MATCH=self.etag).status_code, 200)
+        earlier = http_date(self.file.updated_at.timestamp() - 60)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_UNMODIFIED_SINCE=earlier).status_code, 412)
+
+    def test_if_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[:10])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    def test_no_not_modified_without_read_access(self):
+        other = User.objects.create_user('other', password='pw')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag).status_code, 404)
+        File.objects.filter(pk=self.file.pk).update(visibility='ask')
+        self.assertRedirects(self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag), reverse('drive'))
+
+
+class PlaintextCacheTests(SimpleTestCase):
+    def test_least_recently_used_is_evicted_first(self):
+        plaintext = PlaintextCache(30, 10, 30)
+        for blob_id in (1, 2, 3):
+            plaintext.put(blob_id, 0, b'x' * 10)
+        self.assertEqual(plaintext.get(1, 0), b'x' * 10)
+        plaintext.put(4, 0, b'y' * 10)
+        self.assertNotIn((2, 0), plaintext)
+        self.assertIn((1, 0), plaintext)
+        self.assertEqual(plaintext.get(2, 0), None)
+        self.assertEqual(plaintext.stats(), {
+            'max_bytes': 30, 'bytes': 30, 'entries': 3, 'blobs': 3, 'hits': 1, 'misses': 1,
+            'evictions': 1, 'rejections': 0, 'invalidations': 0})
+
+    def test_byte_limit_counts_entry_sizes(self):
+        plaintext = PlaintextCache(25, 20, 25)
+        plaintext.put(1, 0, b'x' * 10)
+        plaintext.put(2, 0, b'x' * 10)
+        plaintext.put(3, 0, b'x' * 20)
+        self.assertEqual(plaintext.stats()['bytes'], 20)
+        self.assertEqual(plaintext.stats()['evictions'], 2)
+
+    def test_entry_and_blob_caps(self):
+        plaintext = PlaintextCache(100, 10, 20)
+        plaintext.put(1, WHOLE, b'x' * 11)
+        for index in range(3):
+            plaintext.put(2, index, b'x' * 10)
+        self.assertNotIn((1, WHOLE), plaintext)
+        self.assertEqual([(2, index) in plaintext for index in range(3)], [True, True, False])
+        self.assertEqual(plaintext.stats()['rejections'], 2)
+
+    def test_invalidate_drops_every_part_of_a_blob(self):
+        plaintext = PlaintextCache(100, 10, 100)
+        for index in range(3):
+            plaintext.put(1, index, b'x' * 10)
+        plaintext.put(2, 0, b'x' * 10)
+        plaintext.invalidate(1)
+        stats = plaintext.stats()
+        self.assertEqual((stats['bytes'], stats['entries'], stats['blobs'], stats['invalidations']), (10, 1, 1, 1))
+        # Freed bytes are available to the blob again.
+        plaintext.put(1, 0, b'x' * 10)
+        self.assertIn((1, 0), plaintext)
+
+
+class PlaintextCacheViewTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('storage.cache.plaintext_cache', PlaintextCache(1024 * 1024, 256 * 1024, 1024 * 1024))
+        self.plaintext = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.owner)
+
+    def public_file(self, name, data):
+        return File.objects.create(name=name, owner=self.owner, visibility='public', size=len(data),
+                                   blob=store_content(self.owner, name, data))
+
+    def download(self, file):
+        response = self.client.get(reverse('download_file', args=[file.id]))
+        return response.content if not response.streaming else b''.join(response.streaming_content)
+
+    def test_segments_are_dropped_when_the_file_goes_private(self):
+        data = os.urandom(100 * 1024)
+        file = self.public_file('data.bin', data)
+        self.assertEqual(self.download(file), data)
+        self.assertEqual(self.download(file), data)
+        self.assertIn((file.blob_id, 1), self.plaintext)
+        self.assertGreater(self.plaintext.stats()['hits'], 0)
+        response = self.client.post(reverse('api_share_update', args=['file', file.id]), {'visibility': 'private'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.plaintext.stats()['entries'], 0)
+        self.assertEqual(self.download(file), data)
+        self.assertEqual(self.plaintext.stats()['entries'], 0)
+
+    def test_old_content_is_dropped_when_the_file_is_edited(self):
+        text = b'Line after line of text.\n' * 500 + os.urandom(8).hex().encode()
+        file = self.public_file('notes.txt', text)
+        self.assertNotEqual(file.blob.codec, 'none')
+        self.assertEqual(self.download(file), text)
+        self.assertIn((file.blob_id, WHOLE), self.plaintext)
+        old_blob = file.blob_id
+        self.client.post(reverse('view_file', args=[file.id]), {'file_content': 'new text'})
+        file.refresh_from_db()
+        self.assertNotEqual(file.blob_id, old_blob)
+        self.assertNotIn((old_blob, WHOLE), self.plaintext)
+        self.assertEqual(self.download(file), b'new text')
+
+
+@mock.patch('storage.uploads.CHUNK_SIZE', 64 * 1024)
+class ChunkedUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.owner)
+
+    def start(self, name, size):
+        response = self.client.post(reverse('api_upload_create'), {'name': name, 'size': size})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['upload_id']
+
+    def put(self, upload_id, index, data, size):
+        start = index * 64 * 1024
+        return self.client.put(
+            reverse('api_upload_chunk', args=[upload_id, index]), data, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{start + len(data) - 1}/{size}')
+
+    def finalize(self, upload_id):
+        response = self.client.post(reverse('api_upload_finalize', args=[upload_id]))
+        self.assertEqual(response.status_code, 200, response.content)
+        return File.objects.get(pk=response.json()['file_id'])
+
+    def download(self, file):
+        return b''.join(self.client.get(reverse('download_file', args=[file.id])).streaming_content)
+
+    def test_chunks_in_any_order(self):
+        data = os.urandom(150 * 1024)
+        upload_id = self.start('data.bin', len(data))
+        for index in [2, 0, 1]:
+            chunk = data[index * 64 * 1024:(index + 1) * 64 * 1024]
+            self.assertEqual(self.put(upload_id, index, chunk, len(data)).status_code, 200)
+        self.assertEqual(self.download(self.finalize(upload_id)), data)
+
+    def test_resent_chunk_is_never_reencrypted(self):
+        data = os.urandom(100 * 1024)
+        upload_id = self.start('data.bin', len(data))
+        first = data[:64 * 1024]
+        self.assertEqual(self.put(upload_id, 0, first, len(data)).status_code, 200)
+        # An identical retry is accepted; other bytes for the same index are refused.
+        self.assertEqual(self.put(upload_id, 0, first, len(data)).status_code, 200)
+        self.assertEqual(self.put(upload_id, 0, os.urandom(64 * 1024), len(data)).status_code, 409)
+        self.assertEqual(self.put(upload_id, 1, data[64 * 1024:], len(data)).status_code, 200)
+        self.assertEqual(self.download(self.finalize(upload_id)), data)
+
+    def upload_chunks(self, name, data):
+        upload_id = self.start(name, len(data))
+        for index, start in enumerate(range(0, len(data), 64 * 1024)):
+            chunk = data[start:start + 64 * 1024]
+            self.assertEqual(self.put(upload_id, index, chunk, len(data)).status_code, 200)
+        return self.finalize(upload_id)
+
+    def test_compressible_upload_is_stored_compressed(self):
+        data = b'The same line of text, over and over.\n' * 5000
+        file = self.upload_chunks('notes.txt', data)
+        self.assertNotEqual(file.blob.codec, 'none')
+        self.assertLess(file.blob.size, ciphertext_length(len(data)) // 4)
+        self.assertEqual(file.size, file.blob.size)
+        self.assertEqual(self.download(file), data)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+
+    @mock.patch('storage.uploads.COMPRESS_MAX_SIZE', 128 * 1024)
+    def test_uploads_over_the_compression_limit_are_stored_as_received(self):
+        data = b'The same line of text, over and over.\n' * 5000
+        file = self.upload_chunks('notes.txt', data)
+        self.assertEqual(file.blob.codec, 'none')
+        self.assertEqual(file.size, ciphertext_length(len(data)))
+        self.assertEqual(self.download(file), data)
+
+    def test_second_finalize_finds_the_session_gone(self):
+        data = os.urandom(1000)
+        upload_id = self.start('data.bin', len(data))
+        self.assertEqual(self.put(upload_id, 0, data, len(data)).status_code, 200)
+        session = UploadSession.objects.get(pk=upload_id)
+        finalize_session(session)
+        # A repeated finalize still holding the session it loaded before the first one committed.
+        with self.assertRaises(UploadError) as raised:
+            finalize_session(session)
+        self.assertEqual(raised.exception.status, 404)
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(get_usage(self.owner), ciphertext_length(len(data)))
+        self.assertEqual(self.client.post(reverse('api_upload_finalize', args=[upload_id])).status_code, 404)
+
+    def test_failed_write_aborts_the_session(self):
+        data = os.urandom(1000)
+        upload_id = self.start('data.bin', len(data))
+        with mock.patch('storage.uploads.encrypt_segments', side_effect=OSError('disk full')):
+            self.assertEqual(self.put(upload_id, 0, data, len(data)).status_code, 500)
+        self.assertFalse(UploadSession.objects.filter(pk=upload_id).exists())
+
+
+def use_async_views(enabled):
+    # storage.urls picks its views when imported, and the root URLconf includes it when imported.
+    with override_settings(ASYNC_VIEWS=enabled):
+        importlib.reload(storage_urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+async def body(response):
+    if not response.streaming:
+        return response.content
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+@override_settings(ASYNC_VIEWS=True)
+class AsyncViewTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        use_async_views(True)
+        self.addCleanup(use_async_views, False)
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.data = os.urandom(100 * 1024)
+        self.file = File.objects.create(name='data.bin', owner=self.owner, size=len(self.data),
+                                        blob=store_content(self.owner, 'data.bin', self.data))
+
+    async def test_urls_route_to_async_views(self):
+        match = resolve(reverse('download_file', args=[self.file.id]))
+        self.assertIs(match.func.view_class, async_views.DownloadFileView)
+        response = await self.async_client.get(reverse('download_file', args=[self.file.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(settings.LOGIN_URL))
+
+    async def test_range_download(self):
+        await self.async_client.aforce_login(self.owner)
+        url = reverse('download_file', args=[self.file.id])
+        response = await self.async_client.get(url, headers={'Range': 'bytes=65530-70000'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await body(response), self.data[65530:70001])
+        response = await self.async_client.get(url, headers={'If-None-Match': file_etag(self.file.blob)})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_read_access(self):
+        await self.async_client.aforce_login(self.other)
+        url = reverse('download_file', args=[self.file.id])
+        self.assertEqual((await self.async_client.get(url)).status_code, 404)
+        await File.objects.filter(pk=self.file.pk).aupdate(visibility='ask')
+        self.assertEqual((await self.async_client.get(url))['Location'], reverse('drive'))
+        await Permission.objects.acreate(user=self.other, file=self.file, access_level='read')
+        self.assertEqual(await body(await self.async_client.get(url)), self.data)
+
+    @mock.patch('storage.uploads.CHUNK_SIZE', 64 * 1024)
+    async def test_chunked_upload(self):
+        await self.async_client.aforce_login(self.owner)
+        data = os.urandom(100 * 1024)
+        response = await self.async_client.post(reverse('api_upload_create'), {'name': 'up.bin', 'size': len(data)})
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()['upload_id']
+        for index in (1, 0):
+            chunk = data[index * 64 * 1024:(index + 1) * 64 * 1024]
+            start = index * 64 * 1024
+            response = await self.async_client.put(
+                reverse('api_upload_chunk', args=[upload_id, index]), chunk, content_type='application/octet-stream',
+                headers={'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{len(data)}'})
+            self.assertEqual(response.status_code, 200)
+        session = await self.async_client.get(reverse('api_upload_session', args=[upload_id]))
+        self.assertEqual(session.json()['received'], [0, 1])
+        await self.async_client.aforce_login(self.other)
+        finalize = reverse('api_upload_finalize', args=[upload_id])
+        self.assertEqual((await self.async_client.post(finalize)).status_code, 404)
+        await self.async_client.aforce_login(self.owner)
+        response = await self.async_client.post(finalize)
+        self.assertEqual(response.status_code, 200)
+        download = await self.async_client.get(reverse('download_file', args=[response.json()['file_id']]))
+        self.assertEqual(await body(download), data)
+
+    async def test_sharing_is_managed_by_the_owner_only(self):
+        await Permission.objects.acreate(user=self.other, file=self.file, access_level='write')
+        await self.async_client.aforce_login(self.other)
+        info = (await self.async_client.get(reverse('api_share_info', args=['file', self.file.id]))).json()
+        self.assertEqual((info['is_owner'], info['shared_users'], info['visibility']), (False, [], 'private'))
+        for name, data in (('api_share_update', {'visibility': 'public'}),
+                           ('api_share_add_user', {'username': 'other', 'access_level': 'write'}),
+                           ('api_share_remove_user', {'username': 'other'})):
+            response = await self.async_client.post(reverse(name, args=['file', self.file.id]), data)
+            self.assertEqual(response.status_code, 403)
+        await self.async_client.aforce_login(self.owner)
+        info = (await self.async_client.get(reverse('api_share_info', args=['file', self.file.id]))).json()
+        self.assertEqual((info['is_owner'], info['visibility']), (True, 'ask'))
+        self.assertEqual(info['shared_users'], [{'user__username': 'other', 'access_level': 'write'}])
+        response = await self.async_client.post(
+            reverse('api_share_remove_user', args=['file', self.file.id]), {'username': 'other'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(await Permission.objects.filter(user=self.other).aexists())
+
+
+class FormUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.owner)
+
+    def upload(self, data, **fields):
+        fields = {'upload_file': '', 'visibility': 'private', 'file': SimpleUploadedFile('data.bin', data), **fields}
+        return self.client.post(reverse('drive'), fields).json()
+
+    def stored_files(self):
+        return [os.path.join(root, name) for root, _, names in os.walk(self.media_root) for name in names]
+
+    def test_upload_is_stored_encrypted(self):
+        data = os.urandom(200 * 1024)
+        self.assertEqual(self.upload(data)['status'], 'success')
+        file = File.objects.get()
+        self.assertEqual(self.stored_files(), [file.blob.file.path])
+        with open(file.blob.file.path, 'rb') as f:
+            ciphertext = f.read()
+        self.assertNotIn(data[:1024], ciphertext)
+        self.assertEqual(b''.join(decrypt_stream(BytesIO(ciphertext))), data)
+        self.assertEqual(get_usage(self.owner), file.size)
+
+    def test_only_the_first_file_field_is_stored(self):
+        data = os.urandom(1000)
+        result = self.upload(data, file=[SimpleUploadedFile('data.bin', data), SimpleUploadedFile('b.bin', b'b')],
+                             extra=SimpleUploadedFile('c.bin', b'c'))
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(File.objects.get().name, 'data.bin')
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_duplicate_content_keeps_one_copy(self):
+        data = os.urandom(1000)
+        self.upload(data)
+        self.upload(data)
+        self.assertEqual(File.objects.count(), 2)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    @override_settings(MAX_FILE_SIZE=100 * 1024)
+    def test_too_large_upload_is_dropped(self):
+        result = self.upload(os.urandom(300 * 1024))
+        self.assertEqual(result['status'], 'error')
+        self.assertIn('exceeds the limit', result['message'])
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_rejected_upload_leaves_no_ciphertext(self):
+        self.assertEqual(self.upload(os.urandom(1000), visibility='everyone')['message'], 'Invalid form.')
+        with override_settings(USER_STORAGE_QUOTA=10):
+            self.assertEqual(self.upload(os.urandom(1000))['message'], 'Storage quota exceeded.')
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class BlobStoreTests(MediaTestCase):
+    def test_identical_content_shares_one_blob(self):
+        owner = User.objects.create_user('owner', password='pw')
+        data = os.urandom(5000)
+        blob = store_content(owner, 'a.bin', data)
+        self.assertEqual(store_content(owner, 'copy.bin', data).pk, blob.pk)
+        self.assertNotEqual(store_content(owner, 'b.bin', os.urandom(5000)).pk, blob.pk)
+        share_blob(blob)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 3)
+        path = blob.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            release_blob(blob.pk)
+            release_blob(blob.pk)
+        self.assertTrue(os.path.exists(path))
+        # The last reference deletes the row and, once committed, the ciphertext.
+        with self.captureOnCommitCallbacks(execute=True):
+            release_blob(blob.pk)
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_deleting_a_file_releases_its_blob(self):
+        owner = User.objects.create_user('owner', password='pw')
+        blob = store_content(owner, 'a.bin', b'x' * 100)
+        share_blob(blob)
+        files = [File.objects.create(name=f'f{i}', owner=owner, blob=blob, size=100) for i in range(2)]
+        files[0].delete()
+        self.assertEqual(Blob.objects.get(pk=blob.pk).ref_count, 1)
+        files[1].delete()
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+
+
+@mock.patch.multiple('storage.encryption', POOL_WORKERS=2, POOL_KIND='process', POOL_MIN_SIZE=0)
+class CryptoPoolTests(SimpleTestCase):
+    def setUp(self):
+        encryption._pool = None
+        self.addCleanup(self.shut_down)
+
+    def shut_down(self):
+        if encryption._pool is not None:
+            encryption._pool.shutdown()
+            encryption._pool = None
+
+    def test_dead_worker_is_replaced(self):
+        data = os.urandom(64 * 1024 * 40)
+        ciphertext = encryption.encrypt_file(data)
+        pool = encryption.get_pool()
+        # One dead worker breaks the whole executor.
+        worker = next(iter(pool.executor._processes.values()))
+        os.kill(worker.pid, signal.SIGKILL)
+        worker.join()
+        # Batches on the broken pool are redone inline; later ones get a new pool.
+        self.assertEqual(encryption.decrypt_file(ciphertext), data)
+        self.assertEqual(encryption.decrypt_file(encryption.encrypt_file(data)), data)
+        self.assertIsNot(encryption.get_pool(), pool)
+
+
+@override_settings(USER_STORAGE_QUOTA=1000)
+class QuotaTests(DriveTestCase):
+    def test_reserve_stops_at_the_quota(self):
+        user = User.objects.create_user('owner', password='pw')
+        reserve(user, 600)
+        with self.assertRaises(QuotaExceeded):
+            reserve(user, 401)
+        self.assertEqual(get_usage(user), 600)
+        reserve(user, 400)
+        self.assertEqual(get_usage(user), 1000)
+        # Refunds always go through, even at the limit.
+        reserve(user, -300)
+        adjust(user.pk, -200)
+        self.assertEqual(get_usage(user), 500)
+
+    def test_upload_over_quota_is_refused(self):
+        user = User.objects.create_user('owner', password='pw')
+        self.client.force_login(user)
+        response = self.client.post(reverse('api_upload_create'), {'name': 'big.bin', 'size': 2000})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'Storage quota exceeded.')
+
+
+class FolderPathTests(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.a = Folder.objects.create(name='a', owner=self.owner)
+        self.b = Folder.objects.create(name='b', owner=self.owner, parent=self.a)
+        self.c = Folder.objects.create(name='c', owner=self.owner, parent=self.b)
+        self.d = Folder.objects.create(name='d', owner=self.owner, parent=self.c)
+        self.x = Folder.objects.create(name='x', owner=self.owner)
+        self.client.force_login(self.owner)
+
+    def move(self, target, destination):
+        return self.client.post(reverse('drive'), {
+            'move': '', 'target_type': 'folder', 'target_id': target.id, 'destination': destination.id})
+
+    def names(self, folders):
+        return [folder.name for folder in folders]
+
+    def test_move_rewrites_the_subtree(self):
+        self.assertEqual(self.move(self.b, self.x).status_code, 302)
+        for folder in (self.a, self.b, self.c, self.d, self.x):
+            folder.refresh_from_db()
+        self.assertEqual(self.d.path, f'{self.x.pk}/{self.b.pk}/{self.c.pk}/{self.d.pk}/')
+        self.assertEqual(self.a.path, f'{self.a.pk}/')
+        self.assertEqual(self.names(self.d.ancestors()), ['x', 'b', 'c', 'd'])
+        self.assertEqual(self.names(self.a.descendants()), ['a'])
+        self.assertEqual(sorted(self.names(self.x.descendants())), ['b', 'c', 'd', 'x'])
+        response = self.client.get(reverse('drive'), {'folder': self.d.id})
+        self.assertEqual(self.names(response.context['breadcrumbs']), ['x', 'b', 'c', 'd'])
+
+    def test_move_into_own_subtree_is_rejected(self):
+        response = self.move(self.b, self.d)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['show_move_modal'])
+        self.assertIn('destination', response.context['move_form'].errors)
+        self.b.refresh_from_db()
+        self.assertEqual(self.b.parent, self.a)
+        self.d.refresh_from_db()
+        self.assertEqual(self.d.path, f'{self.a.pk}/{self.b.pk}/{self.c.pk}/{self.d.pk}/')
+        self.b.parent = self.c
+        with self.assertRaises(ValueError):
+            self.b.save()
+
+    def test_folder_paths_breaks_cycles(self):
+        parents = {1: 2, 2: 3, 3: 1, 4: 3, 5: None}
+        paths, detached = folder_paths(parents)
+        self.assertEqual(detached, [1])
+        self.assertIsNone(parents[1])
+        self.assertEqual(paths, {1: '1/', 2: '1/3/2/', 3: '1/3/', 4: '1/3/4/', 5: '5/'})
+
+    def test_rebuild_detaches_a_cycle(self):
+        Folder.objects.filter(pk=self.a.pk).update(parent=self.c, path='')
+        call_command('rebuild_folder_paths', stdout=StringIO(), stderr=StringIO())
+        # Whichever folder the walk reached the cycle through is moved to the top level.
+        folders = {folder.pk: folder for folder in Folder.objects.all()}
+        self.assertEqual(len([f for f in folders.values() if f.pk != self.x.pk and f.parent_id is None]), 1)
+        for folder in folders.values():
+            parent_path = folders[folder.parent_id].path if folder.parent_id else ''
+            self.assertEqual(folder.path, f'{parent_path}{folder.pk}/')
+
+
+class SoftDeleteTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.top = Folder.objects.create(name='top', owner=self.owner)
+        self.kept = File.objects.create(
+            name='kept.bin', owner=self.owner, blob=store_content(self.owner, 'kept.bin', os.urandom(1000)), size=1)
+
+    def fill(self, parent, depth, width):
+        for i in range(width):
+            blob = store_content(self.owner, 'f.bin', os.urandom(1000))
+            reserve(self.owner, blob.size)
+            file = File.objects.create(name=f'f{i}', owner=self.owner, folder=parent, blob=blob, size=blob.size)
+            AccessRequest.objects.create(user=self.other, file=file)
+            if depth:
+                child = Folder.objects.create(name=f'd{i}', owner=self.owner, parent=parent)
+                AccessRequest.objects.create(user=self.other, folder=child, status='rejected')
+                self.fill(child, depth - 1, width)
+
+    def delete_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            delete_folder(self.top)
+        return len(queries)
+
+    def test_delete_hides_the_tree_and_refunds_it(self):
+        self.fill(self.top, 2, 3)
+        self.assertEqual(pending_count(self.owner), 39)
+        delete_folder(self.top)
+        self.assertEqual(list(File.objects.all()), [self.kept])
+        self.assertFalse(Folder.objects.exists())
+        self.assertEqual(Folder.all_objects.count(), 13)
+        self.assertFalse(AccessRequest.objects.exists())
+        self.assertEqual(pending_count(self.owner), 0)
+        self.assertEqual(get_usage(self.owner), 0)
+
+    def test_delete_queries_do_not_grow_with_the_tree(self):
+        self.fill(self.top, 1, 2)
+        small = self.delete_queries()
+        self.top = Folder.objects.create(name='top2', owner=self.owner)
+        self.fill(self.top, 2, 4)
+        self.assertEqual(self.delete_queries(), small)
+
+    def test_reclaim_in_batches(self):
+        self.fill(self.top, 3, 2)
+        paths = [blob.file.path for blob in Blob.objects.exclude(pk=self.kept.blob_id)]
+        delete_folder(self.top)
+        call_command('reclaim_deleted', batch_size=2, stdout=StringIO())
+        self.assertEqual(list(File.all_objects.all()), [self.kept])
+        self.assertFalse(Folder.all_objects.exists())
+        self.assertEqual(list(Blob.objects.all()), [self.kept.blob])
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+
+class BlobRelocationTests(TemporaryMediaMixin, TransactionTestCase):
+    # relocate_blobs updates rows from worker threads, which only see committed data.
+    def test_relocate_old_layout(self):
+        data = os.urandom(5000)
+        old_name = 'files/user_1/folder_2/report.bin'
+        old_path = os.path.join(self.media_root, old_name)
+        os.makedirs(os.path.dirname(old_path))
+        with open(old_path, 'wb') as f:
+            f.writelines(encrypt_stream([data], len(data)))
+        blob = Blob.objects.create(file=old_name, size=os.path.getsize(old_path), ref_count=1)
+        call_command('relocate_blobs', workers=1, stdout=StringIO())
+        blob.refresh_from_db()
+        self.assertRegex(blob.file.name, r'^blobs/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{28}$')
+        with open(blob.file.path, 'rb') as f:
+            self.assertEqual(b''.join(decrypt_stream(f)), data)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'files')))
+
+
+class TempFileSweepTests(MediaTestCase):
+    def test_abandoned_temp_files_are_swept(self):
+        stale, fresh = temp_blob_path(), temp_blob_path()
+        for path in (stale, fresh):
+            open(path, 'wb').close()
+        os.utime(stale, (0, 0))
+        call_command('reclaim_deleted', stdout=StringIO())
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+
+
+@override_settings(ACCESS_CACHE_TIMEOUT=300)
+class DriveListingQueryCountTests(DriveTestCase):
+    """The drive listing must not issue more queries as a folder grows.
+
+    Counted with sharing grants cached, as they are behind a shared cache backend.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        cls.blob = Blob.objects.create(file='blobs/00/00/test', size=10, ref_count=0)
+        cls.folder = Folder.objects.create(name='docs', owner=cls.owner, visibility='public')
+
+    def populate(self, parent, count):
+        for i in range(count):
+            Folder.objects.create(name=f'sub{i}', owner=self.owner, parent=parent, visibility='ask')
+            file = File.objects.create(
+                name=f'file{i}.txt', owner=self.owner, folder=parent, blob=self.blob, size=10,
+                visibility=['public', 'ask', 'private'][i % 3])
+            if i % 2:
+                Permission.objects.create(user=self.other, file=file, access_level='read')
+            else:
+                AccessRequest.objects.create(user=self.other, file=file)
+
+    def assertListingQueries(self, user, url, expected):
+        self.client.force_login(user)
+        # Warm up the session so only the listing itself is measured.
+        self.client.get(url)
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_folder_listing_query_count_is_constant(self):
+        url = f"{reverse('drive')}?folder={self.folder.id}"
+        # session, user, folder, subfolders, files, breadcrumbs, move form choices; the
+        # user's grants come from the cache filled by the warm-up request
+        self.populate(self.folder, 3)
+        small = self.assertListingQueries(self.other, url, 7)
+        self.populate(self.folder, 30)
+        large = self.assertListingQueries(self.other, url, 7)
+        self.assertEqual(len(small.context['files']), 2)
+        self.assertEqual(len(large.context['files']), 27)
+
+    def test_root_listing_query_count_is_constant(self):
+        url = reverse('drive')
+        # session, user, folders, files, move form choices
+        self.populate(None, 3)
+        self.assertListingQueries(self.owner, url, 5)
+        self.populate(None, 30)
+        response = self.assertListingQueries(self.owner, url, 5)
+        self.assertEqual(len(response.context['files']), 33)
+
+    def test_access_flags(self):
+        self.populate(self.folder, 2)
+        self.client.force_login(self.other)
+        response = self.client.get(f"{reverse('drive')}?folder={self.folder.id}")
+        flags = {f.name: (f.shared_with_user, f.access_pending) for f in response.context['files']}
+        self.assertEqual(flags, {'file0.txt': (False, True), 'file1.txt': (True, False)})
+
+
+@override_settings(DRIVE_PAGE_SIZE=4)
+class DriveListingPaginationTests(DriveTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        blob = Blob.objects.create(file='blobs/00/00/test', size=10, ref_count=0)
+        cls.folder = Folder.objects.create(name='dump', owner=cls.owner)
+        for i in range(3):
+            Folder.objects.create(name=f'sub{i}', owner=cls.owner, parent=cls.folder)
+        # Equal sizes and names exercise the id tie-breaker.
+        for i in range(8):
+            File.objects.create(name=f'file{i % 4}', owner=cls.owner, folder=cls.folder, blob=blob, size=i // 2)
+
+    def walk(self, sort):
+        self.client.force_login(self.owner)
+        url = reverse('api_listing', kwargs={'version': 'v1'})
+        params = {'folder': self.folder.id, 'sort': sort}
+        items, cursor = [], None
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url, {**params, 'cursor': cursor} if cursor else params).json()
+            # session, user, folder, grants, then subfolders and/or files (+ breadcrumbs)
+            self.assertLessEqual(len(queries), 7)
+            items += [('folder', f['id']) for f in data['folders']] + [('file', f['id']) for f in data['files']]
+            cursor = data['next_cursor']
+            if not cursor:
+                return items
+
+    def test_pages_cover_listing_in_order(self):
+        folders = list(self.folder.subfolders.order_by('-name', '-id').values_list('id', flat=True))
+        files = list(self.folder.files.order_by('-size', '-id').values_list('id', flat=True))
+        expected = [('folder', pk) for pk in folders] + [('file', pk) for pk in files]
+        self.assertEqual(self.walk('-size'), expected)
+
+    def test_pages_by_name(self):
+        files = list(self.folder.files.order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual([pk for kind, pk in self.walk('name') if kind == 'file'], files)
+
+    def test_folders_filling_the_last_page(self):
+        parent = Folder.objects.create(name='full', owner=self.owner)
+        for i in range(4):
+            Folder.objects.create(name=f'sub{i}', owner=self.owner, parent=parent)
+        folders, files, cursor = paginate(parent.subfolders.all(), parent.files.all(), 'name')
+        self.assertEqual((len(folders), files, cursor), (4, [], None))
+        File.objects.create(name='last', owner=self.owner, folder=parent, blob=Blob.objects.get(), size=1)
+        folders, files, cursor = paginate(parent.subfolders.all(), parent.files.all(), 'name')
+        self.assertEqual(len(folders), 4)
+        folders, files, cursor = paginate(parent.subfolders.all(), parent.files.all(), 'name', cursor)
+        self.assertEqual((folders, [f.name for f in files], cursor), ([], ['last'], None))
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('api_listing', kwargs={'version': 'v1'}), {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DriveApiTests(DriveTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        blob = Blob.objects.create(file='blobs/00/00/test', size=10, ref_count=0)
+        cls.folder = Folder.objects.create(name='docs', owner=cls.owner, visibility='public')
+        cls.public = File.objects.create(name='a.txt', owner=cls.owner, folder=cls.folder, blob=blob, size=10,
+                                         visibility='public')
+        cls.private = File.objects.create(name='b.txt', owner=cls.owner, folder=cls.folder, blob=blob, size=10)
+
+    def url(self, name, **kwargs):
+        return reverse(name, kwargs={'version': 'v1', **kwargs})
+
+    def test_listing_fields_and_breadcrumbs(self):
+        self.client.force_login(self.other)
+        data = self.client.get(self.url('api_listing'), {'folder': self.folder.id, 'fields': 'id,name'}).json()
+        self.assertEqual(data['files'], [{'id': self.public.id, 'name': 'a.txt'}])
+        self.assertEqual(data['breadcrumbs'], [{'id': self.folder.id, 'name': 'docs'}])
+
+    def test_hidden_file_is_not_found(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(self.url('api_file', pk=self.private.id)).status_code, 404)
+        self.client.force_login(self.owner)
+        self.assertTrue(self.client.get(self.url('api_file', pk=self.private.id)).json()['is_owner'])
+
+    def test_share_state_is_read_only(self):
+        self.client.force_login(self.owner)
+        data = self.client.get(self.url('api_share_state', kind='files', pk=self.private.id)).json()
+        self.assertEqual(data['visibility'], 'private')
+        self.assertIn('share_link', data)
+        self.private.refresh_from_db()
+        self.assertEqual(self.private.visibility, 'private')
+
+    def test_unknown_version(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get('/storage/api/v9/listing/').status_code, 404)
+
+    def test_requires_authentication(self):
+        self.assertIn(self.client.get(self.url('api_listing')).status_code, (401, 403))
+
+
+class InheritedAccessTests(DriveTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        blob = Blob.objects.create(file='blobs/00/00/test', size=10, ref_count=0)
+        cls.top = Folder.objects.create(name='top', owner=cls.owner)
+        cls.inner = Folder.objects.create(name='inner', owner=cls.owner, parent=cls.top)
+        cls.file = File.objects.create(name='deep.txt', owner=cls.owner, folder=cls.inner, blob=blob, size=10)
+
+    def test_folder_grant_covers_subtree(self):
+        self.assertIsNone(access.file_level(self.other, self.file))
+        grant = Permission.objects.create(user=self.other, folder=self.top, access_level='write')
+        self.assertEqual(access.folder_level(self.other, self.inner), 'write')
+        self.assertEqual(access.file_level(self.other, self.file), 'write')
+        self.client.force_login(self.other)
+        response = self.client.get(reverse('drive'), {'folder': self.inner.id})
+        self.assertEqual([(f.name, f.shared_with_user) for f in response.context['files']], [('deep.txt', True)])
+        grant.delete()
+        self.assertIsNone(access.file_level(self.other, self.file))
+        self.assertEqual(self.client.get(reverse('drive'), {'folder': self.inner.id}).status_code, 404)
+
+    def test_strongest_grant_wins(self):
+        Permission.objects.create(user=self.other, folder=self.top, access_level='read')
+        Permission.objects.create(user=self.other, file=self.file, access_level='write')
+        levels = access.file_levels(self.other, [self.file])
+        self.assertEqual(levels, {self.file.id: 'write'})
+
+    @override_settings(ACCESS_CACHE_TIMEOUT=300)
+    def test_grants_are_cached(self):
+        Permission.objects.create(user=self.other, folder=self.top, access_level='read')
+        access.folder_level(self.other, self.inner)
+        with self.assertNumQueries(0):
+            access.folder_level(self.other, self.inner)
+
+    @override_settings(ACCESS_CACHE_TIMEOUT=None)
+    def test_per_process_cache_is_not_used_by_default(self):
+        Permission.objects.create(user=self.other, folder=self.top, access_level='read')
+        access.folder_level(self.other, self.inner)
+        with self.assertNumQueries(1):
+            access.folder_level(self.other, self.inner)
+
+    def test_check_warns_about_per_process_cache(self):
+        with override_settings(ACCESS_CACHE_TIMEOUT=300):
+            self.assertEqual([w.id for w in check_access_cache(None)], ['storage.W001'])
+        with override_settings(ACCESS_CACHE_TIMEOUT=None):
+            self.assertEqual(check_access_cache(None), [])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with override_settings(ACCESS_CACHE_TIMEOUT=300, CACHES=shared):
+            self.assertEqual(check_access_cache(None), [])
+
+
+class AccessPolicyTests(DriveTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        blob = Blob.objects.create(file='blobs/00/00/test', size=10, ref_count=0)
+        cls.folders = [Folder.objects.create(name=f'dir{i}', owner=cls.owner) for i in range(3)]
+        cls.files = [File.objects.create(name=f'f{i}', owner=cls.owner, folder=folder, blob=blob, size=10)
+                     for i, folder in enumerate(cls.folders)]
+        Permission.objects.create(user=cls.other, folder=cls.folders[1], access_level='read')
+
+    def test_batch_and_memoization(self):
+        policy = access.AccessPolicy(self.other)
+        files = list(File.objects.all())
+        # grants, then the folder paths of all files at once
+        with self.assertNumQueries(2):
+            policy.prefetch(files)
+        with self.assertNumQueries(0):
+            readable = [policy.can_read(file) for file in files]
+            self.assertEqual(policy.level(files[1]), 'read')
+        self.assertEqual(readable, [False, True, False])
+
+    def test_anonymous_policy_needs_no_queries(self):
+        policy = access.AccessPolicy(AnonymousUser())
+        with self.assertNumQueries(0):
+            self.assertFalse(policy.can_read(self.files[0]))
+
+    def test_share_info_hides_private_items(self):
+        self.client.force_login(self.other)
+        url = reverse('api_share_info', kwargs={'type': 'file', 'id': self.files[0].id})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        data = self.client.get(reverse('api_share_info', kwargs={'type': 'file', 'id': self.files[1].id})).json()
+        self.assertEqual((data['is_owner'], data['shared_users']), (False, []))
+
+
+class PendingRequestCountTests(DriveTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        blob = Blob.objects.create(file='blobs/00/00/test', size=10, ref_count=3)
+        cls.folder = Folder.objects.create(name='docs', owner=cls.owner, visibility='ask')
+        cls.files = [File.objects.create(name=f'f{i}', owner=cls.owner, folder=cls.folder, blob=blob, size=10,
+                                         visibility='ask') for i in range(3)]
+
+    def test_counter_follows_requests(self):
+        self.client.force_login(self.other)
+        for file in self.files:
+            self.client.post(reverse('request_access_file', args=[file.id]))
+        self.client.post(reverse('request_access_folder', args=[self.folder.id]))
+        self.client.post(reverse('request_access_file', args=[self.files[0].id]))
+        self.assertEqual(pending_count(self.owner), 4)
+        self.client.force_login(self.owner)
+        requests = {ar.file_id or ar.folder_id: ar for ar in AccessRequest.objects.all()}
+        self.client.post(reverse('approve_access_request', args=[requests[self.files[0].id].id]))
+        self.client.post(reverse('reject_access_request', args=[requests[self.files[1].id].id]))
+        # Approving again changes nothing.
+        self.client.post(reverse('approve_access_request', args=[requests[self.files[0].id].id]))
+        self.assertEqual(pending_count(self.owner), 2)
+        self.files[2].delete()
+        self.assertEqual(pending_count(self.owner), 1)
+        delete_folder(self.folder)
+        self.assertEqual(pending_count(self.owner), 0)
+        self.assertEqual(pending_count(self.other), 0)
+
+    def test_deleting_users(self):
+        AccessRequest.objects.create(user=self.other, file=self.files[0])
+        self.other.delete()
+        self.assertEqual(pending_count(self.owner), 0)
+        AccessRequest.objects.create(user=User.objects.create_user('third'), folder=self.folder)
+        self.owner.delete()
+        self.assertFalse(PendingRequestCount.objects.exists())
+
+    def test_rebuild_and_endpoint(self):
+        AccessRequest.objects.bulk_create([
+            AccessRequest(user=self.other, file=self.files[0]),
+            AccessRequest(user=self.other, folder=self.folder),
+            AccessRequest(user=self.other, file=self.files[1], status='approved'),
+        ])
+        self.assertEqual(pending_count(self.owner), 0)
+        self.assertEqual(rebuild(), 1)
+        self.assertEqual(rebuild(), 0)
+        self.assertEqual(pending_count(self.owner), 2)
+        self.client.force_login(self.owner)
+        url = reverse('api_pending_requests', kwargs={'version': 'v1'})
+        # session, user, counter
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url).json(), {'pending': 2})
+
+
+class QueryPlanTests(DriveTestCase):
+    """The hot lookups must be answered from an index, never a full table scan.
+
+    Runs against whichever database the suite uses (DATABASE_URL); SQLite and
+    PostgreSQL plans are checked, other backends are skipped.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        cls.other = User.objects.create_user('other', password='pw')
+        blob = Blob.objects.create(file='blobs/00/00/test', size=10, ref_count=0)
+        cls.folder = Folder.objects.create(name='docs', owner=cls.owner, visibility='public')
+        for i in range(20):
+            sub = Folder.objects.create(name=f'sub{i}', owner=cls.owner, parent=cls.folder,
+                                        visibility=['public', 'ask', 'private'][i % 3])
+            file = File.objects.create(name=f'file{i}', owner=cls.owner, folder=cls.folder if i % 2 else None,
+                                       blob=blob, size=i, visibility=['public', 'ask', 'private'][i % 3])
+            if i % 2:
+                Permission.objects.create(user=cls.other, file=file, access_level='read')
+                AccessRequest.objects.create(user=cls.other, folder=sub, status='pending')
+            else:
+                Permission.objects.create(user=cls.other, folder=sub, access_level='write')
+                AccessRequest.objects.create(user=cls.other, file=file, status=['pending', 'approved'][i % 4 // 2])
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor == 'postgresql':
+            # On a table this small PostgreSQL always prefers a sequential scan; with
+            # them discouraged it still falls back to one when no index applies.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        elif connection.vendor != 'sqlite':
+            self.skipTest(f'No plan checks for {connection.vendor}')
+
+    def hot_queries(self):
+        owner, other, folder = self.owner, self.other, self.folder
+        return {
+            'grants': Permission.objects.filter(user=other),
+            'file grant': Permission.objects.filter(user=other, file=folder.files.first()),
+            'folder grant': Permission.objects.filter(user=other, folder=folder),
+            'file requests': AccessRequest.objects.filter(file__owner=owner, status='pending'),
+            'folder requests': AccessRequest.objects.filter(folder__owner=owner, status='pending'),
+            'root files': File.objects.filter(owner=owner, folder__isnull=True),
+            'root folders': Folder.objects.filter(owner=owner, parent=None),
+            'public subfolders': folder.subfolders.filter(visibility='public'),
+            'public files': folder.files.filter(visibility='public'),
+            'access flags': with_access_flags(folder.files.all(), other, 'file'),
+        }
+
+    def full_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return re.findall(r'Seq Scan on (\w+)', plan)
+        # "SCAN t" reads the whole table; "SCAN t USING INDEX i" walks an index instead.
+        return re.findall(r'\bSCAN (\w+)$', plan, re.MULTILINE)
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(self.full_scans(plan), [], f'{name}:\n{plan}')
+
+
+class DatasetTests(DriveTestCase):
+    def test_generated_tree_is_consistent(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            users = generate(users=4, folders=24, files=60, permissions=10, requests=5, depth=4, stubs=4)
+        self.assertEqual(len(users), 4)
+        for folder in Folder.objects.select_related('parent'):
+            self.assertEqual(folder.path, f'{folder.parent.path if folder.parent else ""}{folder.pk}/')
+        self.assertEqual(max(folder.path.count('/') for folder in Folder.objects.all()), 4)
+        for blob in Blob.objects.all():
+            self.assertEqual(blob.ref_count, blob.files.count())
+        self.assertEqual(File.objects.count(), 60)
+
+
+class BenchmarkCompareTests(TestCase):
+    def result(self, p50, queries=5):
+        return {'small': {'drive.root': {'status': 200, 'p50_ms': p50, 'p99_ms': p50, 'queries': queries,
+                                         'peak_kib': 100}}}
+
+    def test_regressions(self):
+        self.assertEqual(compare(self.result(50), self.result(60), 0.25), [])
+        # Below the noise floor however large the relative change.
+        self.assertEqual(compare(self.result(1), self.result(2.5), 0.25), [])
+        self.assertEqual([r[2] for r in compare(self.result(50), self.result(80), 0.25)], ['p50_ms', 'p99_ms'])
+        self.assertEqual(compare(self.result(50), self.result(50, queries=6), 0.25),
+                         [('small', 'drive.root', 'queries', 5, 6)])
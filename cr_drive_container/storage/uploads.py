@@ -0,0 +1,362 @@
+import math
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .encryption import (
+    HEADER_SIZE, SEGMENT_SIZE, TAG_SIZE, StreamEncryptor, build_header, ciphertext_length, decrypt_stream,
+    encrypt_segment, encrypt_segments, parse_header, segment_count,
+)
+from .compression import choose_codec, compressor
+from .blobstore import (
+    DIGEST_BLOCK_SIZE, ContentHasher, commit_blob_file, content_digest, store_blob, temp_blob_path, unlink_quietly,
+)
+from .models import Blob, File, UploadChunk, UploadSession
+from .quota import QuotaExceeded, adjust, reserve
+
+# Chunks must hold a whole number of encryption segments so each one can be
+# encrypted on arrival and written at a fixed ciphertext offset, and a whole number
+# of digest blocks so they can be hashed independently.
+_CHUNK_UNIT = math.lcm(SEGMENT_SIZE, DIGEST_BLOCK_SIZE)
+CHUNK_SIZE = max(1, getattr(settings, 'UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024) // _CHUNK_UNIT) * _CHUNK_UNIT
+SESSION_TTL = timedelta(seconds=getattr(settings, 'UPLOAD_SESSION_TTL', 24 * 60 * 60))
+# Chunked uploads up to this size are recompressed when finalized (see compress_partial).
+COMPRESS_MAX_SIZE = getattr(settings, 'UPLOAD_COMPRESS_MAX_SIZE', 64 * 1024 * 1024)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class EncryptedUploadedFile(UploadedFile):
+    """An upload that has already been encrypted to a temporary blob file.
+
+    `temp_path` holds the ciphertext until place() moves it into the blob store,
+    `stored_size` is its size on disk, `codec` the compression applied before
+    encryption and `digest` identifies the plaintext for the blob store. The view
+    calls discard() at the end of every request; placed ciphertext survives it only
+    once the upload is marked `committed`, so a rolled-back transaction leaves none.
+    """
+
+    committed = False
+    placed_path = None
+
+    def __init__(self, temp_path, name, content_type, size, stored_size, codec, digest, charset,
+                 content_type_extra=None):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.temp_path = temp_path
+        self.stored_size = stored_size
+        self.codec = codec
+        self.digest = digest
+
+    def place(self):
+        """Move the ciphertext into the blob store; a place_file() callback for store_blob()."""
+        file_path, self.placed_path = commit_blob_file(self.temp_path)
+        return file_path, self.stored_size
+
+    def discard(self):
+        unlink_quietly(self.temp_path)
+        if self.placed_path and not self.committed:
+            unlink_quietly(self.placed_path)
+
+
+class EncryptingFileUploadHandler(FileUploadHandler):
+    """Encrypt the `file` field of a multipart upload as it is read off the socket.
+
+    Ciphertext is written once, to a temporary blob file that the view moves into the
+    blob store once the upload is accepted, instead of spooling plaintext to a temporary file first. The codec is chosen from the
+    file name and the first chunk; compressible data is compressed on the way through. Any other file fields are
+    skipped. An upload larger than MAX_FILE_SIZE is deleted as soon as it crosses
+    the limit and the rest of it is drained; `too_large` is set so the view can
+    report it.
+    """
+
+    field_name = 'file'
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.encryptor = None
+        self.too_large = False
+        self.complete = False
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != self.field_name or self.encryptor is not None:
+            raise SkipFile()
+        self.encryptor = StreamEncryptor()
+        self.hasher = ContentHasher()
+        self.codec = None
+        self.compressor = None
+        self.temp_path = temp_blob_path()
+        self.file = open(self.temp_path, 'wb')
+        self.file.write(self.encryptor.header)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.too_large:
+            return None
+        if start + len(raw_data) > settings.MAX_FILE_SIZE:
+            self.too_large = True
+            self._cleanup()
+            return None
+        if self.codec is None:
+            self.codec = choose_codec(self.file_name, raw_data)
+            self.compressor = compressor(self.codec)
+        self.hasher.update(raw_data)
+        if self.compressor is not None:
+            raw_data = self.compressor.compress(raw_data)
+        self.file.write(self.encryptor.update(raw_data))
+        return None
+
+    def file_complete(self, file_size):
+        if self.too_large:
+            return None
+        if self.compressor is not None:
+            self.file.write(self.encryptor.update(self.compressor.flush()))
+        self.file.write(self.encryptor.finalize())
+        # The length was unknown when the header went out; patch it in place.
+        self.file.seek(0)
+        self.file.write(self.encryptor.header)
+        self.file.close()
+        self.complete = True
+        return EncryptedUploadedFile(
+            self.temp_path,
+            self.file_name,
+            self.content_type,
+            file_size,
+            ciphertext_length(self.encryptor.plaintext_length),
+            self.codec or 'none',
+            content_digest(self.request.user, file_size, self.hasher.finish()),
+            self.charset,
+            self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        # Also called when a skipped field came last; a completed file belongs to the view.
+        if self.encryptor is not None and not self.too_large and not self.complete:
+            self._cleanup()
+
+    def _cleanup(self):
+        self.file.close()
+        unlink_quietly(self.temp_path)
+
+
+def part_path(session):
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', f'{session.id}.part')
+
+
+def create_session(user, folder, name, size, visibility):
+    header = build_header(size)
+    session = UploadSession.objects.create(
+        owner=user,
+        folder=folder,
+        name=name,
+        visibility=visibility,
+        size=size,
+        chunk_size=CHUNK_SIZE,
+        header=header,
+        expires_at=timezone.now() + SESSION_TTL,
+    )
+    path = part_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(header)
+        if size == 0:
+            # Nothing will be uploaded; seal the (empty) final segment right away.
+            f.write(encrypt_segment(parse_header(header), 0, b'', True))
+        f.truncate(ciphertext_length(size))
+    return session
+
+
+def _read_exactly(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        piece = stream.read(size - len(data))
+        if not piece:
+            raise UploadError('Incomplete chunk.')
+        data += piece
+    return data
+
+
+def _claim_chunk(session, index, size, digests):
+    """Record chunk `index` as received; returns False if it already was, with the same content.
+
+    Raises UploadError if it was received with different content: the chunk's segments
+    were sealed under nonces fixed by the session header and its index, and sealing
+    other plaintext under them would reuse an AES-GCM nonce.
+    """
+    try:
+        with transaction.atomic():
+            UploadChunk.objects.create(session=session, index=index, size=size, digests=digests)
+        return True
+    except IntegrityError:
+        existing = UploadChunk.objects.filter(session=session, index=index).values_list('digests', flat=True).first()
+        if existing is not None and bytes(existing) == digests:
+            return False
+        raise UploadError(f'Chunk {index} was already received with different content.', status=409)
+
+
+def write_chunk(session, index, stream, start, length):
+    """Encrypt chunk `index` from `stream` into the partial file.
+
+    The chunk is read and hashed in full before anything is encrypted, and its row is
+    inserted in the same transaction as the write, so concurrent or retried PUTs of
+    one index encrypt at most one plaintext under its nonces. If the write fails
+    part way the session is aborted: its nonces may already protect some data.
+    """
+    if not 0 <= index < session.chunk_count:
+        raise UploadError('Invalid chunk index.')
+    expected = min(session.chunk_size, session.size - index * session.chunk_size)
+    if start != index * session.chunk_size or length != expected:
+        raise UploadError('Chunk offset or length mismatch.')
+    data = _read_exactly(stream, expected)
+    hasher = ContentHasher()
+    hasher.update(data)
+    digests = hasher.finish()
+    header = parse_header(bytes(session.header))
+    segment_size = header.segment_size
+    total_segments = segment_count(session.size, segment_size)
+    first_segment = start // segment_size
+    segments = (memoryview(data)[offset:offset + segment_size] for offset in range(0, expected, segment_size))
+    encrypting = False
+    try:
+        with transaction.atomic():
+            if not _claim_chunk(session, index, expected, digests):
+                return
+            encrypting = True
+            with open(part_path(session), 'r+b') as f:
+                f.seek(HEADER_SIZE + first_segment * (segment_size + TAG_SIZE))
+                for ciphertext in encrypt_segments(header, first_segment, segments, total_segments, expected):
+                    f.write(ciphertext)
+    except Exception:
+        if not encrypting:
+            raise
+        abort_session(session)
+        raise UploadError('The chunk could not be stored; start the upload again.', status=500)
+    UploadSession.objects.filter(pk=session.pk).update(expires_at=timezone.now() + SESSION_TTL)
+
+
+def received_chunks(session):
+    return list(session.chunks.order_by('index').values_list('index', flat=True))
+
+
+def contiguous_offset(session, received):
+    """Number of plaintext bytes received without gaps from the start of the file."""
+    count = 0
+    for index in received:
+        if index != count:
+            break
+        count += 1
+    return min(count * session.chunk_size, session.size)
+
+
+def compress_partial(session, partial):
+    """Re-encrypt a completed partial file compressed, if its content compresses.
+
+    Chunks are encrypted as they arrive, before the whole file can be compressed, so
+    this takes one more streaming decrypt and encrypt pass while the upload is being
+    finalized; larger uploads than COMPRESS_MAX_SIZE are stored as received.
+    Returns (temp_path, codec, stored_size) or None.
+    """
+    if session.size > COMPRESS_MAX_SIZE:
+        return None
+    with open(partial, 'rb') as f:
+        plaintext = decrypt_stream(f)
+        first = next(plaintext, b'')
+        codec = choose_codec(session.name, first)
+        if codec == 'none':
+            return None
+        comp = compressor(codec)
+        # A fresh header, and with it a fresh nonce prefix, for the new ciphertext.
+        encryptor = StreamEncryptor()
+        temp_path = temp_blob_path()
+        try:
+            with open(temp_path, 'wb') as out:
+                out.write(encryptor.header)
+                out.write(encryptor.update(comp.compress(first)))
+                for chunk in plaintext:
+                    out.write(encryptor.update(comp.compress(chunk)))
+                out.write(encryptor.update(comp.flush()))
+                out.write(encryptor.finalize())
+                out.seek(0)
+                out.write(encryptor.header)
+        except BaseException:
+            unlink_quietly(temp_path)
+            raise
+    return temp_path, codec, ciphertext_length(encryptor.plaintext_length)
+
+
+def finalize_session(session):
+    """Store the completed ciphertext as a blob and create its File row.
+
+    The session row is locked first, so a retried or repeated finalize waits for
+    this one and then finds the session gone. The file's size is charged against
+    the owner's quota. If the same content is already stored, the partial file is
+    simply dropped; otherwise compressible uploads are stored compressed (see
+    compress_partial).
+    """
+    if session.folder is not None and session.folder.deleted_at is not None:
+        raise UploadError('The destination folder has been deleted.', status=404)
+    partial = part_path(session)
+    source = partial
+    try:
+        with transaction.atomic():
+            if UploadSession.objects.select_for_update().filter(pk=session.pk).first() is None:
+                raise UploadError('Upload not found.', status=404)
+            chunks = list(session.chunks.order_by('index').values_list('digests', flat=True))
+            if len(chunks) != session.chunk_count:
+                raise UploadError('Upload is incomplete.', status=409)
+            digest = content_digest(session.owner, session.size, b''.join(bytes(d) for d in chunks))
+            codec, stored_size = 'none', ciphertext_length(session.size)
+            if not Blob.objects.filter(digest=digest).exists():
+                source, codec, stored_size = compress_partial(session, partial) or (source, codec, stored_size)
+
+            def place_file():
+                file_path, _ = commit_blob_file(source)
+                return file_path, stored_size
+
+            try:
+                reserve(session.owner, stored_size)
+            except QuotaExceeded:
+                raise UploadError('Storage quota exceeded.')
+            blob = store_blob(digest, place_file, codec, content_size=session.size)
+            adjust(session.owner_id, blob.size - stored_size)
+            file_obj = File(
+                owner=session.owner,
+                folder=session.folder,
+                name=session.name,
+                size=blob.size,
+                visibility=session.visibility,
+                blob=blob,
+            )
+            file_obj.save()
+            session.delete()
+    finally:
+        if source != partial:
+            unlink_quietly(source)
+    # Left behind when the content was already stored or has been recompressed.
+    unlink_quietly(partial)
+    return file_obj
+
+
+def abort_session(session):
+    unlink_quietly(part_path(session))
+    session.delete()
+
+
+def purge_expired_sessions(user=None):
+    sessions = UploadSession.objects.filter(expires_at__lt=timezone.now())
+    if user is not None:
+        sessions = sessions.filter(owner=user)
+    count = 0
+    for session in sessions:
+        abort_session(session)
+        count += 1
+    return count
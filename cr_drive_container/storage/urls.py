@@ -1,12 +1,26 @@
-from django.urls import path
+from django.conf import settings
+from django.urls import path, re_path
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from . import api
 from .views import (
-    DriveView, DownloadFileView, ViewFileView, ShareFileView,
-    RequestAccessView, AcceptAccessView, SuperuserDashboardView, SuperuserUserFilesView,
+    DriveView, ShareFileView,
+    RequestAccessView, AcceptAccessView, SuperuserDashboardView, SuperuserUserFilesView, PlaintextCacheStatsView,
     RequestAccessToFileView, RequestAccessToFolderView, OwnerAccessRequestsView, ApproveAccessRequestView, RejectAccessRequestView,
     ShareLinkFileView, ShareLinkFolderView,
-    ShareInfoView, ShareUpdateView, ShareAddUserView, ShareRemoveUserView
 )
 
+# Under ASGI, transfers, uploads and the sharing API are served by native async views.
+if settings.ASYNC_VIEWS:
+    from .async_views import (
+        DownloadFileView, ViewFileView, ShareInfoView, ShareUpdateView, ShareAddUserView, ShareRemoveUserView,
+        UploadSessionCreateView, UploadSessionView, UploadChunkView, UploadFinalizeView,
+    )
+else:
+    from .views import (
+        DownloadFileView, ViewFileView, ShareInfoView, ShareUpdateView, ShareAddUserView, ShareRemoveUserView,
+        UploadSessionCreateView, UploadSessionView, UploadChunkView, UploadFinalizeView,
+    )
+
 urlpatterns = [
     path('drive/', DriveView.as_view(), name='drive'),
     path('download/<int:file_id>/', DownloadFileView.as_view(), name='download_file'),
@@ -27,4 +41,16 @@ urlpatterns = [
     path('api/share-update/<str:type>/<int:id>/', ShareUpdateView.as_view(), name='api_share_update'),
     path('api/share-add-user/<str:type>/<int:id>/', ShareAddUserView.as_view(), name='api_share_add_user'),
     path('api/share-remove-user/<str:type>/<int:id>/', ShareRemoveUserView.as_view(), name='api_share_remove_user'),
-] 
\ No newline at end of file
+    path('api/uploads/', UploadSessionCreateView.as_view(), name='api_upload_create'),
+    path('api/uploads/<uuid:upload_id>/', UploadSessionView.as_view(), name='api_upload_session'),
+    path('api/uploads/<uuid:upload_id>/chunks/<int:index>/', UploadChunkView.as_view(), name='api_upload_chunk'),
+    path('api/uploads/<uuid:upload_id>/finalize/', UploadFinalizeView.as_view(), name='api_upload_finalize'),
+    path('api/cache-stats/', PlaintextCacheStatsView.as_view(), name='api_cache_stats'),
+    re_path(r'^api/(?P<version>v\d+)/listing/$', api.ListingView.as_view(), name='api_listing'),
+    re_path(r'^api/(?P<version>v\d+)/folders/(?P<pk>\d+)/$', api.FolderDetailView.as_view(), name='api_folder'),
+    re_path(r'^api/(?P<version>v\d+)/files/(?P<pk>\d+)/$', api.FileDetailView.as_view(), name='api_file'),
+    re_path(r'^api/(?P<version>v\d+)/(?P<kind>files|folders)/(?P<pk>\d+)/share/$', api.ShareStateView.as_view(), name='api_share_state'),
+    re_path(r'^api/(?P<version>v\d+)/access-requests/pending/$', api.PendingRequestCountView.as_view(), name='api_pending_requests'),
+    re_path(r'^api/(?P<version>v\d+)/token/$', TokenObtainPairView.as_view(), name='api_token'),
+    re_path(r'^api/(?P<version>v\d+)/token/refresh/$', TokenRefreshView.as_view(), name='api_token_refresh'),
+]
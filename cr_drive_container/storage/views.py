@@ -2,102 +2,160 @@ from django.views import View
 from django.views.generic import TemplateView
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import HttpResponse, Http404, JsonResponse
+from django.http import Http404, JsonResponse
 from django.contrib import messages
-from .models import File, Folder, AccessRequest
+from .models import File, Folder, AccessRequest, UploadSession
 from .forms import FileUploadForm, FolderCreateForm, RenameForm, MoveForm
 from sharing.models import Permission
 from django.contrib.auth.models import User
 from django.conf import settings
 import os
-from .encryption import encrypt_file, decrypt_file
+from . import cache
+from .access import policy_for
+from .encryption import ciphertext_length
+from .quota import QuotaExceeded, adjust, get_usage, reserve
+from .pagination import paginate, parse_sort
+from .reclaim import delete_folder
+from .blobstore import release_blob, share_blob, store_blob, store_content
+from .streaming import conditional_response, encrypted_file_response, file_etag, read_plaintext
+from .uploads import (
+    UploadError, create_session, write_chunk, received_chunks, contiguous_offset, finalize_session,
+    abort_session, purge_expired_sessions, EncryptedUploadedFile, EncryptingFileUploadHandler,
+)
 import mimetypes
 import re
-from django.core.files.base import File as DjangoFile
 import logging
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
 from django.views.decorators.http import require_POST
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.utils.decorators import method_decorator
 
 logger = logging.getLogger(__name__)
 
-# Helper: get user storage usage
-def get_user_storage_usage(user):
-    return sum(f.size for f in File.objects.filter(owner=user))
+# Files with these extensions open in the text viewer/editor instead of inline.
+TEXT_EXTS = ['.txt', '.csv', '.md', '.py', '.json', '.log']
+
+# Orderings offered by the drive listing; see storage.pagination.
+SORT_CHOICES = [
+    ('name', 'Name (A-Z)'),
+    ('-name', 'Name (Z-A)'),
+    ('size', 'Smallest first'),
+    ('-size', 'Largest first'),
+    ('-created_at', 'Newest first'),
+    ('created_at', 'Oldest first'),
+]
 
 def get_breadcrumbs(folder):
-    breadcrumbs = []
-    while folder:
-        breadcrumbs.insert(0, folder)
-        folder = folder.parent
-    return breadcrumbs
+    return folder.ancestors() if folder else []
+
+def with_access_flags(queryset, user, target, inherited=False):
+    # `shared_with_user`: user holds a Permission; `access_pending`: user has a pending AccessRequest.
+    # `target` is 'file' or 'folder', matching the queryset's model. `inherited` means a grant on
+    # a folder above already covers every row.
+    if inherited:
+        shared = models.Value(True, output_field=models.BooleanField())
+    else:
+        shared = models.Exists(Permission.objects.filter(user=user, **{target: models.OuterRef('pk')}))
+    return queryset.annotate(
+        shared_with_user=shared,
+        access_pending=models.Exists(
+            AccessRequest.objects.filter(user=user, status='pending', **{target: models.OuterRef('pk')})),
+    )
+
+def visible_to(queryset, user):
+    return queryset.filter(
+        models.Q(owner=user) | models.Q(visibility__in=['public', 'ask']) | models.Q(shared_with_user=True))
 
 class IsSuperuserMixin(UserPassesTestMixin):
     def test_func(self):
         return self.request.user.is_superuser
 
+def public_cache_key(file):
+    # Only public content goes into the shared plaintext cache.
+    return file.blob_id if file.visibility == 'public' else None
+
+def replace_file_content(file, data):
+    # Blobs may be shared with other files, so edits are stored as a new blob.
+    # Raises QuotaExceeded if the owner cannot fit the uncompressed new content.
+    with transaction.atomic():
+        old_blob_id = file.blob_id
+        estimate = ciphertext_length(len(data))
+        reserve(file.owner, estimate - file.size)
+        file.blob = store_content(file.owner, file.name, data)
+        adjust(file.owner_id, file.blob.size - estimate)
+        file.size = file.blob.size
+        file.save()
+        release_blob(old_blob_id)
+    cache.invalidate(old_blob_id)
+
+def get_requested_folder(request):
+    folder_id = request.GET.get('folder')
+    # Robust folder_id validation
+    try:
+        folder_id_int = int(folder_id)
+    except (TypeError, ValueError):
+        return None
+    if folder_id_int > 0:
+        return get_object_or_404(Folder, id=folder_id_int)
+    return None
+
+def drive_listing(folder, policy):
+    # The subfolders and files the policy's user sees in `folder` (None for the root), with
+    # access flags. Raises Http404 if the folder itself is hidden from them.
+    user = policy.user
+    inherited = None
+    if folder:
+        if not policy.can_see(folder):
+            raise Http404()
+        # A grant on this folder or any folder above it covers everything listed here.
+        inherited = policy.level(folder)
+        folders = folder.subfolders.all()
+        files = folder.files.all()
+    else:
+        folders = Folder.objects.filter(parent=None)
+        files = File.objects.filter(folder__isnull=True)
+    # The access flags are per-row EXISTS subqueries, so each listing stays one query.
+    folders = with_access_flags(folders, user, 'folder', inherited)
+    files = with_access_flags(files, user, 'file', inherited)
+    if inherited:
+        return folders, files
+    return visible_to(folders, user), visible_to(files, user)
+
 class DriveView(LoginRequiredMixin, View):
     template_name = 'storage/drive.html'
+    upload_handler = None
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        # Uploads are encrypted while the request body is parsed, so the handler must replace
+        # the default ones before CSRF validation reads request.POST; CSRF is enforced right after.
+        if request.method == 'POST' and request.user.is_authenticated:
+            self.upload_handler = EncryptingFileUploadHandler(request)
+            request.upload_handlers = [self.upload_handler]
+        try:
+            return csrf_protect(super().dispatch)(request, *args, **kwargs)
+        finally:
+            # Don't leave ciphertext behind for uploads that never became a File.
+            if hasattr(request, '_files'):
+                for upload in request.FILES.getlist('file'):
+                    if isinstance(upload, EncryptedUploadedFile):
+                        upload.discard()
 
     def get(self, request):
-        folder_id = request.GET.get('folder')
         view_mode = request.GET.get('view', 'list')
-        folder = None
+        folder = get_requested_folder(request)
         user = request.user
-        # Robust folder_id validation
-        try:
-            folder_id_int = int(folder_id)
-            if folder_id_int > 0:
-                folder = get_object_or_404(Folder, id=folder_id_int)
-            else:
-                folder = None
-        except (TypeError, ValueError):
-            folder = None
-        if folder:
-            # Check folder visibility
-            is_owner = folder.owner == user or user.is_superuser
-            is_shared = Permission.objects.filter(folder=folder, user=user).exists()
-            if not (is_owner or is_shared or folder.visibility in ['public', 'ask']):
-                raise Http404()
-            # Subfolders
-            shared_folder_ids = Permission.objects.filter(user=user, folder__in=folder.subfolders.all()).values_list('folder_id', flat=True)
-            folders = folder.subfolders.filter(
-                models.Q(owner=user) |
-                models.Q(visibility='public') |
-                models.Q(visibility='ask') |
-                models.Q(id__in=shared_folder_ids)
-            ).distinct()
-            # Files
-            shared_file_ids = Permission.objects.filter(user=user, file__in=folder.files.all()).values_list('file_id', flat=True)
-            files = folder.files.filter(
-                models.Q(owner=user) |
-                models.Q(visibility='public') |
-                models.Q(visibility='ask') |
-                models.Q(id__in=shared_file_ids)
-            ).distinct()
-            breadcrumbs = get_breadcrumbs(folder)
-        else:
-            root_folders = Folder.objects.filter(parent=None)
-            shared_folder_ids = Permission.objects.filter(user=user, folder__in=root_folders).values_list('folder_id', flat=True)
-            folders = root_folders.filter(
-                models.Q(owner=user) |
-                models.Q(visibility='public') |
-                models.Q(visibility='ask') |
-                models.Q(id__in=shared_folder_ids)
-            ).distinct()
-            root_files = File.objects.filter(folder__isnull=True)
-            shared_file_ids = Permission.objects.filter(user=user, file__in=root_files).values_list('file_id', flat=True)
-            files = root_files.filter(
-                models.Q(owner=user) |
-                models.Q(visibility='public') |
-                models.Q(visibility='ask') |
-                models.Q(id__in=shared_file_ids)
-            ).distinct()
-            breadcrumbs = []
+        # The first page; drive.js loads the rest, and other folders, from the JSON API (storage.api).
+        sort = parse_sort(request.GET.get('sort'))
+        folders, files, next_cursor = paginate(*drive_listing(folder, policy_for(request)), sort)
+        breadcrumbs = get_breadcrumbs(folder)
         context = {
             'folders': folders,
             'files': files,
+            'next_cursor': next_cursor,
+            'sort': sort,
+            'sort_choices': SORT_CHOICES,
             'current_folder': folder,
             'breadcrumbs': breadcrumbs,
             'view_mode': view_mode,
@@ -114,38 +172,11 @@ class DriveView(LoginRequiredMixin, View):
             'move_target': None,
             'remove_target': None,
         }
-        # Add sets of folder/file IDs the user can share
-        context['can_share_folder_ids'] = set(Permission.objects.filter(user=user, folder__in=folders).values_list('folder_id', flat=True))
-        context['can_share_file_ids'] = set(Permission.objects.filter(user=user, file__in=files).values_list('file_id', flat=True))
-        # Add set of file IDs with pending access requests
-        context['pending_access_file_ids'] = set(AccessRequest.objects.filter(user=user, file__in=files, status='pending').values_list('file_id', flat=True))
-        # Optionally, for folders:
-        context['pending_access_folder_ids'] = set(AccessRequest.objects.filter(user=user, folder__in=folders, status='pending').values_list('folder_id', flat=True))
-        # Add count of pending requests for owner's files/folders
-        pending_count = 0
-        if user.is_authenticated:
-            pending_count = AccessRequest.objects.filter(
-                status='pending',
-                file__owner=user
-            ).count() + AccessRequest.objects.filter(
-                status='pending',
-                folder__owner=user
-            ).count()
-        context['pending_access_request_count'] = pending_count
+        # The pending-request badge is filled in by drive.js from the api_pending_requests endpoint.
         return render(request, self.template_name, context)
 
     def post(self, request):
-        folder_id = request.GET.get('folder')
-        folder = None
-        # Robust folder_id validation
-        try:
-            folder_id_int = int(folder_id)
-            if folder_id_int > 0:
-                folder = get_object_or_404(Folder, id=folder_id_int)
-            else:
-                folder = None
-        except (TypeError, ValueError):
-            folder = None
+        folder = get_requested_folder(request)
         view_mode = request.GET.get('view', 'list')
         # Rebuild context for error display
         folders = folder.subfolders.all() if folder else Folder.objects.filter(owner=request.user, parent=None)
@@ -154,6 +185,8 @@ class DriveView(LoginRequiredMixin, View):
         context = {
             'folders': folders,
             'files': files,
+            'sort': 'name',
+            'sort_choices': SORT_CHOICES,
             'current_folder': folder,
             'breadcrumbs': breadcrumbs,
             'view_mode': view_mode,
@@ -171,45 +204,30 @@ class DriveView(LoginRequiredMixin, View):
             'remove_target': None,
         }
         if 'upload_file' in request.POST:
+            # Reading request.POST ran the upload handler, if nothing had before.
+            if self.upload_handler and self.upload_handler.too_large:
+                return JsonResponse({'status': 'error', 'message': f'File size exceeds the limit of {settings.MAX_FILE_SIZE // (1024*1024)} MB.'})
             file_form = FileUploadForm(request.POST, request.FILES)
-            if file_form.is_valid():
-                upload = request.FILES['file']
-                if upload.size > settings.MAX_FILE_SIZE:
-                    return JsonResponse({'status': 'error', 'message': f'File size exceeds the limit of {settings.MAX_FILE_SIZE // (1024*1024)} MB.'})
-                file_bytes = upload.read()
-                encrypted_bytes = encrypt_file(file_bytes)
+            # The upload handler has already encrypted the file to a temporary blob file.
+            upload = request.FILES.get('file')
+            if file_form.is_valid() and isinstance(upload, EncryptedUploadedFile):
                 file_obj = file_form.save(commit=False)
                 file_obj.owner = request.user
                 file_obj.name = upload.name
-                file_obj.size = len(encrypted_bytes)
+                file_obj.size = upload.stored_size
                 if folder:
                     file_obj.folder = folder
-                usage = get_user_storage_usage(request.user)
-                if usage + file_obj.size > settings.USER_STORAGE_QUOTA:
+                try:
+                    with transaction.atomic():
+                        reserve(request.user, upload.stored_size)
+                        file_obj.blob = store_blob(upload.digest, upload.place, upload.codec, upload.size)
+                        adjust(request.user.id, file_obj.blob.size - upload.stored_size)
+                        file_obj.size = file_obj.blob.size
+                        file_obj.save()
+                except QuotaExceeded:
                     return JsonResponse({'status': 'error', 'message': 'Storage quota exceeded.'})
-                def sanitize_filename(name):
-                    name = re.sub(r'[\w\-. ]', '_', name)
-                    return name[:100]
-                safe_name = sanitize_filename(upload.name)
-                user_folder = f'user_{request.user.id}'
-                folder_part = f'folder_{folder.id}' if folder else 'root'
-                file_path = f'files/{user_folder}/{folder_part}/{safe_name}'
-                abs_path = os.path.join(settings.MEDIA_ROOT, file_path)
-                os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-                base, ext = os.path.splitext(safe_name)
-                counter = 1
-                unique_path = abs_path
-                unique_file_path = file_path
-                while os.path.exists(unique_path):
-                    safe_name = f"{base}_{counter}{ext}"
-                    unique_file_path = f'files/{user_folder}/{folder_part}/{safe_name}'
-                    unique_path = os.path.join(settings.MEDIA_ROOT, unique_file_path)
-                    counter += 1
-                with open(unique_path, 'wb') as f:
-                    f.write(encrypted_bytes)
-                with open(unique_path, 'rb') as f:
-                    file_obj.file.save(safe_name, DjangoFile(f), save=False)
-                file_obj.save()
+                # Keeps the ciphertext if place() stored it; already stored content was shared instead.
+                upload.committed = True
                 return JsonResponse({'status': 'success', 'message': 'File uploaded and encrypted successfully.'})
             else:
                 return JsonResponse({'status': 'error', 'message': 'Invalid form.'})
@@ -234,7 +252,7 @@ class DriveView(LoginRequiredMixin, View):
                 target = get_object_or_404(File, id=target_id)
             else:
                 target = get_object_or_404(Folder, id=target_id)
-            if (hasattr(target, 'owner') and target.owner == request.user) or request.user.is_superuser:
+            if policy_for(request).can_manage(target):
                 if rename_form.is_valid():
                     target.name = rename_form.cleaned_data['name']
                     target.save()
@@ -246,14 +264,14 @@ class DriveView(LoginRequiredMixin, View):
             else:
                 messages.error(request, 'Permission denied.')
         elif 'move' in request.POST:
-            move_form = MoveForm(request.POST, user=request.user)
             target_type = request.POST.get('target_type')
             target_id = request.POST.get('target_id')
             if target_type == 'file':
                 target = get_object_or_404(File, id=target_id)
             else:
                 target = get_object_or_404(Folder, id=target_id)
-            if (hasattr(target, 'owner') and target.owner == request.user) or request.user.is_superuser:
+            move_form = MoveForm(request.POST, user=request.user, target=target)
+            if policy_for(request).can_manage(target):
                 if move_form.is_valid():
                     dest = move_form.cleaned_data['destination']
                     if target_type == 'file':
@@ -266,6 +284,7 @@ class DriveView(LoginRequiredMixin, View):
                 else:
                     context['show_move_modal'] = True
                     context['move_target'] = target
+                    context['move_form'] = move_form
             else:
                 messages.error(request, 'Permission denied.')
         elif 'remove' in request.POST:
@@ -275,18 +294,12 @@ class DriveView(LoginRequiredMixin, View):
                 target = get_object_or_404(File, id=target_id)
             else:
                 target = get_object_or_404(Folder, id=target_id)
-            if (hasattr(target, 'owner') and target.owner == request.user) or request.user.is_superuser:
+            if policy_for(request).can_manage(target):
+                # Blobs are released by the File post_delete signal.
                 if target_type == 'file':
-                    target.file.delete()
                     target.delete()
                 else:
-                    def delete_folder(folder):
-                        for f in folder.files.all():
-                            f.file.delete()
-                            f.delete()
-                        for sub in folder.subfolders.all():
-                            delete_folder(sub)
-                        folder.delete()
+                    # Flags the subtree; reclaim_deleted removes the rows and ciphertext later.
                     delete_folder(target)
                 messages.success(request, 'Deleted successfully.')
                 return redirect(request.get_full_path())
@@ -294,99 +307,189 @@ class DriveView(LoginRequiredMixin, View):
                 messages.error(request, 'Permission denied.')
                 context['show_remove_modal'] = True
                 context['remove_target'] = target
+        elif 'copy' in request.POST:
+            target = get_object_or_404(File, id=request.POST.get('target_id'))
+            user = request.user
+            if not policy_for(request).can_read(target):
+                messages.error(request, 'Permission denied.')
+            else:
+                # The copy shares the original's blob; no data is read or written.
+                try:
+                    with transaction.atomic():
+                        reserve(user, target.size)
+                        share_blob(target.blob)
+                        File.objects.create(
+                            name=target.name,
+                            owner=user,
+                            folder=folder if folder and policy_for(request).is_owner(folder) else None,
+                            blob=target.blob,
+                            size=target.size,
+                        )
+                except QuotaExceeded:
+                    messages.error(request, 'Storage quota exceeded.')
+                else:
+                    messages.success(request, 'Copied successfully.')
+                    return redirect(request.get_full_path())
         return render(request, self.template_name, context)
 
 class DownloadFileView(LoginRequiredMixin, View):
     def get(self, request, file_id):
-        file = get_object_or_404(File, id=file_id)
-        user = request.user
-        is_owner = file.owner == user or user.is_superuser
-        is_shared = Permission.objects.filter(file=file, user=user).exists()
-        if not (is_owner or is_shared or file.visibility == 'public'):
+        file = get_object_or_404(File.objects.select_related('blob', 'folder'), id=file_id)
+        if not policy_for(request).can_read(file):
             if file.visibility == 'ask':
                 messages.error(request, 'You must request access to this file.')
                 return redirect('drive')
             raise Http404()
-        file_path = file.file.path
+        etag = file_etag(file.blob)
+        not_modified = conditional_response(request, etag, file.updated_at)
+        if not_modified:
+            return not_modified
+        file_path = file.blob.file.path
         if not os.path.exists(file_path):
             raise Http404()
-        with open(file_path, 'rb') as f:
-            encrypted_bytes = f.read()
-            decrypted_bytes = decrypt_file(encrypted_bytes)
-            if decrypted_bytes is None:
-                raise Http404('File decryption failed.')
-            response = HttpResponse(decrypted_bytes, content_type='application/octet-stream')
-            response['Content-Disposition'] = f'attachment; filename="{file.name}"'
-            return response
+        return encrypted_file_response(request, file_path, file.name, 'attachment', last_modified=file.updated_at,
+                                       codec=file.blob.codec, content_size=file.blob.content_size,
+                                       cache_key=public_cache_key(file), etag=etag)
 
 class ViewFileView(LoginRequiredMixin, View):
     template_name = 'storage/view_text_file.html'
     def get(self, request, file_id):
-        file = get_object_or_404(File, id=file_id)
-        user = request.user
-        is_owner = file.owner == user or user.is_superuser
-        is_shared = Permission.objects.filter(file=file, user=user).exists()
-        if not (is_owner or is_shared or file.visibility == 'public'):
+        file = get_object_or_404(File.objects.select_related('blob', 'folder'), id=file_id)
+        if not policy_for(request).can_read(file):
             if file.visibility == 'ask':
                 messages.error(request, 'You must request access to this file.')
                 return redirect('drive')
             raise Http404()
-        file_path = file.file.path
+        ext = os.path.splitext(file.name)[1].lower()
+        etag = file_etag(file.blob)
+        if ext not in TEXT_EXTS:
+            # The text editor page carries a CSRF token, so only raw content is revalidated.
+            not_modified = conditional_response(request, etag, file.updated_at)
+            if not_modified:
+                return not_modified
+        file_path = file.blob.file.path
         if not os.path.exists(file_path):
             raise Http404()
-        ext = os.path.splitext(file.name)[1].lower()
-        text_exts = ['.txt', '.csv', '.md', '.py', '.json', '.log']
-        with open(file_path, 'rb') as f:
-            encrypted_bytes = f.read()
-            decrypted_bytes = decrypt_file(encrypted_bytes)
-            if decrypted_bytes is None:
-                raise Http404('File decryption failed.')
-            if ext in text_exts:
-                text = decrypted_bytes.decode(errors='replace')
-                return render(request, self.template_name, {'file': file, 'text': text})
-            else:
-                mime, _ = mimetypes.guess_type(file.name)
-                response = HttpResponse(decrypted_bytes, content_type=mime or 'application/octet-stream')
-                response['Content-Disposition'] = f'inline; filename="{file.name}"'
-                return response
+        if ext in TEXT_EXTS:
+            text = read_plaintext(file_path, file.blob.codec).decode(errors='replace')
+            return render(request, self.template_name, {'file': file, 'text': text})
+        mime, _ = mimetypes.guess_type(file.name)
+        return encrypted_file_response(request, file_path, file.name, 'inline', mime or 'application/octet-stream',
+                                       last_modified=file.updated_at, codec=file.blob.codec,
+                                       content_size=file.blob.content_size, cache_key=public_cache_key(file),
+                                       etag=etag)
     def post(self, request, file_id):
-        file = get_object_or_404(File, id=file_id)
-        user = request.user
-        is_owner = file.owner == user or user.is_superuser
-        is_shared = Permission.objects.filter(file=file, user=user).exists()
-        if not (is_owner or is_shared or file.visibility == 'public'):
+        file = get_object_or_404(File.objects.select_related('blob', 'folder'), id=file_id)
+        if not policy_for(request).can_read(file):
             if file.visibility == 'ask':
                 messages.error(request, 'You must request access to this file.')
                 return redirect('drive')
             raise Http404()
-        file_path = file.file.path
+        file_path = file.blob.file.path
         if not os.path.exists(file_path):
             raise Http404()
         ext = os.path.splitext(file.name)[1].lower()
-        text_exts = ['.txt', '.csv', '.md', '.py', '.json', '.log']
-        if ext in text_exts:
+        if ext in TEXT_EXTS:
             new_text = request.POST.get('file_content', '')
-            new_encrypted = encrypt_file(new_text.encode())
-            with open(file_path, 'wb') as wf:
-                wf.write(new_encrypted)
-            file.size = len(new_encrypted)
-            file.save()
-            messages.success(request, 'File saved.')
+            try:
+                replace_file_content(file, new_text.encode())
+            except QuotaExceeded:
+                messages.error(request, 'Storage quota exceeded.')
+            else:
+                messages.success(request, 'File saved.')
             return redirect('view_file', file_id=file.id)
         else:
             return self.get(request, file_id)
 
+# --- Resumable chunked uploads ---
+def can_upload_to(request, folder):
+    return folder is None or policy_for(request).can_write(folder)
+
+class UploadSessionCreateView(LoginRequiredMixin, View):
+    def post(self, request):
+        user = request.user
+        purge_expired_sessions(user)
+        name = request.POST.get('name', '').strip()
+        visibility = request.POST.get('visibility', 'private')
+        try:
+            size = int(request.POST.get('size'))
+        except (TypeError, ValueError):
+            size = -1
+        if not name or size < 0 or visibility not in ['public', 'private', 'ask']:
+            return JsonResponse({'status': 'error', 'message': 'Invalid upload.'}, status=400)
+        folder = None
+        if request.POST.get('folder'):
+            folder = get_object_or_404(Folder, id=request.POST.get('folder'))
+        if not can_upload_to(request, folder):
+            return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
+        if size > settings.MAX_FILE_SIZE:
+            return JsonResponse({'status': 'error', 'message': f'File size exceeds the limit of {settings.MAX_FILE_SIZE // (1024*1024)} MB.'}, status=400)
+        if get_usage(user) + ciphertext_length(size) > settings.USER_STORAGE_QUOTA:
+            return JsonResponse({'status': 'error', 'message': 'Storage quota exceeded.'}, status=400)
+        session = create_session(user, folder, name, size, visibility)
+        return JsonResponse({
+            'status': 'success',
+            'upload_id': str(session.id),
+            'chunk_size': session.chunk_size,
+            'chunk_count': session.chunk_count,
+        }, status=201)
+
+class UploadSessionView(LoginRequiredMixin, View):
+    def get(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id, owner=request.user)
+        received = received_chunks(session)
+        return JsonResponse({
+            'status': 'success',
+            'upload_id': str(session.id),
+            'name': session.name,
+            'size': session.size,
+            'chunk_size': session.chunk_size,
+            'chunk_count': session.chunk_count,
+            'received': received,
+            'offset': contiguous_offset(session, received),
+            'expires_at': session.expires_at.isoformat(),
+        })
+
+    def delete(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id, owner=request.user)
+        abort_session(session)
+        return JsonResponse({'status': 'success'})
+
+class UploadChunkView(LoginRequiredMixin, View):
+    content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    def put(self, request, upload_id, index):
+        session = get_object_or_404(UploadSession, id=upload_id, owner=request.user)
+        match = self.content_range_re.match(request.headers.get('Content-Range', ''))
+        if not match or int(match.group(3)) != session.size:
+            return JsonResponse({'status': 'error', 'message': 'Missing or invalid Content-Range.'}, status=400)
+        start, end = int(match.group(1)), int(match.group(2))
+        try:
+            write_chunk(session, index, request, start, end - start + 1)
+        except UploadError as e:
+            return JsonResponse({'status': 'error', 'message': e.message}, status=e.status)
+        return JsonResponse({'status': 'success', 'index': index})
+
+class UploadFinalizeView(LoginRequiredMixin, View):
+    def post(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id, owner=request.user)
+        try:
+            file_obj = finalize_session(session)
+        except UploadError as e:
+            return JsonResponse({'status': 'error', 'message': e.message}, status=e.status)
+        return JsonResponse({'status': 'success', 'file_id': file_obj.id, 'message': 'File uploaded and encrypted successfully.'})
+
 class ShareFileView(LoginRequiredMixin, View):
     template_name = 'storage/share_file.html'
     def get(self, request, file_id):
         file = get_object_or_404(File, id=file_id)
-        if file.owner != request.user:
+        if not policy_for(request).is_owner(file):
             messages.error(request, 'Only the owner can share this file.')
             return redirect('drive')
         return render(request, self.template_name, {'file': file})
     def post(self, request, file_id):
         file = get_object_or_404(File, id=file_id)
-        if file.owner != request.user:
+        if not policy_for(request).is_owner(file):
             messages.error(request, 'Only the owner can share this file.')
             return redirect('drive')
         username = request.POST.get('username')
@@ -409,7 +512,7 @@ class RequestAccessView(LoginRequiredMixin, View):
 class AcceptAccessView(LoginRequiredMixin, View):
     def post(self, request, permission_id):
         perm = get_object_or_404(Permission, id=permission_id)
-        if perm.file and perm.file.owner == request.user:
+        if perm.file and policy_for(request).is_owner(perm.file):
             perm.access_level = 'read'
             perm.save()
             messages.success(request, 'Access granted.')
@@ -434,11 +537,17 @@ class SuperuserUserFilesView(IsSuperuserMixin, TemplateView):
         context['folders'] = Folder.objects.filter(owner=user)
         return context
 
+class PlaintextCacheStatsView(IsSuperuserMixin, View):
+    def get(self, request):
+        if cache.plaintext_cache is None:
+            return JsonResponse({'enabled': False})
+        return JsonResponse({'enabled': True, **cache.plaintext_cache.stats()})
+
 class RequestAccessToFileView(LoginRequiredMixin, View):
     def post(self, request, file_id):
         file = get_object_or_404(File, id=file_id)
         user = request.user
-        if file.owner == user or Permission.objects.filter(file=file, user=user).exists():
+        if policy_for(request).is_owner(file) or policy_for(request).level(file):
             messages.info(request, 'You already have access.')
         else:
             ar, created = AccessRequest.objects.get_or_create(user=user, file=file)
@@ -452,7 +561,7 @@ class RequestAccessToFolderView(LoginRequiredMixin, View):
     def post(self, request, folder_id):
         folder = get_object_or_404(Folder, id=folder_id)
         user = request.user
-        if folder.owner == user or Permission.objects.filter(folder=folder, user=user).exists():
+        if policy_for(request).is_owner(folder) or policy_for(request).level(folder):
             messages.info(request, 'You already have access.')
         else:
             ar, created = AccessRequest.objects.get_or_create(user=user, folder=folder)
@@ -467,14 +576,14 @@ class OwnerAccessRequestsView(LoginRequiredMixin, View):
     def get(self, request):
         user = request.user
         # All requests for files/folders owned by this user
-        file_requests = AccessRequest.objects.filter(file__owner=user, status='pending')
-        folder_requests = AccessRequest.objects.filter(folder__owner=user, status='pending')
+        file_requests = AccessRequest.objects.filter(file__owner=user, status='pending').select_related('user', 'file')
+        folder_requests = AccessRequest.objects.filter(folder__owner=user, status='pending').select_related('user', 'folder')
         return render(request, self.template_name, {'file_requests': file_requests, 'folder_requests': folder_requests})
 
 class ApproveAccessRequestView(LoginRequiredMixin, View):
     def post(self, request, request_id):
         ar = get_object_or_404(AccessRequest, id=request_id)
-        if (ar.file and ar.file.owner == request.user) or (ar.folder and ar.folder.owner == request.user):
+        if policy_for(request).is_owner(ar.file or ar.folder):
             ar.status = 'approved'
             ar.save()
             # Grant permission
@@ -490,7 +599,7 @@ class ApproveAccessRequestView(LoginRequiredMixin, View):
 class RejectAccessRequestView(LoginRequiredMixin, View):
     def post(self, request, request_id):
         ar = get_object_or_404(AccessRequest, id=request_id)
-        if (ar.file and ar.file.owner == request.user) or (ar.folder and ar.folder.owner == request.user):
+        if policy_for(request).is_owner(ar.file or ar.folder):
             ar.status = 'rejected'
             ar.save()
             messages.info(request, 'Access request rejected.')
@@ -525,9 +634,9 @@ class ShareLinkFileView(View):
                 'share_banner': banner,
             })
         user = request.user if request.user.is_authenticated else None
-        is_owner = user and (file.owner == user or user.is_superuser)
-        is_shared = user and Permission.objects.filter(file=file, user=user).exists()
-        can_view = file.visibility == 'public' or is_owner or is_shared
+        policy = policy_for(request)
+        is_owner = policy.can_manage(file)
+        can_view = policy.can_read(file)
         # If not accessible
         if not can_view:
             if file.visibility == 'ask':
@@ -641,11 +750,11 @@ class ShareLinkFolderView(View):
                 'share_banner': banner,
             })
         user = request.user if request.user.is_authenticated else None
-        is_owner = user and (folder.owner == user or user.is_superuser)
-        is_shared = user and Permission.objects.filter(folder=folder, user=user).exists()
-        if folder.visibility == 'public' or is_owner or is_shared:
-            files = folder.files.all() if (is_owner or is_shared) else folder.files.filter(visibility='public')
-            subfolders = folder.subfolders.all() if (is_owner or is_shared) else folder.subfolders.filter(visibility='public')
+        policy = policy_for(request)
+        has_access = policy.can_manage(folder) or policy.level(folder)
+        if folder.visibility == 'public' or has_access:
+            files = folder.files.all() if has_access else folder.files.filter(visibility='public')
+            subfolders = folder.subfolders.all() if has_access else folder.subfolders.filter(visibility='public')
             return render(request, 'storage/drive.html', {
                 'folders': subfolders,
                 'files': files,
@@ -698,23 +807,23 @@ class ShareLinkFolderView(View):
 # --- AJAX endpoints for sharing modal ---
 class ShareInfoView(LoginRequiredMixin, View):
     def get(self, request, type, id):
-        user = request.user
+        policy = policy_for(request)
+        obj = get_object_or_404(File if type == 'file' else Folder, id=id)
+        if not policy.can_see(obj):
+            raise Http404()
+        is_owner = policy.can_manage(obj)
         # If owner requests a share link for a private item, auto-switch to 'ask' mode for secure sharing
+        if obj.visibility == 'private' and is_owner:
+            obj.visibility = 'ask'
+            obj.save()
         if type == 'file':
-            obj = get_object_or_404(File, id=id)
-            if obj.visibility == 'private' and (obj.owner == user or user.is_superuser):
-                obj.visibility = 'ask'
-                obj.save()
             share_link = request.build_absolute_uri(reverse('share_link_file', args=[obj.share_token]))
-            shared_users = list(Permission.objects.filter(file=obj).values('user__username', 'access_level'))
+            permissions = Permission.objects.filter(file=obj)
         else:
-            obj = get_object_or_404(Folder, id=id)
-            if obj.visibility == 'private' and (obj.owner == user or user.is_superuser):
-                obj.visibility = 'ask'
-                obj.save()
             share_link = request.build_absolute_uri(reverse('share_link_folder', args=[obj.share_token]))
-            shared_users = list(Permission.objects.filter(folder=obj).values('user__username', 'access_level'))
-        is_owner = obj.owner == user or user.is_superuser
+            permissions = Permission.objects.filter(folder=obj)
+        # Only whoever can change the grants gets to see them.
+        shared_users = list(permissions.values('user__username', 'access_level')) if is_owner else []
         return JsonResponse({
             'name': obj.name,
             'share_link': share_link,
@@ -726,13 +835,12 @@ class ShareInfoView(LoginRequiredMixin, View):
 @method_decorator(require_POST, name='dispatch')
 class ShareUpdateView(LoginRequiredMixin, View):
     def post(self, request, type, id):
-        user = request.user
         visibility = request.POST.get('visibility')
         if type == 'file':
             obj = get_object_or_404(File, id=id)
         else:
             obj = get_object_or_404(Folder, id=id)
-        if obj.owner != user and not user.is_superuser:
+        if not policy_for(request).can_manage(obj):
             return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
         if visibility in ['public', 'private', 'ask']:
             obj.visibility = visibility
@@ -743,7 +851,6 @@ class ShareUpdateView(LoginRequiredMixin, View):
 @method_decorator(require_POST, name='dispatch')
 class ShareAddUserView(LoginRequiredMixin, View):
     def post(self, request, type, id):
-        user = request.user
         username = request.POST.get('username')
         access_level = request.POST.get('access_level', 'read')
         target_user = User.objects.filter(username=username).first()
@@ -751,18 +858,19 @@ class ShareAddUserView(LoginRequiredMixin, View):
             return JsonResponse({'status': 'error', 'message': 'User not found.'}, status=404)
         if type == 'file':
             obj = get_object_or_404(File, id=id)
-            perm, created = Permission.objects.update_or_create(user=target_user, file=obj, defaults={'access_level': access_level})
         else:
             obj = get_object_or_404(Folder, id=id)
-            perm, created = Permission.objects.update_or_create(user=target_user, folder=obj, defaults={'access_level': access_level})
-        if obj.owner != user and not user.is_superuser:
+        if not policy_for(request).can_manage(obj):
             return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
+        if type == 'file':
+            Permission.objects.update_or_create(user=target_user, file=obj, defaults={'access_level': access_level})
+        else:
+            Permission.objects.update_or_create(user=target_user, folder=obj, defaults={'access_level': access_level})
         return JsonResponse({'status': 'success', 'user': username, 'access_level': access_level})
 
 @method_decorator(require_POST, name='dispatch')
 class ShareRemoveUserView(LoginRequiredMixin, View):
     def post(self, request, type, id):
-        user = request.user
         username = request.POST.get('username')
         target_user = User.objects.filter(username=username).first()
         if not target_user:
@@ -773,7 +881,7 @@ class ShareRemoveUserView(LoginRequiredMixin, View):
         else:
             obj = get_object_or_404(Folder, id=id)
             perm = Permission.objects.filter(user=target_user, folder=obj)
-        if obj.owner != user and not user.is_superuser:
+        if not policy_for(request).can_manage(obj):
             return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
         perm.delete()
         return JsonResponse({'status': 'success', 'user': username})